@@ -49,6 +49,10 @@ from comps.cores.mega.constants import MegaServiceEndpoint, ServiceRoleType, Ser
 
 # Microservice
 from comps.cores.mega.orchestrator import ServiceOrchestrator
+from comps.cores.mega.context import RequestContext
+from comps.cores.mega.admission import AdmissionController, AdmissionRejected
+from comps.cores.mega.policy import CircuitOpenError, NodePolicy
+from comps.cores.mega.deadline import DeadlineExceeded, within_deadline
 from comps.cores.mega.orchestrator_with_yaml import ServiceOrchestratorWithYaml
 from comps.cores.mega.micro_service import MicroService, register_microservice, opea_microservices
 
@@ -57,6 +61,7 @@ from comps.cores.telemetry.opea_telemetry import opea_telemetry
 
 # Common
 from comps.cores.common.component import OpeaComponent, OpeaComponentRegistry, OpeaComponentLoader
+from comps.cores.common.cache import CollectionGenerations, EmbeddingCache, LRUTTLCache, SemanticAnswerCache
 
 # Statistics
 from comps.cores.mega.base_statistics import statistics_dict, register_statistics
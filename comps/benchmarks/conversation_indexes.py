@@ -0,0 +1,146 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+"""List and history latency of the conversation endpoints on a large MongoDB database.
+
+Seeds two databases with the same conversations against a live MongoDB:
+  - before: the former layout, whole history embedded in every conversation document and no
+    secondary index, queried the way ConversationRAGService used to (full documents, skip/limit
+    sorted on last_updated, count_documents on every page, find_one on conversation_id)
+  - after:  the append-only layout with the indexes bootstrapped by ConversationStore, queried
+    through it (summary projection, cached estimated count, latest turns of one conversation)
+
+Seeding 1M conversations takes a few minutes and about 1 GB per database, use --conversations to
+scale down. Seeded databases are reused by later runs unless --reseed is passed.
+
+Usage:
+    PYTHONPATH=<path/to/project_dir>:<path/to/project_dir>/comps python comps/benchmarks/conversation_indexes.py \\
+        --mongo-uri mongodb://localhost:27017 --conversations 1000000
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pymongo
+from conversation_store import CONVERSATIONS_COLLECTION, TURNS_COLLECTION, ConversationStore
+from motor.motor_asyncio import AsyncIOMotorClient
+
+BEFORE_DB = "conversation_bench_before"
+AFTER_DB = "conversation_bench_after"
+
+
+def make_turn(i: int, seq: int, start: datetime) -> dict:
+    return {
+        "question": f"question {seq} of conversation {i}",
+        "answer": "answer " * 60,
+        "sources": [{"source": f"doc{k}.pdf", "content": "chunk " * 40, "relevance_score": 0.5} for k in range(3)],
+        "timestamp": start + timedelta(seconds=seq),
+    }
+
+
+def seed(client, args):
+    before = client[BEFORE_DB][CONVERSATIONS_COLLECTION]
+    after = client[AFTER_DB][CONVERSATIONS_COLLECTION]
+    after_turns = client[AFTER_DB][TURNS_COLLECTION]
+    if not args.reseed and before.estimated_document_count() >= args.conversations:
+        return
+    for collection in (before, after, after_turns):
+        collection.drop()
+
+    start = time.perf_counter()
+    origin = datetime(2024, 1, 1)
+    for offset in range(0, args.conversations, args.batch_size):
+        legacy, meta, turns = [], [], []
+        for i in range(offset, min(offset + args.batch_size, args.conversations)):
+            created = origin + timedelta(minutes=i)
+            history = [make_turn(i, seq, created) for seq in range(args.turns)]
+            common = {
+                "conversation_id": f"conv-{i:08d}",
+                "created_at": created,
+                "last_updated": history[-1]["timestamp"],
+            }
+            legacy.append({**common, "history": history})
+            meta.append(
+                {
+                    **common,
+                    "turn_count": len(history),
+                    "title": history[0]["question"],
+                    "last_question": history[-1]["question"],
+                }
+            )
+            turns.extend(
+                {**turn, "conversation_id": common["conversation_id"], "seq": seq} for seq, turn in enumerate(history)
+            )
+        before.insert_many(legacy, ordered=False)
+        after.insert_many(meta, ordered=False)
+        after_turns.insert_many(turns, ordered=False)
+        print(f"seeded {offset + len(legacy)} conversations ({time.perf_counter() - start:.0f}s)", end="\r")
+    print()
+
+
+async def timed(func, iterations: int):
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await func()
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1000
+    return np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+
+async def run(args):
+    client = AsyncIOMotorClient(args.mongo_uri)
+    before = client[BEFORE_DB][CONVERSATIONS_COLLECTION]
+    store = ConversationStore(client)
+    # bootstrap the indexes of the "after" database before measuring
+    await store.collections(AFTER_DB)
+
+    def random_id():
+        return f"conv-{random.randrange(args.conversations):08d}"
+
+    async def list_before(skip):
+        await before.find({}, {"_id": 0}).sort("last_updated", -1).skip(skip).limit(10).to_list(length=10)
+        await before.count_documents({})
+
+    async def list_after(skip):
+        await store.list_conversations(AFTER_DB, skip=skip, limit=10)
+        await store.count_conversations(AFTER_DB)
+
+    async def history_before():
+        await before.find_one({"conversation_id": random_id()}, {"_id": 0})
+
+    async def history_after():
+        conversation_id = random_id()
+        await store.get_conversation(AFTER_DB, conversation_id)
+        await store.get_turns(AFTER_DB, conversation_id, limit=args.history_limit)
+
+    print(f"{'query':<24} {'before p50 ms':>14} {'before p99 ms':>14} {'after p50 ms':>13} {'after p99 ms':>13}")
+    cases = [
+        (f"list page (skip={skip})", lambda s=skip: list_before(s), lambda s=skip: list_after(s)) for skip in (0, 1000)
+    ]
+    cases.append(("history", history_before, history_after))
+    for name, before_func, after_func in cases:
+        before_p50, before_p99 = await timed(before_func, args.iterations)
+        after_p50, after_p99 = await timed(after_func, args.iterations)
+        print(f"{name:<24} {before_p50:>14.1f} {before_p99:>14.1f} {after_p50:>13.1f} {after_p99:>13.1f}")
+    client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--conversations", type=int, default=1_000_000)
+    parser.add_argument("--turns", type=int, default=6, help="turns per conversation")
+    parser.add_argument("--history-limit", type=int, default=20, help="turns fetched per history request (after)")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--reseed", action="store_true", help="drop and seed the databases even if they exist")
+    args = parser.parse_args()
+
+    setup = pymongo.MongoClient(args.mongo_uri)
+    seed(setup, args)
+    setup.close()
+    asyncio.run(run(args))
@@ -0,0 +1,105 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+"""Microbenchmark of the per-request scheduling overhead of ServiceOrchestrator.
+
+For graphs of 4, 20 and 100 nodes it reports, per request:
+  - legacy: graph bookkeeping of the former scheduler (deepcopy of the graph, full-graph
+    predecessor scans and topological sorts for the final pruning)
+  - plan:   the same traversal on a copy-on-write overlay of the compiled ExecutionPlan
+  - schedule: a full `ServiceOrchestrator.schedule` call with a no-op `execute`, i.e. the
+    remaining asyncio task overhead on top of the plan
+
+Usage:
+    PYTHONPATH=<path/to/project_dir> python comps/benchmarks/dag_schedule.py --iterations 2000
+"""
+
+import argparse
+import asyncio
+import copy
+import time
+
+from comps import MicroService, ServiceOrchestrator, ServiceType
+from comps.cores.mega.dag import DAG
+
+
+class NoopOrchestrator(ServiceOrchestrator):
+    async def execute(self, session, req_start, cur_node, inputs, runtime_graph, llm_parameters=None, **kwargs):
+        return {}, cur_node
+
+
+def build_orchestrator(num_nodes: int, width: int) -> NoopOrchestrator:
+    orchestrator = NoopOrchestrator()
+    services = []
+    for i in range(num_nodes):
+        service = MicroService(
+            name=f"node{i}", host="127.0.0.1", port=9, use_remote_service=True, service_type=ServiceType.UNDEFINED
+        )
+        orchestrator.add(service)
+        services.append(service)
+    # layered graph: every node feeds the nodes of the next layer at the same and the next position
+    for i in range(num_nodes):
+        for j in (i + width, i + width + 1):
+            if j < num_nodes and (j // width) == (i // width) + 1:
+                orchestrator.flow_to(services[i], services[j])
+    return orchestrator
+
+
+def traverse(runtime_graph):
+    done = set()
+    ready = list(runtime_graph.ind_nodes())
+    while ready:
+        node = ready.pop()
+        done.add(node)
+        for d_node in runtime_graph.downstream(node):
+            if d_node not in done and all(i in done for i in runtime_graph.predecessors(d_node)):
+                ready.append(d_node)
+    return done
+
+
+def legacy_request(orchestrator):
+    runtime_graph = DAG()
+    runtime_graph.graph = copy.deepcopy(orchestrator.graph)
+    ind_nodes = runtime_graph.ind_nodes()
+    traverse(runtime_graph)
+    nodes_to_keep = []
+    for i in ind_nodes:
+        nodes_to_keep.append(i)
+        nodes_to_keep.extend(runtime_graph.all_downstreams(i))
+
+
+def plan_request(orchestrator):
+    runtime_graph = orchestrator.compile().overlay()
+    traverse(runtime_graph)
+
+
+def timeit(func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+async def time_schedule(orchestrator, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await orchestrator.schedule(initial_inputs={"text": "hello"})
+    elapsed = time.perf_counter() - start
+    await orchestrator.close()
+    return elapsed / iterations * 1e6
+
+
+def main(args):
+    print(f"{'nodes':>6} {'legacy us':>11} {'plan us':>9} {'speedup':>8} {'schedule us':>12}")
+    for num_nodes in args.nodes:
+        orchestrator = build_orchestrator(num_nodes, width=1 if num_nodes <= 4 else 4)
+        legacy = timeit(lambda: legacy_request(orchestrator), args.iterations)
+        plan = timeit(lambda: plan_request(orchestrator), args.iterations)
+        schedule = asyncio.run(time_schedule(orchestrator, args.iterations))
+        print(f"{num_nodes:>6} {legacy:>11.1f} {plan:>9.1f} {legacy / plan:>7.1f}x {schedule:>12.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, nargs="+", default=[4, 20, 100])
+    parser.add_argument("--iterations", type=int, default=2000)
+    main(parser.parse_args())
@@ -0,0 +1,130 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+"""Serialization CPU per request of the standard library codec and the HTTPService fast JSON codec.
+
+Encodes and decodes the payloads that cross the pipeline hops, the way the services do it:
+  - std:  `json.dumps` as rendered by FastAPI `JSONResponse` and sent by aiohttp, `json.loads` as
+          parsed by FastAPI and `response.json()`
+  - fast: orjson through `comps.cores.mega.codec` (HTTP_SERVICE_FAST_JSON=true)
+and reports the CPU time per request of each, along with the size and CPU time of the response
+compression (HTTP_SERVICE_COMPRESSION=true) of the non-streaming payloads.
+
+Payloads:
+  - embedding:    TEI /embed reply, one vector of --dim floats
+  - retrieval:    retriever reply, --k docs of --chunk-chars characters with their metadata
+  - conversation: /api/conversations/{id} reply, --turns turns with answers and sources
+
+Usage:
+    PYTHONPATH=<path/to/project_dir> python comps/benchmarks/json_codec.py --iterations 2000
+"""
+
+import argparse
+import gzip
+import json
+import random
+import string
+import time
+from datetime import datetime, timedelta
+
+from comps.cores.mega.codec import brotli, fast_json_available, json_dumps, json_loads
+
+
+# vocabulary of the generated documents, prose compresses about as well as this
+VOCABULARY = ["".join(random.Random(i).choices(string.ascii_lowercase, k=2 + i % 8)) for i in range(2000)]
+
+
+def text(chars: int) -> str:
+    words = random.choices(VOCABULARY, weights=[1 / (rank + 1) for rank in range(len(VOCABULARY))], k=chars // 4)
+    return " ".join(words)[:chars]
+
+
+def make_payloads(args):
+    embedding = [[random.uniform(-1, 1) for _ in range(args.dim)]]
+    retrieval = {
+        "id": "9a3f",
+        "initial_query": "What is the warranty period of the product?",
+        "retrieved_docs": [{"id": f"doc-{i}", "text": text(args.chunk_chars)} for i in range(args.k)],
+        "metadata": [
+            {"file_path": f"./uploaded_files/manual_{i % 4}.pdf", "file_name": f"manual_{i % 4}.pdf", "token_count": 350}
+            for i in range(args.k)
+        ],
+    }
+    start = datetime(2024, 1, 1)
+    conversation = {
+        "conversation_id": "conv-00000001",
+        "created_at": start.isoformat(),
+        "history": [
+            {
+                "question": text(80),
+                "answer": text(1200),
+                "sources": [
+                    {"source": f"manual_{k}.pdf", "content": text(args.chunk_chars), "relevance_score": 0.8}
+                    for k in range(3)
+                ],
+                "metrics": {"ttft": 0.21, "e2e_latency": 3.4, "output_tokens": 280, "throughput": 88.1},
+                "timestamp": (start + timedelta(minutes=seq)).isoformat(),
+            }
+            for seq in range(args.turns)
+        ],
+    }
+    return {"embedding": embedding, "retrieval": retrieval, "conversation": conversation}
+
+
+def std_dumps(obj) -> bytes:
+    # JSONResponse.render
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def cpu_per_call(func, arg, iterations: int) -> float:
+    start = time.process_time()
+    for _ in range(iterations):
+        func(arg)
+    return (time.process_time() - start) / iterations * 1e6
+
+
+def main(args):
+    if not fast_json_available():
+        raise SystemExit("orjson is not installed, the fast codec would fall back to the standard library")
+    random.seed(0)
+    payloads = make_payloads(args)
+
+    print(
+        f"{'payload':<14} {'bytes':>9} {'std enc us':>11} {'fast enc us':>12} {'std dec us':>11} {'fast dec us':>12}"
+        f" {'saved us/hop':>13}"
+    )
+    for name, payload in payloads.items():
+        body = std_dumps(payload)
+        std_enc = cpu_per_call(std_dumps, payload, args.iterations)
+        fast_enc = cpu_per_call(json_dumps, payload, args.iterations)
+        std_dec = cpu_per_call(json.loads, body, args.iterations)
+        fast_dec = cpu_per_call(json_loads, body, args.iterations)
+        # every hop encodes the payload once and decodes it once
+        saved = std_enc + std_dec - fast_enc - fast_dec
+        print(
+            f"{name:<14} {len(body):>9} {std_enc:>11.1f} {fast_enc:>12.1f} {std_dec:>11.1f} {fast_dec:>12.1f}"
+            f" {saved:>13.1f}"
+        )
+
+    print()
+    print(f"{'payload':<14} {'encoding':<9} {'bytes':>9} {'ratio':>7} {'cpu us':>9}")
+    compressors = [("gzip", lambda body: gzip.compress(body, compresslevel=args.gzip_level))]
+    if brotli is not None:
+        compressors.append(("br", lambda body: brotli.compress(body, quality=args.brotli_quality)))
+    for name in ("retrieval", "conversation"):
+        body = json_dumps(payloads[name])
+        for encoding, compress in compressors:
+            compressed = compress(body)
+            cpu = cpu_per_call(compress, body, max(args.iterations // 10, 1))
+            print(f"{name:<14} {encoding:<9} {len(compressed):>9} {len(body) / len(compressed):>7.1f} {cpu:>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--dim", type=int, default=1024, help="embedding dimension")
+    parser.add_argument("--k", type=int, default=20, help="retrieved docs")
+    parser.add_argument("--chunk-chars", type=int, default=1500)
+    parser.add_argument("--turns", type=int, default=20, help="turns of the conversation history")
+    parser.add_argument("--gzip-level", type=int, default=6)
+    parser.add_argument("--brotli-quality", type=int, default=4)
+    main(parser.parse_args())
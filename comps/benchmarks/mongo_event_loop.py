@@ -0,0 +1,114 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+"""Load test of the conversation persistence path against a live MongoDB.
+
+Concurrent writers run the per-turn Mongo work of ConversationRAGService (find_one + update_one)
+with either the synchronous pymongo client, as the service used to, or the motor client from
+`comps/mongo_client.py`. Meanwhile a probe issues a trivial request every few milliseconds on the
+same event loop and records its latency, i.e. what any other request served by the process sees.
+
+Server side latency is injected with a JavaScript `sleep` in the lookup filter (needs server-side
+scripting enabled, the default for mongod). With pymongo the probe p99 follows the Mongo latency,
+with motor it stays flat.
+
+Usage:
+    python comps/benchmarks/mongo_event_loop.py \\
+        --mongo-uri mongodb://localhost:27017 --writers 32 --mongo-delay-ms 0 20 50
+"""
+
+import argparse
+import asyncio
+import time
+
+import numpy as np
+import pymongo
+from motor.motor_asyncio import AsyncIOMotorClient
+
+DB_NAME = "conversation_loadtest"
+
+
+def delayed_filter(conversation_id: str, delay_ms: int) -> dict:
+    query = {"conversation_id": conversation_id}
+    if delay_ms:
+        query["$where"] = f"sleep({delay_ms}) || true"
+    return query
+
+
+async def probe(stop: asyncio.Event, interval: float, latencies: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        # lateness beyond the requested sleep is the time spent waiting for a blocked loop
+        latencies.append(time.perf_counter() - start - interval)
+
+
+async def sync_writer(collection, conversation_id: str, delay_ms: int, stop: asyncio.Event, op_latencies: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        collection.find_one(delayed_filter(conversation_id, delay_ms))
+        collection.update_one({"conversation_id": conversation_id}, {"$set": {"last_updated": time.time()}})
+        op_latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0)
+
+
+async def async_writer(collection, conversation_id: str, delay_ms: int, stop: asyncio.Event, op_latencies: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await collection.find_one(delayed_filter(conversation_id, delay_ms))
+        await collection.update_one({"conversation_id": conversation_id}, {"$set": {"last_updated": time.time()}})
+        op_latencies.append(time.perf_counter() - start)
+
+
+async def run_case(driver: str, args, delay_ms: int):
+    if driver == "pymongo":
+        client = pymongo.MongoClient(args.mongo_uri, maxPoolSize=args.writers)
+        writer = sync_writer
+    else:
+        client = AsyncIOMotorClient(args.mongo_uri, maxPoolSize=args.writers)
+        writer = async_writer
+    collection = client[DB_NAME]["conversations"]
+
+    stop = asyncio.Event()
+    probe_latencies, op_latencies = [], []
+    tasks = [asyncio.create_task(probe(stop, args.probe_interval / 1000, probe_latencies))]
+    tasks += [
+        asyncio.create_task(writer(collection, f"conv-{i}", delay_ms, stop, op_latencies)) for i in range(args.writers)
+    ]
+    await asyncio.sleep(args.duration)
+    stop.set()
+    await asyncio.gather(*tasks)
+    client.close()
+
+    probe_ms = np.array(probe_latencies) * 1000
+    ops_ms = np.array(op_latencies) * 1000
+    print(
+        f"{driver:>8} {delay_ms:>9} {len(op_latencies) / args.duration:>8.0f} {np.percentile(ops_ms, 99):>11.1f}"
+        f" {np.percentile(probe_ms, 50):>13.2f} {np.percentile(probe_ms, 99):>13.2f}"
+    )
+
+
+async def main(args):
+    setup = pymongo.MongoClient(args.mongo_uri)
+    collection = setup[DB_NAME]["conversations"]
+    collection.drop()
+    collection.create_index("conversation_id", unique=True)
+    collection.insert_many([{"conversation_id": f"conv-{i}", "history": []} for i in range(args.writers)])
+
+    print(f"{'driver':>8} {'delay ms':>9} {'ops/s':>8} {'op p99 ms':>11} {'probe p50 ms':>13} {'probe p99 ms':>13}")
+    try:
+        for delay_ms in args.mongo_delay_ms:
+            for driver in ("pymongo", "motor"):
+                await run_case(driver, args, delay_ms)
+    finally:
+        setup.drop_database(DB_NAME)
+        setup.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--writers", type=int, default=32)
+    parser.add_argument("--mongo-delay-ms", type=int, nargs="+", default=[0, 20, 50])
+    parser.add_argument("--probe-interval", type=float, default=5, help="milliseconds between probe requests")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per case")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,104 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+"""Concurrency benchmark for the orchestrator LLM streaming path.
+
+Starts a fake OpenAI-compatible streaming LLM in a separate thread, then runs N concurrent
+`ServiceOrchestrator.schedule` streams for every concurrency level and reports the time to
+first token (TTFT). With a non-blocking streaming path TTFT stays close to the configured
+first-token delay regardless of the number of concurrent streams. Streams beyond
+ORCHESTRATOR_HTTP_POOL_LIMIT_PER_HOST wait for a pooled connection, raise it to measure higher levels.
+
+Usage:
+    PYTHONPATH=<path/to/project_dir> python comps/benchmarks/stream_ttft.py --concurrency 1 8 32 64
+"""
+
+import argparse
+import asyncio
+import json
+import threading
+import time
+
+import numpy as np
+from aiohttp import web
+
+from comps import MicroService, ServiceOrchestrator, ServiceType
+from comps.cores.proto.docarray import LLMParams
+
+
+def start_fake_llm(port: int, first_token_delay: float, token_interval: float, num_tokens: int):
+    async def completions(request):
+        await request.json()
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await asyncio.sleep(first_token_delay)
+        for i in range(num_tokens):
+            chunk = {"choices": [{"delta": {"content": f" tok{i}"}, "finish_reason": None}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            await asyncio.sleep(token_interval)
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    ready = threading.Event()
+
+    def run():
+        loop = asyncio.new_event_loop()
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", completions)
+        runner = web.AppRunner(app)
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", port).start())
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+
+
+async def one_stream(orchestrator: ServiceOrchestrator) -> float:
+    start = time.perf_counter()
+    result_dict, _ = await orchestrator.schedule(
+        initial_inputs={"messages": [{"role": "user", "content": "hello"}]},
+        llm_parameters=LLMParams(stream=True, max_tokens=32),
+    )
+    response = next(iter(result_dict.values()))
+    ttft = None
+    async for _ in response.body_iterator:
+        if ttft is None:
+            ttft = time.perf_counter() - start
+    return ttft
+
+
+async def run(args):
+    orchestrator = ServiceOrchestrator()
+    orchestrator.add(
+        MicroService(
+            name="llm",
+            host="127.0.0.1",
+            port=args.port,
+            endpoint="/v1/chat/completions",
+            use_remote_service=True,
+            service_type=ServiceType.LLM,
+        )
+    )
+    print(f"first token delay: {args.first_token_delay * 1000:.0f} ms")
+    print(f"{'streams':>8} {'p50 ttft ms':>12} {'p99 ttft ms':>12} {'max ttft ms':>12}")
+    for concurrency in args.concurrency:
+        ttfts = await asyncio.gather(*(one_stream(orchestrator) for _ in range(concurrency)))
+        ttfts = np.array(ttfts) * 1000
+        print(
+            f"{concurrency:>8} {np.percentile(ttfts, 50):>12.1f} {np.percentile(ttfts, 99):>12.1f} {ttfts.max():>12.1f}"
+        )
+    await orchestrator.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--port", type=int, default=18500)
+    parser.add_argument("--first-token-delay", type=float, default=0.2)
+    parser.add_argument("--token-interval", type=float, default=0.01)
+    parser.add_argument("--num-tokens", type=int, default=32)
+    args = parser.parse_args()
+
+    start_fake_llm(args.port, args.first_token_delay, args.token_interval, args.num_tokens)
+    asyncio.run(run(args))
@@ -0,0 +1,101 @@
+"""Token budgeted packing of the retrieved chunks into the prompt context.
+
+Chunks are taken in retrieval or rerank order and packed until the token budget of the context is
+spent. Their token counts come from the `token_count` stored in the Qdrant payload at ingestion, so
+nothing is tokenized at query time. Chunks ingested before the counts were stored are estimated
+from their length.
+
+Chunks repeating text already packed are dropped: exact duplicates, as well as chunks mostly
+contained in a packed one or overlapping its start or end, as produced by the `chunk_overlap` of
+the text splitter.
+"""
+
+import math
+import os
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+# tokens of retrieved text allowed in the prompt, the template and the question come on top
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 2048))
+# a chunk whose text is covered by packed chunks for at least this fraction is dropped
+CONTEXT_OVERLAP_THRESHOLD = float(os.getenv("CONTEXT_OVERLAP_THRESHOLD", 0.5))
+# estimate for chunks without a stored token count, about right for English with cl100k_base
+CHARS_PER_TOKEN = 4
+# length of the chunk start looked up in the packed chunks to find boundary overlaps
+OVERLAP_PROBE_CHARS = 32
+
+
+class PackedContext(NamedTuple):
+    # positions of the packed chunks in the candidates, in packing order
+    indices: List[int]
+    tokens: int
+    duplicates: int
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.split())
+
+
+def boundary_overlap(head: str, tail: str) -> int:
+    """Length of the longest end of `head` that is also the start of `tail`."""
+    probe = tail[:OVERLAP_PROBE_CHARS]
+    if not probe:
+        return 0
+    # try the earliest position first, it gives the longest overlap
+    start = max(len(head) - len(tail), 0)
+    pos = head.find(probe, start)
+    while pos != -1:
+        if tail.startswith(head[pos:]):
+            return len(head) - pos
+        pos = head.find(probe, pos + 1)
+    return 0
+
+
+def covered_fraction(text: str, packed: Sequence[str]) -> float:
+    """Largest fraction of `text` found in a single packed chunk, whole or across a boundary."""
+    best = 0
+    for other in packed:
+        if text in other:
+            return 1.0
+        best = max(best, boundary_overlap(other, text), boundary_overlap(text, other))
+    return best / len(text)
+
+
+def pack_context(
+    chunks: Sequence[Tuple[str, Optional[int]]],
+    budget: int = CONTEXT_TOKEN_BUDGET,
+    limit: Optional[int] = None,
+) -> PackedContext:
+    """Select the chunks of the prompt context.
+
+    Args:
+        chunks: (text, token count) of the candidates in decreasing relevance, the count is None
+            when it was not stored at ingestion.
+        budget: tokens of retrieved text allowed in the prompt.
+        limit: maximum number of chunks, e.g. the `top_n` of the reranker.
+
+    A chunk that does not fit in what is left of the budget is skipped, a shorter one further down
+    may still fit.
+    """
+    indices, packed, seen = [], [], set()
+    tokens = duplicates = 0
+    for i, (text, token_count) in enumerate(chunks):
+        if limit is not None and len(indices) >= limit:
+            break
+        normalized = normalize(text)
+        if not normalized:
+            continue
+        if normalized in seen or covered_fraction(normalized, packed) >= CONTEXT_OVERLAP_THRESHOLD:
+            duplicates += 1
+            continue
+        count = token_count if token_count is not None else estimate_tokens(text)
+        if tokens + count > budget:
+            continue
+        indices.append(i)
+        packed.append(normalized)
+        seen.add(normalized)
+        tokens += count
+    return PackedContext(indices, tokens, duplicates)
@@ -0,0 +1,448 @@
+"""Append-only conversation storage on MongoDB.
+
+Every conversation is one small document in `conversations`:
+    {conversation_id, created_at, last_updated, turn_count, title, last_question}
+and every turn is its own document in `conversation_turns`:
+    {conversation_id, seq, question, answer, sources, metrics, timestamp}
+so saving a turn costs the size of that turn, whatever the length of the conversation.
+
+Conversations written by earlier versions embed all turns in a `history` array and store their
+dates as ISO strings. They are migrated on first access, all at once in the background after the
+first summary page of a database is requested, or ahead of time with:
+    python conversation_store.py migrate --db-name rag_db
+Summary pages only list the conversations migrated already.
+"""
+
+import argparse
+import asyncio
+import base64
+import binascii
+import json
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import OperationFailure
+
+from comps import LRUTTLCache
+from comps.cores.common.cache import estimate_size
+
+CONVERSATIONS_COLLECTION = "conversations"
+TURNS_COLLECTION = "conversation_turns"
+TITLE_MAX_CHARS = 100
+# the conversation list only needs the summary fields, never the embedded history of legacy documents
+LIST_PROJECTION = {"_id": 0, "history": 0}
+SUMMARY_PROJECTION = {
+    "_id": 0,
+    "conversation_id": 1,
+    "title": 1,
+    "last_question": 1,
+    "created_at": 1,
+    "last_updated": 1,
+    "turn_count": 1,
+}
+
+CONVERSATION_INDEXES = [
+    IndexModel([("conversation_id", ASCENDING)], unique=True, name="conversation_id_unique"),
+    # serves the list sort and its (last_updated, conversation_id) tie-break
+    IndexModel([("last_updated", DESCENDING), ("conversation_id", DESCENDING)], name="last_updated_desc"),
+]
+TURN_INDEXES = [
+    IndexModel([("conversation_id", ASCENDING), ("seq", DESCENDING)], unique=True, name="conversation_seq_unique"),
+]
+
+
+def _as_datetime(value):
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            return value
+    return value
+
+
+class InvalidCursor(ValueError):
+    """Raised for a list cursor that was not produced by `encode_cursor`."""
+
+
+def encode_cursor(last_updated: datetime, conversation_id: str) -> str:
+    """Opaque keyset cursor pointing after the given (last_updated, conversation_id)."""
+    payload = json.dumps([last_updated.isoformat(), conversation_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        last_updated, conversation_id = json.loads(payload)
+        return datetime.fromisoformat(last_updated), str(conversation_id)
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+
+
+def _title(question: Optional[str]) -> Optional[str]:
+    if not question:
+        return None
+    return question if len(question) <= TITLE_MAX_CHARS else question[: TITLE_MAX_CHARS - 3] + "..."
+
+
+class ConversationCache(LRUTTLCache):
+    """Bounded in-process cache of the latest turns of active conversations.
+
+    Conversations are evicted least recently used first once any budget is exceeded: number of
+    conversations, total turns or estimated bytes; idle ones expire after `idle_ttl` seconds.
+    Only the latest `max_turns_per_conversation` turns of a conversation are kept, a miss is
+    served from Mongo by the caller.
+    """
+
+    def __init__(
+        self,
+        max_conversations: int = 1000,
+        max_turns: int = 20000,
+        max_bytes: Optional[int] = 64 * 1024 * 1024,
+        idle_ttl: Optional[float] = 1800,
+        max_turns_per_conversation: int = 50,
+    ):
+        self.max_turns = max_turns
+        self.max_turns_per_conversation = max_turns_per_conversation
+        self.total_turns = 0
+        super().__init__(
+            "conversation",
+            max_entries=max_conversations,
+            max_bytes=max_bytes,
+            ttl=idle_ttl,
+            sliding=True,
+            sizeof=lambda turns: sum(estimate_size(turn) for turn in turns),
+        )
+
+    @classmethod
+    def from_env(cls) -> "ConversationCache":
+        return cls(
+            max_conversations=int(os.getenv("CONVERSATION_CACHE_MAX_CONVERSATIONS", 1000)),
+            max_turns=int(os.getenv("CONVERSATION_CACHE_MAX_TURNS", 20000)),
+            max_bytes=int(float(os.getenv("CONVERSATION_CACHE_MAX_MB", 64)) * 1024 * 1024),
+            idle_ttl=float(os.getenv("CONVERSATION_CACHE_IDLE_TTL", 1800)),
+            max_turns_per_conversation=int(os.getenv("CONVERSATION_CACHE_MAX_TURNS_PER_CONVERSATION", 50)),
+        )
+
+    def set(self, key, turns: List[Dict], size: Optional[int] = None):
+        turns = list(turns[-self.max_turns_per_conversation :]) if self.max_turns_per_conversation else []
+        size = self.sizeof(turns) if size is None else size
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        self.pop(key)
+        self.total_turns += len(turns)
+        super().set(key, turns, size)
+
+    def append(self, key, turn: Dict) -> bool:
+        """Add a turn to a cached conversation, returns False when the conversation is not cached."""
+        turns = self.get(key, count=False)
+        if turns is None:
+            return False
+        turns = turns + [turn]
+        size = self._data[key][1] + estimate_size(turn)
+        overflow = len(turns) - self.max_turns_per_conversation
+        if overflow > 0:
+            size -= self.sizeof(turns[:overflow])
+            turns = turns[overflow:]
+        self.set(key, turns, size)
+        return True
+
+    def pop(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is not None:
+            self.total_turns -= len(entry[0])
+        return super().pop(key, default)
+
+    def clear(self):
+        super().clear()
+        self.total_turns = 0
+
+    def stats(self) -> dict:
+        return {**super().stats(), "turns": self.total_turns}
+
+    def _evict(self, key, reason: str):
+        self.total_turns -= len(self._data[key][0])
+        super()._evict(key, reason)
+
+    def _shrink(self):
+        super()._shrink()
+        while self.total_turns > self.max_turns and self._data:
+            self._evict(next(iter(self._data)), "turns")
+
+
+class ConversationStore:
+    """Conversation metadata and turns of every tenant database (`db_name`) of a Mongo client."""
+
+    def __init__(self, client, count_ttl: float = 30):
+        self.client = client
+        self._indexed = {}  # db_name -> index bootstrap task
+        self._migrated = {}  # db_name -> legacy conversations migration task
+        self._counts = LRUTTLCache("conversation_count", max_entries=1024, ttl=count_ttl)
+
+    async def collections(self, db_name: str):
+        """Return the (conversations, turns) collections of `db_name`, ensuring their indexes on first use."""
+        task = self._indexed.get(db_name)
+        if task is None:
+            task = self._indexed[db_name] = asyncio.ensure_future(self._ensure_indexes(db_name))
+        if not task.done() or task.exception() is not None:
+            try:
+                await asyncio.shield(task)
+            except Exception as e:
+                # e.g. Mongo unreachable, retried on the next use
+                print(f"Failed to create indexes on {db_name}: {e}")
+                if self._indexed.get(db_name) is task:
+                    del self._indexed[db_name]
+        db = self.client[db_name]
+        return db[CONVERSATIONS_COLLECTION], db[TURNS_COLLECTION]
+
+    async def _ensure_indexes(self, db_name: str) -> None:
+        db = self.client[db_name]
+        for collection, indexes in ((CONVERSATIONS_COLLECTION, CONVERSATION_INDEXES), (TURNS_COLLECTION, TURN_INDEXES)):
+            try:
+                # a no-op when the indexes exist, runs once per db_name and process
+                await db[collection].create_indexes(indexes)
+            except OperationFailure as e:
+                # e.g. duplicated conversation ids in old data, keep serving without the index
+                print(f"Failed to create indexes on {db_name}.{collection}: {e}")
+
+    def _start_migration(self, db_name: str) -> None:
+        """Migrate the legacy conversations of `db_name` in the background, once per process.
+
+        Detached, a large legacy database must not hold up the request that triggered it.
+        """
+        if db_name not in self._migrated:
+            self._migrated[db_name] = asyncio.ensure_future(self._migrate_in_background(db_name))
+
+    async def _migrate_in_background(self, db_name: str) -> None:
+        try:
+            migrated = await self.migrate_all(db_name)
+            if migrated:
+                print(f"Migrated {migrated} legacy conversations of {db_name}")
+        except Exception as e:
+            # retried on the next summary page
+            print(f"Failed to migrate the conversations of {db_name}: {e}")
+            del self._migrated[db_name]
+
+    async def list_conversations(self, db_name: str, skip: int = 0, limit: int = 10) -> List[Dict]:
+        """Return a page of conversation summaries, most recently updated first."""
+        conversations, _ = await self.collections(db_name)
+        cursor = (
+            conversations.find({}, LIST_PROJECTION)
+            .sort([("last_updated", DESCENDING), ("conversation_id", DESCENDING)])
+            .skip(skip)
+            .limit(limit)
+        )
+        return await cursor.to_list(length=limit)
+
+    async def list_conversation_summaries(
+        self, db_name: str, limit: int = 20, cursor: Optional[str] = None
+    ) -> Tuple[List[Dict], Optional[str]]:
+        """Return a page of conversation summaries, most recently updated first, and the cursor of the next page.
+
+        Keyset pagination on (last_updated, conversation_id): every page is a range scan on the
+        list index, so page N costs the same as the first one. The next cursor is None on the last page.
+        """
+        conversations, _ = await self.collections(db_name)
+        self._start_migration(db_name)
+        # string dates of legacy conversations not migrated yet would sort apart from the others and
+        # never match the keyset range, they are left out
+        query = {"last_updated": {"$type": "date"}}
+        if cursor:
+            last_updated, conversation_id = decode_cursor(cursor)
+            query["$or"] = [
+                {"last_updated": {"$lt": last_updated}},
+                {"last_updated": last_updated, "conversation_id": {"$lt": conversation_id}},
+            ]
+        docs = await (
+            conversations.find(query, SUMMARY_PROJECTION)
+            .sort([("last_updated", DESCENDING), ("conversation_id", DESCENDING)])
+            .limit(limit + 1)
+            .to_list(length=limit + 1)
+        )
+        next_cursor = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            last = docs[-1]
+            next_cursor = encode_cursor(last["last_updated"], last["conversation_id"])
+        for doc in docs:
+            doc.setdefault("title", doc.get("last_question"))
+        return docs, next_cursor
+
+    async def count_conversations(self, db_name: str) -> int:
+        """Approximate number of conversations, from collection metadata and cached for `count_ttl` seconds."""
+        count = self._counts.get(db_name)
+        if count is None:
+            conversations, _ = await self.collections(db_name)
+            count = await conversations.estimated_document_count()
+            self._counts.set(db_name, count)
+        return count
+
+    async def create_conversation(self, db_name: str, conversation_id: str) -> None:
+        conversations, _ = await self.collections(db_name)
+        now = datetime.now()
+        await conversations.insert_one(
+            {"conversation_id": conversation_id, "created_at": now, "last_updated": now, "turn_count": 0}
+        )
+
+    async def get_conversation(self, db_name: str, conversation_id: str) -> Optional[Dict]:
+        """Return the conversation metadata, None if it does not exist."""
+        conversations, _ = await self.collections(db_name)
+        conversation = await conversations.find_one(
+            {"conversation_id": conversation_id}, {"_id": 0, "history": {"$slice": 0}}
+        )
+        if conversation is not None and "history" in conversation:
+            conversation = await self.migrate_conversation(db_name, conversation_id)
+        return conversation
+
+    async def append_turn(self, db_name: str, conversation_id: str, turn: Dict) -> int:
+        """Store a new turn at the end of the conversation, creating it if needed, and return its seq."""
+        conversations, turns = await self.collections(db_name)
+        now = datetime.now()
+        conversation = await conversations.find_one_and_update(
+            {"conversation_id": conversation_id},
+            {
+                "$inc": {"turn_count": 1},
+                "$set": {"last_updated": now, "last_question": _title(turn.get("question"))},
+                "$setOnInsert": {"created_at": now},
+            },
+            projection={"_id": 0, "turn_count": 1, "title": 1, "history": {"$slice": 0}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if "history" in conversation:
+            # not migrated yet, the migration resets turn_count so the increment above is discarded
+            await self.migrate_conversation(db_name, conversation_id)
+            return await self.append_turn(db_name, conversation_id, turn)
+
+        seq = conversation["turn_count"] - 1
+        await turns.insert_one({**turn, "conversation_id": conversation_id, "seq": seq})
+        if not conversation.get("title"):
+            await conversations.update_one(
+                {"conversation_id": conversation_id, "title": {"$in": [None, ""]}},
+                {"$set": {"title": _title(turn.get("question"))}},
+            )
+        return seq
+
+    async def get_turns(
+        self, db_name: str, conversation_id: str, limit: Optional[int] = None, before: Optional[int] = None
+    ) -> Tuple[List[Dict], Optional[int]]:
+        """Return the latest `limit` turns (all when None) older than seq `before`, oldest first.
+
+        The second value is the `before` cursor of the next older page, None on the first turn.
+        """
+        _, turns = await self.collections(db_name)
+        query = {"conversation_id": conversation_id}
+        if before is not None:
+            query["seq"] = {"$lt": before}
+        cursor = turns.find(query, {"_id": 0, "conversation_id": 0}).sort("seq", -1)
+        if limit:
+            cursor = cursor.limit(limit + 1)
+        docs = await cursor.to_list(length=None)
+        next_before = None
+        if limit and len(docs) > limit:
+            docs = docs[:limit]
+            next_before = docs[-1]["seq"]
+        docs.reverse()
+        return docs, next_before
+
+    async def delete_conversation(self, db_name: str, conversation_id: str) -> bool:
+        conversations, turns = await self.collections(db_name)
+        result = await conversations.delete_one({"conversation_id": conversation_id})
+        await turns.delete_many({"conversation_id": conversation_id})
+        return result.deleted_count > 0
+
+    async def migrate_conversation(self, db_name: str, conversation_id: str) -> Optional[Dict]:
+        """Move the embedded `history` of a legacy conversation into the turns collection.
+
+        Idempotent and safe to run concurrently, turns are upserted on (conversation_id, seq).
+        Returns the migrated metadata.
+        """
+        conversations, turns = await self.collections(db_name)
+        conversation = await conversations.find_one({"conversation_id": conversation_id}, {"_id": 0})
+        if conversation is None:
+            return None
+        if "history" not in conversation:
+            if isinstance(conversation.get("last_updated"), str):
+                return await self._migrate_dates(db_name, conversation)
+            return conversation
+
+        history = conversation.pop("history") or []
+        if history:
+            await turns.bulk_write(
+                [
+                    UpdateOne(
+                        {"conversation_id": conversation_id, "seq": seq},
+                        {"$setOnInsert": {**turn, "timestamp": _as_datetime(turn.get("timestamp"))}},
+                        upsert=True,
+                    )
+                    for seq, turn in enumerate(history)
+                ],
+                ordered=False,
+            )
+        conversation.update(
+            {
+                "turn_count": len(history),
+                "title": _title(history[0].get("question")) if history else None,
+                "last_question": _title(history[-1].get("question")) if history else None,
+                "created_at": _as_datetime(conversation.get("created_at")) or datetime.now(),
+                # keyset pagination needs a datetime on every document
+                "last_updated": _as_datetime(conversation.get("last_updated"))
+                or _as_datetime(conversation.get("created_at"))
+                or datetime.now(),
+            }
+        )
+        await conversations.update_one(
+            {"conversation_id": conversation_id, "history": {"$exists": True}},
+            {"$set": {k: v for k, v in conversation.items() if k != "conversation_id"}, "$unset": {"history": ""}},
+        )
+        return conversation
+
+    async def _migrate_dates(self, db_name: str, conversation: Dict) -> Dict:
+        """Convert the ISO string dates of a conversation without `history`, backfill its `last_question`."""
+        conversations, turns = await self.collections(db_name)
+        conversation_id = conversation["conversation_id"]
+        update = {
+            "created_at": _as_datetime(conversation.get("created_at")) or datetime.now(),
+            "last_updated": _as_datetime(conversation.get("last_updated")),
+        }
+        if not isinstance(update["last_updated"], datetime):
+            update["last_updated"] = update["created_at"]
+        if not conversation.get("last_question"):
+            last_turn = await turns.find_one(
+                {"conversation_id": conversation_id}, {"question": 1}, sort=[("seq", DESCENDING)]
+            )
+            if last_turn is not None:
+                update["last_question"] = _title(last_turn.get("question"))
+        await conversations.update_one(
+            {"conversation_id": conversation_id, "last_updated": {"$type": "string"}}, {"$set": update}
+        )
+        conversation.update(update)
+        return conversation
+
+    async def migrate_all(self, db_name: str) -> int:
+        """Migrate every legacy conversation of `db_name`, return how many were migrated."""
+        conversations, _ = await self.collections(db_name)
+        migrated = 0
+        legacy = {"$or": [{"history": {"$exists": True}}, {"last_updated": {"$type": "string"}}]}
+        async for doc in conversations.find(legacy, {"conversation_id": 1}):
+            await self.migrate_conversation(db_name, doc["conversation_id"])
+            migrated += 1
+        return migrated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Conversation storage maintenance")
+    parser.add_argument("command", choices=["migrate"])
+    parser.add_argument("--db-name", required=True, nargs="+", help="tenant database(s) to migrate")
+    args = parser.parse_args()
+
+    from mongo_client import create_mongo_client
+
+    async def migrate():
+        store = ConversationStore(create_mongo_client())
+        for db_name in args.db_name:
+            print(f"{db_name}: migrated {await store.migrate_all(db_name)} conversations")
+
+    asyncio.run(migrate())
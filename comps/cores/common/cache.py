@@ -0,0 +1,428 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+import unicodedata
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+import numpy as np
+from prometheus_client import Counter
+from prometheus_client.core import GaugeMetricFamily
+
+from ..mega.logger import CustomLogger
+from ..mega.workers import register_collector
+
+logger = CustomLogger("OpeaCache")
+
+_MISSING = object()
+
+cache_hits = Counter("opea_cache_hits", "Cache hits per cache and tier", ["cache", "tier"])
+cache_misses = Counter("opea_cache_misses", "Cache misses per cache", ["cache"])
+cache_evictions = Counter("opea_cache_evictions", "Cache evictions per cache and reason", ["cache", "reason"])
+
+# live in-process caches, exported by the collector below
+_caches = weakref.WeakSet()
+
+
+class CacheSizeCollector:
+    """Prometheus collector exposing the size of every in-process cache at scrape time."""
+
+    units = ("entries", "bytes", "turns")
+
+    def collect(self):
+        totals = {}
+        for cache in list(_caches):
+            stats = cache.stats()
+            for unit in self.units:
+                if unit in stats:
+                    key = (unit, cache.name)
+                    totals[key] = totals.get(key, 0) + stats[unit]
+        for unit in self.units:
+            family = GaugeMetricFamily(f"opea_cache_{unit}", f"Cache size in {unit} (gauge)", labels=["cache"])
+            for (total_unit, name), value in totals.items():
+                if total_unit == unit:
+                    family.add_metric([name], value)
+            yield family
+
+
+register_collector(CacheSizeCollector())
+
+
+def estimate_size(value: Any) -> int:
+    """Cheap estimate of the memory held by JSON-like values, used for cache byte budgets."""
+    if isinstance(value, (int, float)):
+        return 8
+    if isinstance(value, str):
+        return 49 + len(value)
+    if isinstance(value, (list, tuple)):
+        if value and isinstance(value[0], float):
+            # embedding vectors, do not walk every element
+            return 56 + 8 * len(value) + 24 * len(value)
+        return 56 + 8 * len(value) + sum(estimate_size(item) for item in value)
+    if isinstance(value, dict):
+        return 232 + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    return sys.getsizeof(value)
+
+
+class LRUTTLCache:
+    """In-process LRU cache with TTL expiry, an entry budget and an optional byte budget.
+
+    Meant to be used from a single event loop, it is not thread-safe.
+
+    Args:
+        name (str): Name of the cache, used as the metrics label.
+        max_entries (int): Maximum number of entries kept.
+        max_bytes (int, optional): Maximum estimated size of all entries in bytes.
+        ttl (float, optional): Seconds an entry stays valid after it was set (or last read when `sliding` is set).
+        sliding (bool): Refresh the TTL of an entry on every read, i.e. expire idle entries.
+        sizeof (Callable, optional): Function estimating the size of a value, defaults to `estimate_size`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_entries: int = 10000,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+        sliding: bool = False,
+        sizeof: Optional[Callable[[Any], int]] = None,
+    ):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sliding = sliding
+        self.sizeof = sizeof or estimate_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_bytes = 0
+        self._data = OrderedDict()  # key -> (value, size, expires_at)
+        _caches.add(self)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING, count=False) is not _MISSING
+
+    def get(self, key, default=None, count: bool = True):
+        entry = self._data.get(key)
+        if entry is None:
+            if count:
+                self._miss()
+            return default
+        value, size, expires_at = entry
+        now = time.monotonic()
+        if expires_at is not None and expires_at <= now:
+            self._evict(key, "ttl")
+            if count:
+                self._miss()
+            return default
+        self._data.move_to_end(key)
+        if self.sliding and self.ttl is not None:
+            self._data[key] = (value, size, now + self.ttl)
+        if count:
+            self.hits += 1
+            cache_hits.labels(self.name, "memory").inc()
+        return value
+
+    def set(self, key, value, size: Optional[int] = None):
+        size = self.sizeof(value) if size is None else size
+        if self.max_bytes is not None and size > self.max_bytes:
+            # never let a single entry flush the whole cache
+            return
+        if key in self._data:
+            self.total_bytes -= self._data.pop(key)[1]
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        self._data[key] = (value, size, expires_at)
+        self.total_bytes += size
+        self._shrink()
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return default
+        self.total_bytes -= entry[1]
+        return entry[0]
+
+    def clear(self):
+        self._data.clear()
+        self.total_bytes = 0
+
+    def expire(self):
+        """Drop all expired entries."""
+        now = time.monotonic()
+        for key in [k for k, (_, _, expires_at) in self._data.items() if expires_at is not None and expires_at <= now]:
+            self._evict(key, "ttl")
+
+    def items(self):
+        return [(key, entry[0]) for key, entry in self._data.items()]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _miss(self):
+        self.misses += 1
+        cache_misses.labels(self.name).inc()
+
+    def _evict(self, key, reason: str):
+        self.total_bytes -= self._data.pop(key)[1]
+        self.evictions += 1
+        cache_evictions.labels(self.name, reason).inc()
+
+    def _shrink(self):
+        while len(self._data) > self.max_entries:
+            self._evict(next(iter(self._data)), "lru")
+        while self.max_bytes is not None and self.total_bytes > self.max_bytes and self._data:
+            self._evict(next(iter(self._data)), "size")
+
+
+class RedisCacheTier:
+    """Shared Redis tier behind an in-process cache, values are stored as JSON with a TTL.
+
+    Redis failures are logged and treated as misses, the cache never fails a request.
+    """
+
+    def __init__(self, name: str, redis_url: str, ttl: Optional[float] = None, prefix: str = "opea:cache:"):
+        import redis.asyncio as aioredis
+
+        self.name = name
+        self.ttl = int(ttl) if ttl else None
+        self.prefix = f"{prefix}{name}:"
+        self.client = aioredis.from_url(redis_url)
+
+    async def get(self, key: str):
+        try:
+            raw = await self.client.get(self.prefix + key)
+        except Exception as e:
+            logger.warning(f"[ {self.name} ] redis get failed: {e}")
+            return None
+        if raw is None:
+            return None
+        cache_hits.labels(self.name, "redis").inc()
+        return json.loads(raw)
+
+    async def set(self, key: str, value) -> None:
+        try:
+            await self.client.set(self.prefix + key, json.dumps(value), ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"[ {self.name} ] redis set failed: {e}")
+
+
+class EmbeddingCache:
+    """Query embedding cache consulted by the orchestrator before calling an EMBEDDING node.
+
+    Entries are keyed on the normalized query text and the embedding model, kept in an LRU/TTL
+    memory tier with a byte budget and optionally shared between replicas through Redis.
+    Subclass and override `get`/`set` to plug in another backend.
+
+    Cached values are shared between requests and must be treated as read-only.
+    """
+
+    name = "embedding"
+
+    def __init__(
+        self,
+        model_id: str = "",
+        max_entries: int = 10000,
+        max_bytes: Optional[int] = 64 * 1024 * 1024,
+        ttl: Optional[float] = 3600,
+        redis_url: Optional[str] = None,
+        casefold: bool = True,
+    ):
+        self.model_id = model_id
+        self.casefold = casefold
+        self.memory = LRUTTLCache(self.name, max_entries=max_entries, max_bytes=max_bytes, ttl=ttl)
+        self.shared = RedisCacheTier(self.name, redis_url, ttl=ttl) if redis_url else None
+
+    @classmethod
+    def from_env(cls) -> Optional["EmbeddingCache"]:
+        """Build the cache from EMBEDDING_CACHE_* environment variables, None when disabled."""
+        if os.getenv("EMBEDDING_CACHE_ENABLED", "false").lower() not in ("true", "1", "yes"):
+            return None
+        return cls(
+            model_id=os.getenv("EMBEDDING_MODEL_ID", ""),
+            max_entries=int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 10000)),
+            max_bytes=int(float(os.getenv("EMBEDDING_CACHE_MAX_MB", 64)) * 1024 * 1024),
+            ttl=float(os.getenv("EMBEDDING_CACHE_TTL", 3600)),
+            redis_url=os.getenv("EMBEDDING_CACHE_REDIS_URL") or None,
+            casefold=os.getenv("EMBEDDING_CACHE_CASEFOLD", "true").lower() in ("true", "1", "yes"),
+        )
+
+    def normalize(self, text: str) -> str:
+        text = re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+        return text.casefold() if self.casefold else text
+
+    def key(self, text: str, model_id: str = "") -> str:
+        material = f"{self.model_id or model_id}\x00{self.normalize(text)}"
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    async def get(self, text: str, model_id: str = ""):
+        key = self.key(text, model_id)
+        value = self.memory.get(key)
+        if value is None and self.shared is not None:
+            value = await self.shared.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+        return value
+
+    async def set(self, text: str, value, model_id: str = "") -> None:
+        key = self.key(text, model_id)
+        self.memory.set(key, value)
+        if self.shared is not None:
+            await self.shared.set(key, value)
+
+    def stats(self) -> dict:
+        return self.memory.stats()
+
+
+class CollectionGenerations:
+    """Per-collection generation counters used to invalidate caches of vector store results.
+
+    Dataprep bumps the generation of a collection whenever it ingests into or deletes from it,
+    readers include the current generation in their cache keys so stale entries are never served.
+    With a Redis URL the counters are shared between services, otherwise they are process-local.
+    """
+
+    def __init__(self, redis_url: Optional[str] = None, prefix: str = "opea:generation:"):
+        self.prefix = prefix
+        self._local = {}
+        self.client = None
+        if redis_url:
+            import redis.asyncio as aioredis
+
+            self.client = aioredis.from_url(redis_url)
+
+    @classmethod
+    def from_env(cls) -> "CollectionGenerations":
+        return cls(redis_url=os.getenv("COLLECTION_GENERATION_REDIS_URL") or None)
+
+    async def get(self, collection_name: str) -> Optional[int]:
+        """Return the current generation, None if it cannot be read and caching must be bypassed."""
+        if self.client is None:
+            return self._local.get(collection_name, 0)
+        try:
+            raw = await self.client.get(self.prefix + collection_name)
+        except Exception as e:
+            logger.warning(f"[ generations ] failed to read generation of {collection_name}: {e}")
+            return None
+        return int(raw) if raw is not None else 0
+
+    async def bump(self, collection_name: str) -> Optional[int]:
+        """Advance the generation of a collection after its content changed."""
+        if self.client is None:
+            self._local[collection_name] = self._local.get(collection_name, 0) + 1
+            return self._local[collection_name]
+        try:
+            return await self.client.incr(self.prefix + collection_name)
+        except Exception as e:
+            logger.error(f"[ generations ] failed to bump generation of {collection_name}: {e}")
+            return None
+
+
+class SemanticAnswerCache:
+    """Cache of final answers looked up by cosine similarity of the question embedding.
+
+    Entries are scoped to a collection and to the collection generation they were produced
+    from, so an answer is never served once the collection content changed.
+
+    Args:
+        threshold (float): Minimum cosine similarity between questions to serve a cached answer.
+        max_entries (int): Maximum number of answers kept across all collections.
+        ttl (float, optional): Seconds an answer stays valid.
+    """
+
+    name = "answer"
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 1000, ttl: Optional[float] = 86400):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # collection -> OrderedDict(entry id -> entry)
+        self._matrices = {}  # collection -> (entry ids, stacked unit vectors), rebuilt lazily
+        self._size = 0
+        self._next_id = 0
+        _caches.add(self)
+
+    @classmethod
+    def from_env(cls) -> Optional["SemanticAnswerCache"]:
+        """Build the cache from ANSWER_CACHE_* environment variables, None when disabled."""
+        if os.getenv("ANSWER_CACHE_ENABLED", "false").lower() not in ("true", "1", "yes"):
+            return None
+        return cls(
+            threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95)),
+            max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 1000)),
+            ttl=float(os.getenv("ANSWER_CACHE_TTL", 86400)),
+        )
+
+    @staticmethod
+    def _unit(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _drop(self, collection: str, entry_id: int, reason: str):
+        self._entries[collection].pop(entry_id)
+        self._matrices.pop(collection, None)
+        self._size -= 1
+        cache_evictions.labels(self.name, reason).inc()
+
+    def lookup(self, embedding, collection: str, generation: int) -> Optional[dict]:
+        """Return the stored {"answer", "sources"} of the most similar question above the threshold."""
+        entries = self._entries.get(collection)
+        now = time.monotonic()
+        if entries:
+            for entry_id in [i for i, e in entries.items() if e["generation"] != generation or e["expires_at"] <= now]:
+                self._drop(collection, entry_id, "ttl" if entries[entry_id]["generation"] == generation else "stale")
+        if not entries:
+            cache_misses.labels(self.name).inc()
+            return None
+
+        if collection not in self._matrices:
+            ids = list(entries)
+            self._matrices[collection] = (ids, np.stack([entries[i]["vector"] for i in ids]))
+        ids, matrix = self._matrices[collection]
+        scores = matrix @ self._unit(embedding)
+        best = int(np.argmax(scores))
+        if float(scores[best]) < self.threshold:
+            cache_misses.labels(self.name).inc()
+            return None
+        cache_hits.labels(self.name, "memory").inc()
+        entry = entries[ids[best]]
+        return {"answer": entry["answer"], "sources": entry["sources"], "similarity": float(scores[best])}
+
+    def stats(self) -> dict:
+        return {"entries": self._size}
+
+    def store(self, embedding, collection: str, generation: int, answer: str, sources: list) -> None:
+        entries = self._entries.setdefault(collection, OrderedDict())
+        self._next_id += 1
+        entries[self._next_id] = {
+            "vector": self._unit(embedding),
+            "generation": generation,
+            "answer": answer,
+            "sources": sources,
+            "expires_at": time.monotonic() + self.ttl if self.ttl is not None else float("inf"),
+        }
+        self._matrices.pop(collection, None)
+        self._size += 1
+        while self._size > self.max_entries:
+            # evict the oldest answer of the collection holding the most answers
+            largest = max(self._entries, key=lambda c: len(self._entries[c]))
+            self._drop(largest, next(iter(self._entries[largest])), "lru")
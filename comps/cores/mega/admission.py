@@ -0,0 +1,310 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# priority lanes, in the order free slots are offered to them
+INTERACTIVE_LANE = "interactive"
+BATCH_LANE = "batch"
+LANES = (INTERACTIVE_LANE, BATCH_LANE)
+DEFAULT_TENANT = "default"
+
+admission_active = Gauge(
+    "megaservice_admission_active", "Pipelines admitted and not finished yet", ["lane"], multiprocess_mode="livesum"
+)
+admission_queue_depth = Gauge(
+    "megaservice_admission_queue_depth", "Requests waiting for a pipeline slot", ["lane"], multiprocess_mode="livesum"
+)
+admission_wait = Histogram(
+    "megaservice_admission_wait_seconds",
+    "Time spent waiting for a pipeline slot by the admitted requests (histogram)",
+    ["tenant", "lane"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+admission_rejected = Counter(
+    "megaservice_admission_rejected", "Requests rejected by the admission control", ["tenant", "lane", "reason"]
+)
+
+# weight of the last pipeline in the running average of the slot hold time
+HOLD_TIME_SMOOTHING = 0.1
+# tenants whose finish tag is remembered before the ones behind the virtual time are dropped
+MAX_TRACKED_TENANTS = 1024
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    """Parse `tenant=weight` pairs separated by commas, e.g. `univ_a=2,univ_b=0.5`."""
+    weights = {}
+    for item in spec.split(","):
+        tenant, sep, weight = item.strip().rpartition("=")
+        if sep and tenant.strip():
+            weights[tenant.strip()] = float(weight)
+    return weights
+
+
+class AdmissionRejected(Exception):
+    """The request could not be admitted, to be answered with `status_code` and a Retry-After header.
+
+    reason is `queue_full` (429, the wait queue or the share of it a tenant may use is full) or
+    `deadline` (503, no slot freed up, or none is expected to, within the queue deadline).
+    """
+
+    def __init__(self, reason: str, status_code: int, retry_after: int) -> None:
+        super().__init__(f"request rejected by admission control: {reason}, retry after {retry_after}s")
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def headers(self):
+        return {"Retry-After": str(self.retry_after)}
+
+
+class AdmissionSlot:
+    """A pipeline slot held by an admitted request, `release()` must be called once it is finished."""
+
+    __slots__ = ("controller", "lane", "acquired_at", "released")
+
+    def __init__(self, controller: "AdmissionController", lane: "_Lane") -> None:
+        self.controller = controller
+        self.lane = lane
+        self.acquired_at = time.monotonic()
+        self.released = False
+
+    def release(self) -> None:
+        """Offer the slot to the next waiting request, safe to call more than once."""
+        if not self.released:
+            self.released = True
+            self.controller._release(self.lane, time.monotonic() - self.acquired_at)
+
+
+class _Waiter:
+    __slots__ = ("future", "tenant", "start_tag", "finish_tag", "queued")
+
+    def __init__(self, future: asyncio.Future, tenant: str, start_tag: float, finish_tag: float) -> None:
+        self.future = future
+        self.tenant = tenant
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.queued = True
+
+
+class _Lane:
+    """Weighted fair queue of one priority lane.
+
+    A request of a tenant starts, in virtual time, when the previous request of the tenant finished
+    or now if later, and takes `1 / weight` of virtual time. Waiters are served by increasing
+    finish tag, so backlogged tenants share the lane in proportion to their weights whatever the
+    number of requests each of them queued.
+    """
+
+    def __init__(self, name: str, max_concurrency: int) -> None:
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.active = 0
+        self.heap: List[Tuple[float, int, _Waiter]] = []
+        self.depth = 0
+        self.queued: Dict[str, int] = {}
+        self.virtual_time = 0.0
+        self.finish_tags: Dict[str, float] = {}
+        # running average of the time a pipeline holds its slot, None until a pipeline finished
+        self.hold_time: Optional[float] = None
+
+    def tags(self, tenant: str, weight: float) -> Tuple[float, float]:
+        if len(self.finish_tags) > MAX_TRACKED_TENANTS:
+            # a tenant whose tag fell behind the virtual time starts from the virtual time anyway
+            self.finish_tags = {t: f for t, f in self.finish_tags.items() if f > self.virtual_time}
+        start = max(self.virtual_time, self.finish_tags.get(tenant, 0.0))
+        return start, start + 1 / weight
+
+    def push(self, waiter: _Waiter, seq: int) -> None:
+        heapq.heappush(self.heap, (waiter.finish_tag, seq, waiter))
+        self.finish_tags[waiter.tenant] = waiter.finish_tag
+        self.depth += 1
+        self.queued[waiter.tenant] = self.queued.get(waiter.tenant, 0) + 1
+        admission_queue_depth.labels(self.name).inc()
+
+    def dequeue(self, waiter: _Waiter) -> None:
+        if waiter.queued:
+            waiter.queued = False
+            self.depth -= 1
+            self.queued[waiter.tenant] -= 1
+            if not self.queued[waiter.tenant]:
+                del self.queued[waiter.tenant]
+            admission_queue_depth.labels(self.name).dec()
+
+    def pop(self) -> Optional[_Waiter]:
+        """Next waiter in finish tag order, the abandoned ones are dropped on the way."""
+        while self.heap:
+            _, _, waiter = heapq.heappop(self.heap)
+            if waiter.queued and not waiter.future.done():
+                self.dequeue(waiter)
+                self.virtual_time = max(self.virtual_time, waiter.start_tag)
+                return waiter
+            self.dequeue(waiter)
+        return None
+
+    def ahead_of(self, finish_tag: float) -> int:
+        return sum(1 for tag, _, waiter in self.heap if waiter.queued and tag <= finish_tag)
+
+    def observe_hold(self, held: float) -> None:
+        self.hold_time = (
+            held if self.hold_time is None else (1 - HOLD_TIME_SMOOTHING) * self.hold_time + HOLD_TIME_SMOOTHING * held
+        )
+
+
+class AdmissionController:
+    """Cap the concurrent pipelines of the megaservice and queue the excess fairly for a bounded time.
+
+    Without a cap every request of a burst starts its pipeline at once, the embedding, rerank and
+    LLM backends queue internally and every request ends up late. Here at most `max_concurrency`
+    pipelines run and the next `max_queue` requests wait for a slot for at most `queue_timeout`
+    seconds, the others are rejected right away with a Retry-After, so that the admitted requests
+    keep their latency.
+
+    Requests are queued per priority lane and tenant (database or API key). A free slot goes to the
+    interactive lane first, then to the batch lane, each lane running at most its own number of
+    pipelines so that bulk jobs cannot take all the slots. Within a lane the tenants are served by
+    weighted fair queueing (`weights`, 1 by default), and a tenant holds at most
+    `max_queue_per_tenant` places of the queue.
+
+    A request is also rejected without waiting when, given the average time a slot is held, its
+    place in the queue would not let it start within the deadline.
+    The limits apply to each worker process of the service.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        max_queue: int = 64,
+        queue_timeout: float = 10.0,
+        lane_concurrency: Optional[Dict[str, int]] = None,
+        max_queue_per_tenant: Optional[int] = None,
+        weights: Optional[Dict[str, float]] = None,
+    ) -> None:
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_queue_per_tenant = max_queue_per_tenant or max_queue
+        self.weights = weights or {}
+        lane_concurrency = lane_concurrency or {}
+        self.lanes = {
+            name: _Lane(name, min(lane_concurrency.get(name) or max_concurrency, max_concurrency)) for name in LANES
+        }
+        self.active = 0
+        self._seq = itertools.count()
+
+    @classmethod
+    def from_env(cls) -> Optional["AdmissionController"]:
+        """Build the controller from MEGASERVICE_* environment variables, None when there is no cap."""
+        max_concurrency = int(os.getenv("MEGASERVICE_MAX_CONCURRENCY", 0))
+        if max_concurrency <= 0:
+            return None
+        return cls(
+            max_concurrency=max_concurrency,
+            max_queue=int(os.getenv("MEGASERVICE_MAX_QUEUE", 64)),
+            queue_timeout=float(os.getenv("MEGASERVICE_QUEUE_TIMEOUT", 10)),
+            lane_concurrency={
+                INTERACTIVE_LANE: int(os.getenv("MEGASERVICE_INTERACTIVE_MAX_CONCURRENCY", max_concurrency)),
+                BATCH_LANE: int(os.getenv("MEGASERVICE_BATCH_MAX_CONCURRENCY", max(max_concurrency // 2, 1))),
+            },
+            max_queue_per_tenant=int(os.getenv("MEGASERVICE_MAX_QUEUE_PER_TENANT", 0)) or None,
+            weights=parse_weights(os.getenv("MEGASERVICE_TENANT_WEIGHTS", "")),
+        )
+
+    @property
+    def depth(self) -> int:
+        return sum(lane.depth for lane in self.lanes.values())
+
+    @staticmethod
+    def expected_wait(lane: _Lane, ahead: int) -> float:
+        """Seconds before a request of `lane` gets a slot, with `ahead` requests to be served before it."""
+        if lane.hold_time is None:
+            return 0.0
+        return (ahead + 1) * lane.hold_time / lane.max_concurrency
+
+    def _reject(self, tenant: str, lane: _Lane, reason: str, status_code: int, wait: float) -> AdmissionRejected:
+        admission_rejected.labels(tenant, lane.name, reason).inc()
+        return AdmissionRejected(reason, status_code, max(math.ceil(wait), 1))
+
+    def _can_start(self, lane: _Lane) -> bool:
+        return self.active < self.max_concurrency and lane.active < lane.max_concurrency
+
+    def _start(self, lane: _Lane) -> None:
+        self.active += 1
+        lane.active += 1
+        admission_active.labels(lane.name).inc()
+
+    async def acquire(
+        self, tenant: str = DEFAULT_TENANT, lane: str = INTERACTIVE_LANE, timeout: Optional[float] = None
+    ) -> AdmissionSlot:
+        """Wait for a pipeline slot in `lane` for at most `timeout` seconds (default `queue_timeout`).
+
+        Raises AdmissionRejected when the request cannot be admitted in time.
+        """
+        timeout = self.queue_timeout if timeout is None else timeout
+        queue = self.lanes[lane]
+        if self._can_start(queue) and not queue.depth:
+            self._start(queue)
+            admission_wait.labels(tenant, queue.name).observe(0)
+            return AdmissionSlot(self, queue)
+
+        if self.depth >= self.max_queue or queue.queued.get(tenant, 0) >= self.max_queue_per_tenant:
+            raise self._reject(tenant, queue, "queue_full", 429, self.expected_wait(queue, queue.depth))
+        start_tag, finish_tag = queue.tags(tenant, self.weights.get(tenant, 1.0))
+        ahead = queue.ahead_of(finish_tag)
+        if queue.name != INTERACTIVE_LANE:
+            # the interactive requests queued meanwhile are served first
+            ahead += self.lanes[INTERACTIVE_LANE].depth
+        wait = self.expected_wait(queue, ahead)
+        if wait > timeout:
+            raise self._reject(tenant, queue, "deadline", 503, wait)
+
+        start = time.monotonic()
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), tenant, start_tag, finish_tag)
+        queue.push(waiter, next(self._seq))
+        try:
+            await asyncio.wait_for(waiter.future, timeout)
+        except asyncio.TimeoutError:
+            if not self._granted(queue, waiter):
+                raise self._reject(tenant, queue, "deadline", 503, self.expected_wait(queue, queue.depth))
+            # the slot was handed over as the deadline expired
+        except asyncio.CancelledError:
+            if self._granted(queue, waiter):
+                # the slot was handed over just as the request was abandoned, pass it on
+                self._release(queue, None)
+            raise
+        admission_wait.labels(tenant, queue.name).observe(time.monotonic() - start)
+        return AdmissionSlot(self, queue)
+
+    @staticmethod
+    def _granted(lane: _Lane, waiter: _Waiter) -> bool:
+        if waiter.future.done() and not waiter.future.cancelled():
+            return True
+        lane.dequeue(waiter)
+        return False
+
+    def _release(self, lane: _Lane, held: Optional[float]) -> None:
+        if held is not None:
+            lane.observe_hold(held)
+        self.active -= 1
+        lane.active -= 1
+        admission_active.labels(lane.name).dec()
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Start waiting requests while slots are free, interactive lane first."""
+        for lane in self.lanes.values():
+            while self._can_start(lane):
+                waiter = lane.pop()
+                if waiter is None:
+                    break
+                self._start(lane)
+                waiter.future.set_result(None)
@@ -0,0 +1,138 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import math
+import random
+import time
+from collections import deque
+from typing import Collection, List, Optional
+
+from prometheus_client import Counter, Gauge
+
+from .logger import CustomLogger
+
+logger = CustomLogger("comps-core-balancer")
+
+LEAST_OUTSTANDING = "least_outstanding"
+EWMA = "ewma"
+
+# weight of the last reply in the latency average of a replica
+EWMA_SMOOTHING = 0.3
+# replies of the node kept to compute the hedging delay
+LATENCY_SAMPLES = 256
+# no hedging before the node answered this many times, the quantile would be noise
+MIN_HEDGE_SAMPLES = 20
+
+replica_outstanding = Gauge(
+    "megaservice_replica_outstanding",
+    "Requests in flight per replica of a node",
+    ["node", "replica"],
+    multiprocess_mode="livesum",
+)
+replica_ejected = Gauge(
+    "megaservice_replica_ejected",
+    "Replicas currently ejected from the balancing after consecutive failures",
+    ["node", "replica"],
+    multiprocess_mode="livemax",
+)
+replica_ejections = Counter(
+    "megaservice_replica_ejections", "Ejections of replicas after consecutive failures", ["node", "replica"]
+)
+hedged_requests = Counter(
+    "megaservice_hedged_requests", "Hedged duplicate requests sent to a second replica, by winner", ["node", "winner"]
+)
+
+
+class Replica:
+    __slots__ = ("url", "outstanding", "latency", "failures", "ejected_until")
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.outstanding = 0
+        # running average of the reply latency, None until the first reply
+        self.latency: Optional[float] = None
+        self.failures = 0
+        self.ejected_until = 0.0
+
+
+class LoadBalancer:
+    """Pick the replica of a node serving each call, and eject the failing ones.
+
+    Replicas are picked by least outstanding requests (`least_outstanding`) or by latency average
+    weighted by the outstanding requests (`ewma`), ties at random. A replica failing
+    `eject_threshold` times in a row is left out for `eject_time` seconds, unless every replica is.
+    The latencies of the node give the delay after which a hedged request is worth sending.
+    """
+
+    def __init__(
+        self,
+        node: str,
+        urls: List[str],
+        strategy: str = LEAST_OUTSTANDING,
+        eject_threshold: int = 5,
+        eject_time: float = 30.0,
+    ) -> None:
+        if strategy not in (LEAST_OUTSTANDING, EWMA):
+            raise ValueError(f"Unknown balancing strategy: {strategy}")
+        self.node = node
+        self.replicas = [Replica(url) for url in urls]
+        self.strategy = strategy
+        self.eject_threshold = eject_threshold
+        self.eject_time = eject_time
+        self.samples = deque(maxlen=LATENCY_SAMPLES)
+
+    def _score(self, replica: Replica) -> float:
+        if self.strategy == EWMA:
+            # replicas without a reply yet come first, so that they are measured
+            return (replica.latency or 0.0) * (replica.outstanding + 1)
+        return replica.outstanding
+
+    def healthy(self) -> List[Replica]:
+        now = time.monotonic()
+        healthy = []
+        for replica in self.replicas:
+            if replica.ejected_until and now >= replica.ejected_until:
+                # back on probation, ejected again at the next failure
+                replica.ejected_until = 0.0
+                replica.failures = self.eject_threshold - 1
+                replica_ejected.labels(self.node, replica.url).set(0)
+                logger.info(f"Replica {replica.url} of {self.node} is back in the balancing")
+            if not replica.ejected_until:
+                healthy.append(replica)
+        return healthy
+
+    def acquire(self, exclude: Collection[Replica] = ()) -> Replica:
+        """Pick a replica for a call and count it as outstanding, avoiding `exclude` if possible."""
+        candidates = [r for r in self.healthy() if r not in exclude] or self.healthy() or self.replicas
+        random.shuffle(candidates)
+        replica = min(candidates, key=self._score)
+        replica.outstanding += 1
+        replica_outstanding.labels(self.node, replica.url).inc()
+        return replica
+
+    def release(self, replica: Replica) -> None:
+        replica.outstanding -= 1
+        replica_outstanding.labels(self.node, replica.url).dec()
+
+    def observe(self, replica: Replica, latency: float, ok: bool) -> None:
+        """Account the outcome of a call, failed calls only count towards the ejection."""
+        if ok:
+            replica.failures = 0
+            replica.latency = (
+                latency if replica.latency is None else (1 - EWMA_SMOOTHING) * replica.latency + EWMA_SMOOTHING * latency
+            )
+            self.samples.append(latency)
+            return
+        replica.failures += 1
+        if self.eject_threshold > 0 and replica.failures >= self.eject_threshold and not replica.ejected_until:
+            replica.ejected_until = time.monotonic() + self.eject_time
+            replica_ejections.labels(self.node, replica.url).inc()
+            replica_ejected.labels(self.node, replica.url).set(1)
+            logger.warning(f"Replica {replica.url} of {self.node} ejected for {self.eject_time}s")
+
+    def hedge_delay(self, quantile: float) -> Optional[float]:
+        """Seconds after which a call is hedged, None while there is no second healthy replica or few replies."""
+        if len(self.samples) < MIN_HEDGE_SAMPLES or len(self.healthy()) < 2:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(math.ceil(quantile * len(ordered)), len(ordered)) - 1]
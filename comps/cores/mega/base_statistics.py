@@ -1,26 +1,83 @@
 # Copyright (C) 2024 Intel Corporation
 # SPDX-License-Identifier: Apache-2.0
 
+import glob
+import os
+from urllib.parse import quote
+
 import numpy as np
 
 # name => statistic dict
 statistics_dict = {}
 
+# latest samples kept per worker slot when the statistics are shared by worker processes
+STATISTICS_MAX_SAMPLES = int(os.getenv("STATISTICS_MAX_SAMPLES", 10000))
+# (latency, first token latency or NaN) float64 pair
+_RECORD_SIZE = 16
+
+
+def _multiprocess_dir():
+    # shared with the Prometheus metrics of the worker processes, see comps/cores/mega/workers.py
+    return os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+
+def _worker_id():
+    # slot of the worker process set by WorkerSupervisor, kept by the worker replacing it
+    return os.environ.get("HTTP_SERVICE_WORKER_ID") or str(os.getpid())
+
 
 class BaseStatistics:
-    """Base class to store in-memory statistics of an entity for measurement in one service."""
+    """Base class to store in-memory statistics of an entity for measurement in one service.
+
+    When the service runs several worker processes sharing PROMETHEUS_MULTIPROC_DIR, every worker
+    slot writes its samples to its own file of that directory and the statistics are computed over
+    the files of all the workers. The files are ring buffers of the latest STATISTICS_MAX_SAMPLES
+    samples, so they and the time to read them stay bounded however long the service runs.
+    """
 
     def __init__(
         self,
+        name=None,
     ):
+        self.name = name
         self.response_times = []  # store responses time for all requests
         self.first_token_latencies = []  # store first token latencies for all requests
+        self._fd = None
+        self._fd_pid = None
+        self._next_record = 0
+
+    def _path(self, worker="*"):
+        return os.path.join(_multiprocess_dir(), f"statistics_{quote(self.name, safe='')}_{worker}.bin")
 
     def append_latency(self, latency, first_token_latency=None):
+        if self.name and _multiprocess_dir():
+            self._append_shared(latency, first_token_latency)
+            return
         self.response_times.append(latency)
         if first_token_latency:
             self.first_token_latencies.append(first_token_latency)
 
+    def _append_shared(self, latency, first_token_latency):
+        pid = os.getpid()
+        if self._fd_pid != pid:
+            # first sample of this process, forked workers must not write to the file of their parent
+            self._fd = os.open(self._path(_worker_id()), os.O_RDWR | os.O_CREAT, 0o644)
+            self._fd_pid = pid
+            # a replaced worker left its samples, the ring goes on after them or wraps
+            self._next_record = os.fstat(self._fd).st_size // _RECORD_SIZE % STATISTICS_MAX_SAMPLES
+        record = np.array([latency, first_token_latency or np.nan], dtype=np.float64).tobytes()
+        # one write per record, a reader racing the end of the file drops the partial record
+        os.pwrite(self._fd, record, self._next_record * _RECORD_SIZE)
+        self._next_record = (self._next_record + 1) % STATISTICS_MAX_SAMPLES
+
+    def _load_shared(self):
+        samples = [np.fromfile(path, dtype=np.float64) for path in glob.glob(self._path())]
+        if not samples:
+            return [], []
+        samples = np.concatenate([s[: len(s) // 2 * 2] for s in samples]).reshape(-1, 2)
+        first_token_latencies = samples[:, 1]
+        return samples[:, 0].tolist(), first_token_latencies[~np.isnan(first_token_latencies)].tolist()
+
     def _add_statistics(self, result, stats, suffix):
         "add P50 (median), P99 and average values for 'stats' array to 'result' dict"
         if stats:
@@ -35,8 +92,11 @@ class BaseStatistics:
     def get_statistics(self):
         "return stats dict with P50, P99 and average values for first token and response timings"
         result = {}
-        self._add_statistics(result, self.response_times, "latency")
-        self._add_statistics(result, self.first_token_latencies, "latency_first_token")
+        response_times, first_token_latencies = self.response_times, self.first_token_latencies
+        if self.name and _multiprocess_dir():
+            response_times, first_token_latencies = self._load_shared()
+        self._add_statistics(result, response_times, "latency")
+        self._add_statistics(result, first_token_latencies, "latency_first_token")
         return result
 
 
@@ -45,7 +105,7 @@ def register_statistics(
 ):
     def decorator(func):
         for name in names:
-            statistics_dict[name] = BaseStatistics()
+            statistics_dict[name] = BaseStatistics(name)
         return func
 
     return decorator
@@ -0,0 +1,169 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import gzip
+import json
+import os
+from typing import Any, Callable
+
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import orjson
+except ImportError:  # optional, the standard library codec is used without it
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional, only gzip is negotiated without it
+    brotli = None
+
+# opt-in fast JSON codec of HTTPService requests and responses, needs orjson
+HTTP_SERVICE_FAST_JSON = os.getenv("HTTP_SERVICE_FAST_JSON", "false").lower() in ("true", "1", "yes")
+# opt-in gzip/brotli compression of the non-streaming responses of HTTPService
+HTTP_SERVICE_COMPRESSION = os.getenv("HTTP_SERVICE_COMPRESSION", "false").lower() in ("true", "1", "yes")
+# responses smaller than this many bytes are sent as is
+HTTP_SERVICE_COMPRESSION_MIN_SIZE = int(os.getenv("HTTP_SERVICE_COMPRESSION_MIN_SIZE", 1024))
+HTTP_SERVICE_GZIP_LEVEL = int(os.getenv("HTTP_SERVICE_GZIP_LEVEL", 6))
+HTTP_SERVICE_BROTLI_QUALITY = int(os.getenv("HTTP_SERVICE_BROTLI_QUALITY", 4))
+# larger bodies are compressed in a thread instead of blocking the event loop
+COMPRESSION_THREAD_MIN_SIZE = 256 * 1024
+
+if orjson is not None:
+    # numpy arrays (embeddings) and non-string keys are accepted like by the standard encoder
+    ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    def json_dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=ORJSON_OPTIONS)
+
+    json_loads = orjson.loads
+else:
+
+    def json_dumps(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+    json_loads = json.loads
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson, several times cheaper on embeddings, documents and histories."""
+
+    def render(self, content: Any) -> bytes:
+        return json_dumps(content)
+
+
+class FastJSONRequest(Request):
+    """Request whose JSON body is parsed with orjson, `orjson.JSONDecodeError` is a `json.JSONDecodeError`."""
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            self._json = json_loads(await self.body())
+        return self._json
+
+
+class FastJSONRoute(APIRoute):
+    """Route handing `FastJSONRequest` to FastAPI body parsing and to the endpoints taking the request."""
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def fast_json_handler(request: Request) -> Response:
+            return await handler(FastJSONRequest(request.scope, request.receive))
+
+        return fast_json_handler
+
+
+def fast_json_available() -> bool:
+    return orjson is not None
+
+
+class CompressionMiddleware:
+    """Negotiated brotli or gzip compression of complete responses.
+
+    Only responses sent in a single body message (JSON, files, ...) of at least `minimum_size` bytes
+    are compressed. Streaming responses, server-sent events in particular, are passed through
+    untouched so that every chunk still reaches the client as soon as it is produced.
+    """
+
+    def __init__(self, app, minimum_size: int = HTTP_SERVICE_COMPRESSION_MIN_SIZE) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+
+    @staticmethod
+    def negotiate(accept_encoding: str):
+        accepted = {}
+        for item in accept_encoding.split(","):
+            coding, _, params = item.strip().partition(";")
+            quality = 1.0
+            if params.strip().startswith("q="):
+                try:
+                    quality = float(params.strip()[2:])
+                except ValueError:
+                    quality = 0.0
+            accepted[coding.strip().lower()] = quality
+        if brotli is not None and accepted.get("br", 0) > 0:
+            return "br"
+        if accepted.get("gzip", 0) > 0:
+            return "gzip"
+        return None
+
+    @staticmethod
+    def compress(encoding: str, body: bytes) -> bytes:
+        if encoding == "br":
+            return brotli.compress(body, quality=HTTP_SERVICE_BROTLI_QUALITY)
+        return gzip.compress(body, compresslevel=HTTP_SERVICE_GZIP_LEVEL)
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = self.negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        # set once the response is known not to be compressed, messages are then forwarded as they come
+        passthrough = False
+
+        async def send_compressed(message) -> None:
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if "content-encoding" in headers or headers.get("content-type", "").startswith("text/event-stream"):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start_message = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            if message.get("more_body", False) or len(body) < self.minimum_size:
+                # streamed or small response
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            if len(body) >= COMPRESSION_THREAD_MIN_SIZE:
+                body = await asyncio.to_thread(self.compress, encoding, body)
+            else:
+                body = self.compress(encoding, body)
+            headers = MutableHeaders(raw=start_message["headers"])
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start_message)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,209 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import time
+import weakref
+from contextlib import suppress
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from fastapi.responses import StreamingResponse
+from prometheus_client import Counter, Gauge, Histogram
+
+from .deadline import time_left
+
+active_request_contexts = Gauge(
+    "megaservice_request_contexts", "Request contexts not released yet", multiprocess_mode="livesum"
+)
+cancelled_requests = Counter(
+    "megaservice_cancelled_requests", "Requests abandoned by the client before completion", ["stage"]
+)
+prompt_tokens_histogram = Histogram(
+    "megaservice_prompt_tokens",
+    "Tokens of the LLM prompts built from the retrieved context",
+    buckets=(128, 256, 512, 1024, 2048, 4096, 8192, 16384),
+)
+avoided_tokens = Counter(
+    "megaservice_avoided_tokens",
+    "LLM tokens not generated because the stream was cancelled on client disconnect (max_tokens bound)",
+)
+
+
+class RequestContext:
+    """State of a single request through the megaservice.
+
+    Created by the gateway for every request and passed as the `context` keyword argument of
+    `ServiceOrchestrator.schedule`, which forwards it to `execute` and the `align_*` hooks. It carries
+    the sources, timings and generation metrics of this request only, so nothing request specific is
+    kept on the service or in registries shared by concurrent requests.
+
+    `release()` is called when the response stream ends or the client disconnects, a context that is
+    garbage collected without being released is accounted as released as well. Resources held for
+    the whole request, e.g. its admission slot, are freed through `on_release`.
+
+    `deadline` is the time.monotonic() by which the request should be answered, passed on to the
+    nodes by the orchestrator, None for no deadline.
+    """
+
+    def __init__(
+        self,
+        request_id: Optional[str] = None,
+        start_time: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        deadline: Optional[float] = None,
+    ) -> None:
+        self.request_id = request_id or str(uuid4())
+        # time.perf_counter() of the request arrival, reference of ttft and e2e latency
+        self.start_time = start_time if start_time is not None else time.perf_counter()
+        # generation budget, bounds the tokens saved when the stream is cancelled
+        self.max_tokens = max_tokens
+        self.deadline = deadline
+        self.sources: List[Dict] = []
+        # tokens of the LLM prompt, set when the prompt is built from the retrieved context
+        self.prompt_tokens: Optional[int] = None
+        # (text, embedding service reply) of the query when it was embedded before the pipeline run,
+        # reused by the embedding node instead of calling the service again
+        self.query_embedding: Optional[Tuple[str, Any]] = None
+        self.ttft: Optional[float] = None
+        self.metrics: Optional[Dict] = None
+        self.cancelled = False
+        self._release_callbacks: List[Callable[[], None]] = []
+        active_request_contexts.inc()
+        self._finalizer = weakref.finalize(self, _release, self._release_callbacks)
+
+    @property
+    def released(self) -> bool:
+        return not self._finalizer.alive
+
+    @property
+    def completed(self) -> bool:
+        return self.metrics is not None
+
+    def time_left(self) -> Optional[float]:
+        """Seconds left to the deadline, negative once it passed, None without deadline."""
+        return time_left(self.deadline)
+
+    def first_token(self) -> None:
+        """Record the time to first token, only the first call counts."""
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self.start_time
+
+    def complete(self, output_tokens: int) -> Dict:
+        """Close the generation timings and return the metrics of the request."""
+        e2e_latency = time.perf_counter() - self.start_time
+        ttft = self.ttft if self.ttft is not None else e2e_latency
+        self.metrics = {
+            "ttft": ttft,
+            "e2e_latency": e2e_latency,
+            "output_tokens": output_tokens,
+            "throughput": output_tokens / max(e2e_latency - ttft if self.ttft is not None else e2e_latency, 0.001),
+        }
+        if self.prompt_tokens is not None:
+            self.metrics["prompt_tokens"] = self.prompt_tokens
+            prompt_tokens_histogram.observe(self.prompt_tokens)
+        return self.metrics
+
+    def cancel(self, stage: str, output_tokens: int = 0) -> None:
+        """Account the request as abandoned by the client during `stage` (`pipeline` or `stream`).
+
+        `output_tokens` is what the LLM generated before its stream was stopped.
+        """
+        if self.cancelled:
+            return
+        self.cancelled = True
+        cancelled_requests.labels(stage).inc()
+        if self.max_tokens:
+            avoided_tokens.inc(max(self.max_tokens - output_tokens, 0))
+
+    def on_release(self, callback: Callable[[], None]) -> None:
+        """Call `callback` when the request is released, right away if it already was."""
+        if self.released:
+            callback()
+        else:
+            self._release_callbacks.append(callback)
+
+    def release(self) -> None:
+        """Mark the request as finished, safe to call more than once."""
+        self._finalizer()
+
+
+def _release(callbacks: List[Callable[[], None]]) -> None:
+    # must not reference the context, it also runs when the context is garbage collected
+    active_request_contexts.dec()
+    for callback in callbacks:
+        callback()
+
+
+class ClosingStream:
+    """Async iterator over `iterator` that calls `on_close` once, when it ends, fails or is closed.
+
+    A `finally` clause of an async generator does not run when the generator is closed before its
+    first item was requested, e.g. when the client disconnects before the answer starts. Resources
+    acquired before the iteration, such as an upstream response, are released through `on_close`
+    instead, which also runs in that case. `close()` runs it without awaiting the iterator.
+    """
+
+    def __init__(self, iterator, on_close: Callable[[], None]) -> None:
+        self.iterator = iterator
+        self._on_close: Optional[Callable[[], None]] = on_close
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.iterator.__anext__()
+        except (StopAsyncIteration, Exception):
+            self.close()
+            raise
+
+    async def aclose(self) -> None:
+        try:
+            if hasattr(self.iterator, "aclose"):
+                await self.iterator.aclose()
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        on_close, self._on_close = self._on_close, None
+        if on_close is not None:
+            on_close()
+
+
+class CancellableStreamingResponse(StreamingResponse):
+    """StreamingResponse that stops its body as soon as the client disconnects.
+
+    Starlette notices a disconnect at best when writing the next chunk (ASGI 2.4 servers) and leaves
+    the body iterator suspended, so an upstream LLM stream would go on generating until the generator
+    is garbage collected. Here `http.disconnect` is awaited while streaming and the body iterator is
+    closed when the response ends, for whatever reason, running its `finally` clauses down to the
+    upstream request.
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        spec_version = tuple(map(int, scope.get("asgi", {}).get("spec_version", "2.0").split(".")))
+        streaming = asyncio.ensure_future(super().__call__(scope, receive, send))
+        # older servers are watched by StreamingResponse itself, two concurrent receivers are not allowed
+        watcher = asyncio.ensure_future(wait_for_disconnect(receive)) if spec_version >= (2, 4) else None
+        try:
+            if watcher is not None:
+                await asyncio.wait({streaming, watcher}, return_when=asyncio.FIRST_COMPLETED)
+                if not streaming.done():
+                    streaming.cancel()
+                with suppress(asyncio.CancelledError):
+                    await streaming
+            else:
+                await streaming
+        finally:
+            for task in (streaming, watcher):
+                if task is not None and not task.done():
+                    task.cancel()
+            if hasattr(self.body_iterator, "aclose"):
+                await self.body_iterator.aclose()
+
+
+async def wait_for_disconnect(receive) -> None:
+    """Return once the client of an HTTP request has disconnected, its body must have been read."""
+    while (await receive())["type"] != "http.disconnect":
+        pass
@@ -2,7 +2,7 @@
 # SPDX-License-Identifier: Apache-2.0
 
 from collections import OrderedDict, defaultdict
-from copy import deepcopy
+from types import MappingProxyType
 
 
 class DAG(object):
@@ -14,6 +14,7 @@ class DAG(object):
         if node_name in graph:
             raise KeyError("node %s already exists" % node_name)
         graph[node_name] = set()
+        self._plan = None
 
     def add_node_if_not_exists(self, node_name):
         try:
@@ -30,6 +31,7 @@ class DAG(object):
         for node, edges in graph.items():
             if node_name in edges:
                 edges.remove(node_name)
+        self._plan = None
 
     def delete_node_if_exists(self, node_name):
         try:
@@ -41,19 +43,18 @@ class DAG(object):
         graph = self.graph
         if ind_node not in graph or dep_node not in graph:
             raise KeyError("one or more nodes do not exist in graph")
-        test_graph = deepcopy(graph)
-        test_graph[ind_node].add(dep_node)
-        is_valid = self.validate(test_graph)
-        if is_valid:
-            graph[ind_node].add(dep_node)
-        else:
+        # the new edge closes a cycle only if ind_node is already reachable from dep_node
+        if ind_node == dep_node or ind_node in self.all_downstreams(dep_node):
             raise Exception("validation error!")
+        graph[ind_node].add(dep_node)
+        self._plan = None
 
     def delete_edge(self, ind_node, dep_node):
         graph = self.graph
         if dep_node not in graph.get(ind_node, []):
             raise KeyError("this edge does not exist in graph")
         graph[ind_node].remove(dep_node)
+        self._plan = None
 
     def predecessors(self, node):
         graph = self.graph
@@ -95,6 +96,13 @@ class DAG(object):
 
     def reset_graph(self):
         self.graph = OrderedDict()
+        self._plan = None
+
+    def compile(self) -> "ExecutionPlan":
+        """Return the immutable execution plan of the graph, rebuilt only after the graph changes."""
+        if self._plan is None:
+            self._plan = ExecutionPlan(self.graph)
+        return self._plan
 
     def ind_nodes(self, graph=None):
         graph = graph if graph is not None else self.graph
@@ -140,3 +148,168 @@ class DAG(object):
 
     def size(self):
         return len(self.graph)
+
+
+class ExecutionPlan(object):
+    """Immutable precompiled view of a DAG.
+
+    Holds the topological order and levels, forward/reverse adjacency, in-degrees and the
+    downstream closure of every node, so per-request scheduling only does O(1) lookups.
+    """
+
+    def __init__(self, graph):
+        self.nodes = tuple(graph)
+        self.order = tuple(DAG().topological_sort(graph=graph))
+        self.successors = MappingProxyType({node: tuple(graph[node]) for node in self.nodes})
+        predecessors = {node: [] for node in self.nodes}
+        for node in self.nodes:
+            for dep_node in graph[node]:
+                predecessors[dep_node].append(node)
+        self.predecessors = MappingProxyType({node: tuple(preds) for node, preds in predecessors.items()})
+        self.in_degree = MappingProxyType({node: len(preds) for node, preds in predecessors.items()})
+        self.ind_nodes = tuple(node for node in self.nodes if not self.in_degree[node])
+        self.leaves = tuple(node for node in self.nodes if not self.successors[node])
+
+        level_of = {}
+        for node in self.order:
+            level_of[node] = max((level_of[pred] + 1 for pred in self.predecessors[node]), default=0)
+        levels = defaultdict(list)
+        for node in self.order:
+            levels[level_of[node]].append(node)
+        self.levels = tuple(tuple(levels[i]) for i in range(len(levels)))
+
+        position = {node: i for i, node in enumerate(self.order)}
+        descendants = {}
+        for node in reversed(self.order):
+            seen = set(self.successors[node])
+            for dep_node in self.successors[node]:
+                seen.update(descendants[dep_node])
+            descendants[node] = tuple(sorted(seen, key=position.__getitem__))
+        self.descendants = MappingProxyType(descendants)
+
+    def overlay(self) -> "RuntimeDAG":
+        """Return a cheap copy-on-write DAG for runtime edits of a single request."""
+        return RuntimeDAG(self)
+
+
+class RuntimeDAG(DAG):
+    """Per-request copy-on-write overlay of an ExecutionPlan.
+
+    Reads go to the shared plan until a node's edges are edited, only the edited adjacency
+    entries are copied into the overlay.
+    """
+
+    def __init__(self, plan: ExecutionPlan):
+        self._base = plan
+        self._succ = {}  # node -> set, overridden successors
+        self._pred = {}  # node -> list, overridden predecessors
+        self._removed = set()
+        self._added = []
+        self.modified = False
+
+    def _nodes(self):
+        for node in self._base.nodes:
+            if node not in self._removed:
+                yield node
+        yield from self._added
+
+    def _has_node(self, node_name):
+        return (node_name in self._base.successors and node_name not in self._removed) or node_name in self._added
+
+    def _own_succ(self, node_name):
+        if node_name not in self._succ:
+            self._succ[node_name] = set(self._base.successors.get(node_name, ()))
+        return self._succ[node_name]
+
+    def _own_pred(self, node_name):
+        if node_name not in self._pred:
+            self._pred[node_name] = list(self._base.predecessors.get(node_name, ()))
+        return self._pred[node_name]
+
+    @property
+    def graph(self):
+        return OrderedDict((node, set(self.downstream(node))) for node in self._nodes())
+
+    def reset_graph(self):
+        raise TypeError("runtime graphs are derived from an execution plan")
+
+    def compile(self):
+        return self._base if not self.modified else ExecutionPlan(self.graph)
+
+    def add_node(self, node_name: str):
+        if self._has_node(node_name):
+            raise KeyError("node %s already exists" % node_name)
+        self._removed.discard(node_name)
+        if node_name not in self._base.successors:
+            self._added.append(node_name)
+        self._succ[node_name] = set()
+        self._pred[node_name] = []
+        self.modified = True
+
+    def delete_node(self, node_name):
+        if not self._has_node(node_name):
+            raise KeyError("node %s does not exist" % node_name)
+        for pred in self.predecessors(node_name):
+            self._own_succ(pred).discard(node_name)
+        for dep_node in self.downstream(node_name):
+            self._own_pred(dep_node).remove(node_name)
+        self._succ.pop(node_name, None)
+        self._pred.pop(node_name, None)
+        if node_name in self._added:
+            self._added.remove(node_name)
+        else:
+            self._removed.add(node_name)
+        self.modified = True
+
+    def add_edge(self, ind_node, dep_node):
+        if not self._has_node(ind_node) or not self._has_node(dep_node):
+            raise KeyError("one or more nodes do not exist in graph")
+        if ind_node == dep_node or ind_node in self.all_downstreams(dep_node):
+            raise Exception("validation error!")
+        if dep_node in self.downstream(ind_node):
+            return
+        self._own_succ(ind_node).add(dep_node)
+        self._own_pred(dep_node).append(ind_node)
+        self.modified = True
+
+    def delete_edge(self, ind_node, dep_node):
+        if not self._has_node(ind_node) or dep_node not in self.downstream(ind_node):
+            raise KeyError("this edge does not exist in graph")
+        self._own_succ(ind_node).discard(dep_node)
+        self._own_pred(dep_node).remove(ind_node)
+        self.modified = True
+
+    def predecessors(self, node):
+        if node in self._pred:
+            return list(self._pred[node])
+        return list(self._base.predecessors.get(node, ()))
+
+    def downstream(self, node) -> list:
+        if not self._has_node(node):
+            raise KeyError("node %s is not in graph" % node)
+        if node in self._succ:
+            return list(self._succ[node])
+        return list(self._base.successors[node])
+
+    def all_downstreams(self, node):
+        if not self.modified:
+            return list(self._base.descendants[node])
+        return super().all_downstreams(node)
+
+    def all_leaves(self):
+        if not self.modified:
+            return list(self._base.leaves)
+        return [node for node in self._nodes() if not self.downstream(node)]
+
+    def ind_nodes(self, graph=None):
+        if graph is None and not self.modified:
+            return list(self._base.ind_nodes)
+        return super().ind_nodes(graph=graph)
+
+    def topological_sort(self, graph=None):
+        if graph is None and not self.modified:
+            return list(self._base.order)
+        return super().topological_sort(graph=graph)
+
+    def size(self):
+        return len(self._base.nodes) - len(self._removed) + len(self._added)
@@ -0,0 +1,129 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import math
+import time
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from fastapi.responses import JSONResponse
+from prometheus_client import Counter
+
+# seconds left to the request deadline, sent by the orchestrator to every node it calls
+DEADLINE_HEADER = "X-Request-Timeout"
+_DEADLINE_HEADER_KEY = DEADLINE_HEADER.lower().encode("latin-1")
+
+deadline_exceeded = Counter(
+    "request_deadline_exceeded", "Work abandoned because the deadline of its request had passed", ["stage"]
+)
+
+# time.monotonic() deadline of the request served by the current task, set by `DeadlineMiddleware`
+_current_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+def parse_timeout(value) -> Optional[float]:
+    """Seconds of a `X-Request-Timeout` value, None when it is missing or malformed."""
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        return None
+    return seconds if math.isfinite(seconds) else None
+
+
+def deadline_after(seconds: Optional[float]) -> Optional[float]:
+    """Deadline `seconds` from now, None for no deadline."""
+    return None if seconds is None else time.monotonic() + seconds
+
+
+def time_left(deadline: Optional[float]) -> Optional[float]:
+    """Seconds left to `deadline`, negative once it passed, None for no deadline."""
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def deadline_headers(deadline: Optional[float]) -> Dict[str, str]:
+    """Headers passing the time left to `deadline` on to the next hop."""
+    if deadline is None:
+        return {}
+    # relative, the clocks of the hosts need not agree
+    return {DEADLINE_HEADER: f"{max(time_left(deadline), 0):.3f}"}
+
+
+def current_deadline() -> Optional[float]:
+    """Deadline of the request being served, from its `X-Request-Timeout` header."""
+    return _current_deadline.get()
+
+
+class DeadlineExceeded(Exception):
+    """The deadline of a request passed before `stage` could complete."""
+
+    status_code = 504
+
+    def __init__(self, stage: str) -> None:
+        super().__init__(f"Request deadline exceeded in {stage}")
+        self.stage = stage
+
+    @property
+    def headers(self):
+        return {}
+
+
+async def within_deadline(awaitable, deadline: Optional[float] = None, stage: str = "handler"):
+    """Await `awaitable`, cancelled with DeadlineExceeded if it cannot finish before the deadline.
+
+    `deadline` defaults to the one of the request being served.
+    """
+    deadline = current_deadline() if deadline is None else deadline
+    if deadline is None:
+        return await awaitable
+    left = time_left(deadline)
+    if left <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        deadline_exceeded.labels(stage).inc()
+        raise DeadlineExceeded(stage)
+    try:
+        return await asyncio.wait_for(awaitable, left)
+    except asyncio.TimeoutError:
+        if time_left(deadline) > 0:
+            raise
+        deadline_exceeded.labels(stage).inc()
+        raise DeadlineExceeded(stage) from None
+
+
+async def deadline_exceeded_handler(request, exc: DeadlineExceeded) -> JSONResponse:
+    return JSONResponse({"detail": str(exc)}, status_code=exc.status_code)
+
+
+class DeadlineMiddleware:
+    """Make the `X-Request-Timeout` header of HTTP requests their deadline.
+
+    Requests arriving with no time left are answered 504 right away, the others are served with
+    their deadline available through `current_deadline` and `within_deadline`.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timeout = None
+        for key, value in scope["headers"]:
+            if key == _DEADLINE_HEADER_KEY:
+                timeout = parse_timeout(value.decode("latin-1"))
+                break
+        if timeout is None:
+            await self.app(scope, receive, send)
+            return
+        if timeout <= 0:
+            deadline_exceeded.labels("arrival").inc()
+            response = await deadline_exceeded_handler(None, DeadlineExceeded("arrival"))
+            await response(scope, receive, send)
+            return
+        token = _current_deadline.set(deadline_after(timeout))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current_deadline.reset(token)
@@ -0,0 +1,165 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import json
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+import aiohttp
+from prometheus_client.core import GaugeMetricFamily
+
+from .codec import HTTP_SERVICE_FAST_JSON, fast_json_available, json_dumps, json_loads
+from .logger import CustomLogger
+from .workers import register_collector
+
+logger = CustomLogger("comps-core-http-client")
+LOGFLAG = os.getenv("LOGFLAG", False)
+
+
+class HTTPClientPool:
+    """Long-lived aiohttp session with a tuned connection pool, shared by all orchestrator requests.
+
+    The session is created lazily inside the running event loop and recreated if the loop changes
+    or the session was closed, so it can be used from the services' dedicated event loops.
+    """
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 32,
+        keepalive_timeout: float = 60,
+        dns_cache_ttl: int = 300,
+        total_timeout: float = 2000,
+        trust_env: bool = True,
+        fast_json: bool = False,
+    ) -> None:
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.total_timeout = total_timeout
+        self.trust_env = trust_env
+        self.fast_json = fast_json and fast_json_available()
+        # request bodies are encoded by the session, replies decoded with `response.json(loads=pool.json_loads)`
+        self.json_loads = json_loads if self.fast_json else json.loads
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @classmethod
+    def from_env(cls) -> "HTTPClientPool":
+        return cls(
+            limit=int(os.getenv("ORCHESTRATOR_HTTP_POOL_LIMIT", 100)),
+            limit_per_host=int(os.getenv("ORCHESTRATOR_HTTP_POOL_LIMIT_PER_HOST", 32)),
+            keepalive_timeout=float(os.getenv("ORCHESTRATOR_HTTP_KEEPALIVE_TIMEOUT", 60)),
+            dns_cache_ttl=int(os.getenv("ORCHESTRATOR_HTTP_DNS_CACHE_TTL", 300)),
+            total_timeout=float(os.getenv("ORCHESTRATOR_HTTP_TIMEOUT", 2000)),
+            fast_json=HTTP_SERVICE_FAST_JSON,
+        )
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.dns_cache_ttl,
+            use_dns_cache=True,
+        )
+        timeout = aiohttp.ClientTimeout(total=self.total_timeout)
+        if LOGFLAG:
+            logger.info(
+                f"Creating orchestrator HTTP pool: limit={self.limit}, limit_per_host={self.limit_per_host}, "
+                f"keepalive={self.keepalive_timeout}s, dns_ttl={self.dns_cache_ttl}s"
+            )
+        json_serialize = (lambda obj: json_dumps(obj).decode("utf-8")) if self.fast_json else json.dumps
+        return aiohttp.ClientSession(
+            connector=connector, timeout=timeout, trust_env=self.trust_env, json_serialize=json_serialize
+        )
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        """Return the shared session, creating it on first use in the current event loop."""
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            if self._session is not None and not self._session.closed and self._loop is not loop:
+                logger.warning("Event loop changed, recreating the orchestrator HTTP pool")
+                self._discard_session(self._session, self._loop)
+            self._session = self._create_session()
+            self._loop = loop
+        return self._session
+
+    @staticmethod
+    def _discard_session(session: aiohttp.ClientSession, loop: asyncio.AbstractEventLoop) -> None:
+        """Release a session of another event loop, its connections can only be closed by that loop."""
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(session.close(), loop)
+            return
+        connector = session.connector
+        session.detach()
+        # the transports finish closing when the loop runs again, those of a closed loop can only be
+        # left to the garbage collector
+        if connector is not None and not loop.is_closed():
+            connector.close()
+
+    async def close(self) -> None:
+        """Close the session and release all pooled connections."""
+        session, self._session = self._session, None
+        if session is not None and not session.closed:
+            await session.close()
+            # give the underlying transports a chance to finish closing (see aiohttp docs)
+            await asyncio.sleep(0.250)
+
+    def stats(self) -> Dict[Tuple[str, str], Dict[str, int]]:
+        """Return in-use and idle connection counts keyed by (host, port)."""
+        result = {}
+        session = self._session
+        if session is None or session.closed:
+            return result
+        connector = session.connector
+        # aiohttp does not expose pool occupancy publicly, read the connector bookkeeping
+        for key, conns in (getattr(connector, "_conns", None) or {}).items():
+            entry = result.setdefault((key.host, str(key.port)), {"in_use": 0, "idle": 0})
+            entry["idle"] += len(conns)
+        for key, conns in (getattr(connector, "_acquired_per_host", None) or {}).items():
+            entry = result.setdefault((key.host, str(key.port)), {"in_use": 0, "idle": 0})
+            entry["in_use"] += len(conns)
+        return result
+
+
+class HTTPClientPoolCollector:
+    """Prometheus collector exposing the connection pool occupancy at scrape time."""
+
+    def __init__(self, pool: HTTPClientPool) -> None:
+        self.pool = pool
+
+    def collect(self):
+        connections = GaugeMetricFamily(
+            "megaservice_http_pool_connections",
+            "Orchestrator HTTP pool connections per downstream host (gauge)",
+            labels=["host", "port", "state"],
+        )
+        for (host, port), counts in self.pool.stats().items():
+            connections.add_metric([host, port, "in_use"], counts["in_use"])
+            connections.add_metric([host, port, "idle"], counts["idle"])
+        yield connections
+
+        limits = GaugeMetricFamily(
+            "megaservice_http_pool_limit", "Configured orchestrator HTTP pool limits (gauge)", labels=["scope"]
+        )
+        limits.add_metric(["total"], self.pool.limit)
+        limits.add_metric(["per_host"], self.pool.limit_per_host)
+        yield limits
+
+
+_pool_lock = threading.Lock()
+_http_client_pool = None
+
+
+def get_http_client_pool() -> HTTPClientPool:
+    """Return the process-wide pool, registering its Prometheus collector on first use."""
+    global _http_client_pool
+    with _pool_lock:
+        if _http_client_pool is None:
+            _http_client_pool = HTTPClientPool.from_env()
+            register_collector(HTTPClientPoolCollector(_http_client_pool))
+    return _http_client_pool
@@ -14,6 +14,22 @@ from uvicorn import Config, Server
 
 from .base_service import BaseService
 from .base_statistics import collect_all_statistics
+from .codec import (
+    HTTP_SERVICE_COMPRESSION,
+    HTTP_SERVICE_FAST_JSON,
+    CompressionMiddleware,
+    FastJSONResponse,
+    FastJSONRoute,
+    fast_json_available,
+)
+from .deadline import DeadlineExceeded, DeadlineMiddleware, deadline_exceeded_handler
+from .workers import (
+    HTTP_SERVICE_GRACEFUL_TIMEOUT,
+    HTTP_SERVICE_WORKERS,
+    WorkerSupervisor,
+    multiprocess_metrics_enabled,
+    publish_collectors_forever,
+)
 
 
 class HTTPService(BaseService):
@@ -26,17 +42,29 @@ class HTTPService(BaseService):
         self,
         uvicorn_kwargs: Optional[dict] = None,
         cors: Optional[bool] = True,
+        workers: Optional[int] = None,
+        fast_json: Optional[bool] = None,
+        compression: Optional[bool] = None,
         **kwargs,
     ):
         """Initialize the HTTPService
         :param uvicorn_kwargs: Dictionary of kwargs arguments that will be passed to Uvicorn server when starting the server
         :param cors: If set, a CORS middleware is added to FastAPI frontend to allow cross-origin access.
+        :param workers: Number of pre-forked processes serving the port, defaults to env HTTP_SERVICE_WORKERS (1).
+            With more than one, set PROMETHEUS_MULTIPROC_DIR to aggregate the metrics of the workers.
+        :param fast_json: Parse request bodies and render JSON responses with orjson, defaults to env HTTP_SERVICE_FAST_JSON.
+        :param compression: Compress large non-streaming responses with brotli or gzip as accepted by the client,
+            defaults to env HTTP_SERVICE_COMPRESSION.
 
         :param kwargs: keyword args
         """
         super().__init__(**kwargs)
         self.uvicorn_kwargs = uvicorn_kwargs or {}
         self.cors = cors
+        self.workers = workers or HTTP_SERVICE_WORKERS
+        self.fast_json = HTTP_SERVICE_FAST_JSON if fast_json is None else fast_json
+        self.compression = HTTP_SERVICE_COMPRESSION if compression is None else compression
+        self._socket = None
         self._app = self._create_app()
         Instrumentator().instrument(self._app).expose(self._app)
 
@@ -51,7 +79,24 @@ class HTTPService(BaseService):
 
         :return: a FastAPI application.
         """
-        app = FastAPI(title=self.title, description=self.description)
+        if self.fast_json and not fast_json_available():
+            self.logger.warning("orjson is not installed, the fast JSON codec is disabled")
+            self.fast_json = False
+        if self.fast_json:
+            app = FastAPI(title=self.title, description=self.description, default_response_class=FastJSONResponse)
+            # applies to the routes added from now on, i.e. all of them
+            app.router.route_class = FastJSONRoute
+            self.logger.info("Fast JSON codec is enabled.")
+        else:
+            app = FastAPI(title=self.title, description=self.description)
+
+        # requests carrying an X-Request-Timeout are served within it, see `within_deadline`
+        app.add_middleware(DeadlineMiddleware)
+        app.add_exception_handler(DeadlineExceeded, deadline_exceeded_handler)
+
+        if self.compression:
+            app.add_middleware(CompressionMiddleware)
+            self.logger.info("Response compression is enabled.")
 
         if self.cors:
             from fastapi.middleware.cors import CORSMiddleware
@@ -98,6 +143,11 @@ class HTTPService(BaseService):
         async def startup_event():
             asyncio.create_task(func)
 
+    def add_shutdown_event(self, func):
+        @self.app.on_event("shutdown")
+        async def shutdown_event():
+            await func()
+
     async def initialize_server(self):
         """Initialize and return HTTP server."""
         self.logger.info("Setting up HTTP server")
@@ -125,20 +175,41 @@ class HTTPService(BaseService):
                 """
                 await self.main_loop()
 
-        self.server = UviServer(
-            config=Config(
-                app=self.app,
-                host=self.host_address,
-                port=self.primary_port,
-                log_level="info",
-                **self.uvicorn_kwargs,
-            )
-        )
+        self.server = UviServer(config=self._server_config())
         logging.getLogger("uvicorn.access").addFilter(lambda record: "/v1/health_check" not in record.getMessage())
         self.logger.info(f"Uvicorn server setup on port {self.primary_port}")
         await self.server.setup_server()
         self.logger.info("HTTP server setup successful")
 
+    def _server_config(self) -> Config:
+        return Config(
+            app=self.app,
+            host=self.host_address,
+            port=self.primary_port,
+            log_level="info",
+            **self.uvicorn_kwargs,
+        )
+
+    def _bind_socket(self):
+        """Bind the listening socket shared by the worker processes."""
+        config = self._server_config()
+        config.timeout_graceful_shutdown = config.timeout_graceful_shutdown or HTTP_SERVICE_GRACEFUL_TIMEOUT
+        self._socket = config.bind_socket()
+        self._worker_config = config
+        self.logger.info(f"Listening on port {self.primary_port} with {self.workers} worker processes")
+
+    def _serve_worker(self):
+        """Serve the app on the shared socket, entry point of the worker processes."""
+        logging.getLogger("uvicorn.access").addFilter(lambda record: "/v1/health_check" not in record.getMessage())
+        server = Server(config=self._worker_config)
+
+        async def serve():
+            if multiprocess_metrics_enabled():
+                asyncio.create_task(publish_collectors_forever())
+            await server.serve(sockets=[self._socket])
+
+        asyncio.run(serve())
+
     async def execute_server(self):
         """Run the HTTP server indefinitely."""
         await self.server.start_server()
@@ -153,17 +224,32 @@ class HTTPService(BaseService):
     def _async_setup(self):
         self.event_loop = asyncio.new_event_loop()
         asyncio.set_event_loop(self.event_loop)
-        self.event_loop.run_until_complete(self.initialize_server())
+        if self.workers > 1:
+            # the servers and their startup events run in the worker processes forked by `start`
+            self._bind_socket()
+        else:
+            self.event_loop.run_until_complete(self.initialize_server())
 
     def start(self):
         """Running method to block the main thread.
 
         This method runs the event loop until a Future is done. It is designed to be called in the main thread to keep it busy.
+        With several workers, the main thread supervises the worker processes instead, see `WorkerSupervisor`.
         """
+        if self.workers > 1:
+            supervisor = WorkerSupervisor(
+                self._serve_worker,
+                self.workers,
+                self._worker_config.timeout_graceful_shutdown,
+                name=self.title,
+            )
+            supervisor.run()
+            return
         self.event_loop.run_until_complete(self.execute_server())
 
     def stop(self):
-        self.event_loop.run_until_complete(self.terminate_server())
+        if self.server is not None:
+            self.event_loop.run_until_complete(self.terminate_server())
         self.event_loop.stop()
         self.event_loop.close()
         self.logger.close()
@@ -12,6 +12,7 @@ from ..proto.docarray import TextDoc
 from .constants import MCPFuncType, ServiceRoleType, ServiceType
 from .http_service import HTTPService
 from .logger import CustomLogger
+from .policy import NodePolicy
 from .utils import check_ports_availability
 
 opea_microservices = {}
@@ -48,8 +49,16 @@ class MicroService(HTTPService):
         enable_mcp: bool = False,
         mcp_func_type: Enum = MCPFuncType.TOOL,
         func: AnyFunction = None,
+        workers: Optional[int] = None,
+        policy: Optional[NodePolicy] = None,
+        replicas: Optional[List[str]] = None,
     ):
-        """Init the microservice."""
+        """Init the microservice.
+
+        `policy` sets the timeouts, retries and circuit breaking of the orchestrator calls to a remote service.
+        `replicas` lists the `host`, `host:port` or base URLs of the instances of a remote service that the
+        orchestrator balances the calls over, `host` and `port` are used when not set.
+        """
         self.service_role = service_role
         self.service_type = service_type
         self.protocol = protocol
@@ -60,6 +69,8 @@ class MicroService(HTTPService):
         self.input_datatype = input_datatype
         self.output_datatype = output_datatype
         self.use_remote_service = use_remote_service
+        self.policy = policy
+        self.replicas = replicas or []
         self.description = description
         self.enable_mcp = enable_mcp
         self.dynamic_batching = dynamic_batching
@@ -91,7 +102,10 @@ class MicroService(HTTPService):
                 "description": self.description or "OPEA Microservice Infrastructure",
             }
 
-            super().__init__(uvicorn_kwargs=self.uvicorn_kwargs, runtime_args=runtime_args)
+            # MCP runs its own server in the main process
+            super().__init__(
+                uvicorn_kwargs=self.uvicorn_kwargs, workers=1 if enable_mcp else workers, runtime_args=runtime_args
+            )
 
             # create a batch request processor loop if using dynamic batching
             if self.dynamic_batching:
@@ -163,6 +177,18 @@ class MicroService(HTTPService):
         else:
             return f"{self.protocol}://{self.host}:{self.port}{self.endpoint}"
 
+    def replica_paths(self) -> List[str]:
+        """Endpoint URL of every replica of a remote service."""
+        if not self.replicas or self.api_key:
+            return [self.endpoint_path(None)]
+        urls = []
+        for replica in self.replicas:
+            base = replica if "://" in replica else f"{self.protocol}://{replica}"
+            if ":" not in base.split("://", 1)[1]:
+                base = f"{base}:{self.port}"
+            urls.append(f"{base.rstrip('/')}{self.endpoint}")
+        return urls
+
     def start(self):
         """Start the server using MCP if enabled, otherwise fall back to default."""
         if self.enable_mcp:
@@ -3,29 +3,55 @@
 
 import asyncio
 import contextlib
-import copy
-import json
 import os
 import re
 import threading
 import time
-from typing import Dict, List
+from typing import Callable, Dict, List, Optional, Tuple
 
 import aiohttp
-import requests
 from fastapi.responses import StreamingResponse
 from prometheus_client import Gauge, Histogram
 from pydantic import BaseModel
 
+from ..common.cache import EmbeddingCache
 from ..proto.docarray import LLMParams
 from ..telemetry.opea_telemetry import opea_telemetry, tracer
+from .admission import AdmissionController
+from .balancer import LoadBalancer, hedged_requests
 from .constants import ServiceType
+from .context import ClosingStream
 from .dag import DAG
+from .deadline import DeadlineExceeded, deadline_exceeded, deadline_headers, time_left
+from .http_client import get_http_client_pool
 from .logger import CustomLogger
+from .policy import (
+    RETRYABLE_STATUSES,
+    CircuitBreaker,
+    CircuitOpenError,
+    NodePolicy,
+    RetryBudget,
+    node_retries,
+    node_retries_denied,
+    node_skipped,
+)
+from .singleflight import SingleFlight, StreamMulticast
 
 logger = CustomLogger("comps-core-orchestrator")
 LOGFLAG = os.getenv("LOGFLAG", False)
 ENABLE_OPEA_TELEMETRY = bool(os.environ.get("TELEMETRY_ENDPOINT"))
+# policy of the services added without one: the pool timeout, no retries, no breaker
+DEFAULT_NODE_POLICY = NodePolicy()
+# seconds the model reported by an embedding service is trusted, or its lookup failure remembered
+EMBEDDING_MODEL_REFRESH = 60
+
+
+def _no_release() -> None:
+    pass
+
+
+def _failed_reply(task: asyncio.Future) -> bool:
+    return task.exception() is not None or task.result()[0].status in RETRYABLE_STATUSES
 
 
 class OrchestratorMetrics:
@@ -72,8 +98,11 @@ class OrchestratorMetrics:
         with self._lock:
             # in case another thread already got here
             if self.pending_update == self._pending_update_create:
+                # summed over the live workers when metrics are shared by several processes
                 self.request_pending = Gauge(
-                    "megaservice_request_pending", "Count of currently pending requests (gauge)"
+                    "megaservice_request_pending",
+                    "Count of currently pending requests (gauge)",
+                    multiprocess_mode="livesum",
                 )
                 self.pending_update = self._pending_update_real
         self.pending_update(increase)
@@ -105,6 +134,15 @@ class ServiceOrchestrator(DAG):
 
     def __init__(self) -> None:
         self.metrics = _metrics
+        self.http_pool = get_http_client_pool()
+        self.embedding_cache = EmbeddingCache.from_env()
+        self.embedding_models: Dict[str, Tuple[Optional[str], float]] = {}  # node -> (model id, refresh at)
+        self.single_flight = SingleFlight("schedule")
+        # caps the pipelines run concurrently by the callers of `schedule`, None without a cap
+        self.admission = AdmissionController.from_env()
+        self.retry_budget = RetryBudget.from_env()
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.balancers: Dict[str, Optional[LoadBalancer]] = {}
         self.services = {}  # all services, id -> service
         super().__init__()
 
@@ -124,27 +162,234 @@ class ServiceOrchestrator(DAG):
             logger.error(e)
             return False
 
+    def node_policy(self, node: str) -> NodePolicy:
+        return getattr(self.services[node], "policy", None) or DEFAULT_NODE_POLICY
+
+    def node_breaker(self, node: str, policy: NodePolicy):
+        """Circuit breaker of `node`, None when its policy has none."""
+        if policy.breaker_threshold <= 0:
+            return None
+        breaker = self.breakers.get(node)
+        if breaker is None:
+            breaker = self.breakers[node] = CircuitBreaker(
+                node, policy.breaker_threshold, policy.breaker_reset_timeout
+            )
+        return breaker
+
+    def node_balancer(self, node: str, policy: NodePolicy) -> Optional[LoadBalancer]:
+        """Load balancer of `node`, None when it has a single endpoint."""
+        if node not in self.balancers:
+            service = self.services[node]
+            urls = service.replica_paths() if hasattr(service, "replica_paths") else []
+            self.balancers[node] = (
+                LoadBalancer(node, urls, policy.balancing, policy.eject_threshold, policy.eject_time)
+                if len(urls) > 1
+                else None
+            )
+        return self.balancers[node]
+
+    async def call_node(
+        self,
+        session: aiohttp.ClientSession,
+        cur_node: str,
+        endpoint: str,
+        input_data,
+        headers: Dict,
+        deadline: Optional[float] = None,
+    ) -> aiohttp.ClientResponse:
+        """POST `input_data` to a node under its `NodePolicy` and read the reply.
+
+        Returns the reply of the last attempt, possibly an error status once the retries are exhausted.
+        Raises CircuitOpenError when the breaker of the node refuses the call, or the timeout or
+        connection error of the last attempt. `endpoint` is replaced by the one of the picked replica
+        for the nodes with several replicas.
+
+        With a `deadline` (time.monotonic()), the time left is sent to the node as `X-Request-Timeout`
+        and bounds every attempt, DeadlineExceeded is raised once it passed.
+        """
+        response, _ = await self._call_node(session, cur_node, endpoint, input_data, headers, False, deadline)
+        return response
+
+    async def open_stream(
+        self,
+        session: aiohttp.ClientSession,
+        cur_node: str,
+        endpoint: str,
+        input_data,
+        headers: Dict,
+        deadline: Optional[float] = None,
+    ) -> Tuple[aiohttp.ClientResponse, Callable[[], None]]:
+        """`call_node` for a streamed reply, whose body is not read.
+
+        Also returns the callable to call once the stream ended, until which the replica serving it
+        counts the call as outstanding.
+        """
+        return await self._call_node(session, cur_node, endpoint, input_data, headers, True, deadline)
+
+    async def _call_node(
+        self, session, cur_node: str, endpoint: str, input_data, headers: Dict, stream: bool, deadline=None
+    ):
+        policy = self.node_policy(cur_node)
+        breaker = self.node_breaker(cur_node, policy)
+        balancer = self.node_balancer(cur_node, policy)
+        self.retry_budget.record_call()
+        # replicas already tried by this call, retries go to another one when possible
+        tried = []
+        retry = 0
+        while True:
+            left = time_left(deadline)
+            if left is not None and left <= 0:
+                deadline_exceeded.labels(cur_node).inc()
+                raise DeadlineExceeded(cur_node)
+            if breaker is not None and not breaker.allow():
+                raise CircuitOpenError(cur_node, breaker.retry_after())
+            timeout = policy.client_timeout(self.http_pool.total_timeout, left)
+            if deadline is not None:
+                headers = {**headers, **deadline_headers(deadline)}
+            response = error = None
+            try:
+                if balancer is None:
+                    response = await self._post(session, endpoint, input_data, headers, timeout, stream)
+                    release = _no_release
+                else:
+                    response, release = await self._post_balanced(
+                        session, cur_node, balancer, policy, input_data, headers, timeout, stream, tried
+                    )
+            except asyncio.TimeoutError as e:
+                reason, error = "timeout", e
+            except aiohttp.ClientError as e:
+                reason, error = "connection", e
+            else:
+                if response.status not in RETRYABLE_STATUSES:
+                    if breaker is not None:
+                        breaker.record_success()
+                    return response, release
+                reason = "status"
+            if breaker is not None:
+                # a 429 is the node shedding load, not failing
+                if error is not None or response.status >= 500:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+            left = time_left(deadline)
+            if left is not None and left <= 0 and reason == "timeout":
+                # the attempt was cut by the deadline rather than by the node policy
+                deadline_exceeded.labels(cur_node).inc()
+                raise DeadlineExceeded(cur_node) from error
+            if retry >= policy.max_retries:
+                break
+            backoff = policy.backoff(retry)
+            if left is not None and backoff >= left:
+                # no time left for another attempt
+                break
+            if not self.retry_budget.try_retry():
+                node_retries_denied.labels(cur_node).inc()
+                break
+            node_retries.labels(cur_node, reason).inc()
+            await asyncio.sleep(backoff)
+            retry += 1
+        if error is not None:
+            raise error
+        return response, _no_release
+
+    @staticmethod
+    async def _post(session, url: str, input_data, headers: Dict, timeout, stream: bool) -> aiohttp.ClientResponse:
+        response = await session.post(url, json=input_data, headers=headers, timeout=timeout)
+        if not stream or response.status in RETRYABLE_STATUSES:
+            await response.read()
+        return response
+
+    async def _post_replica(self, balancer: LoadBalancer, replica, session, input_data, headers, timeout, stream):
+        start = time.monotonic()
+        try:
+            response = await self._post(session, replica.url, input_data, headers, timeout, stream)
+        except asyncio.CancelledError:
+            balancer.release(replica)
+            raise
+        except BaseException:
+            balancer.observe(replica, time.monotonic() - start, False)
+            balancer.release(replica)
+            raise
+        balancer.observe(replica, time.monotonic() - start, response.status < 500 and response.status != 429)
+        if stream and response.ok:
+            return response, lambda: balancer.release(replica)
+        balancer.release(replica)
+        return response, _no_release
+
+    async def _post_balanced(
+        self, session, cur_node: str, balancer: LoadBalancer, policy: NodePolicy, input_data, headers, timeout, stream, tried
+    ):
+        """POST to the best replica, hedged to a second one if the reply takes longer than usual."""
+        replica = balancer.acquire(exclude=tried)
+        tried.append(replica)
+        primary = asyncio.ensure_future(
+            self._post_replica(balancer, replica, session, input_data, headers, timeout, stream)
+        )
+        tasks = [primary]
+        try:
+            delay = None if stream or policy.hedge_quantile is None else balancer.hedge_delay(policy.hedge_quantile)
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                # hedges are duplicate load, they draw from the retry budget
+                if not done and self.retry_budget.try_retry():
+                    hedge_replica = balancer.acquire(exclude=tried)
+                    tried.append(hedge_replica)
+                    tasks.append(
+                        asyncio.ensure_future(
+                            self._post_replica(balancer, hedge_replica, session, input_data, headers, timeout, stream)
+                        )
+                    )
+            pending = set(tasks)
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # the first good reply wins, a failure is only returned once every request failed
+                for task in sorted(done, key=_failed_reply):
+                    if not pending or not _failed_reply(task):
+                        if len(tasks) > 1:
+                            hedged_requests.labels(cur_node, "primary" if task is primary else "hedge").inc()
+                        return task.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def skip_node(self, cur_node: str, reason, inputs, runtime_graph, llm_parameters_dict, **kwargs):
+        logger.warning(f"Skipping optional node {cur_node}: {str(reason) or type(reason).__name__}")
+        node_skipped.labels(cur_node).inc()
+        return self.align_skipped(inputs, cur_node, runtime_graph, llm_parameters_dict, **kwargs), cur_node
+
+    async def close(self):
+        """Release the pooled HTTP connections, call on service shutdown."""
+        await self.http_pool.close()
+
     @opea_telemetry
     async def schedule(self, initial_inputs: Dict | BaseModel, llm_parameters: LLMParams = LLMParams(), **kwargs):
+        """Run the pipeline for one request.
+
+        Extra keyword arguments, e.g. the `RequestContext` of the request as `context`, are passed on to
+        `execute` and the `align_*` hooks. The deadline of the context is sent to every node and bounds
+        its calls, optional nodes are skipped when it is closer than their `NodePolicy.min_budget`.
+        """
         req_start = time.monotonic()
         self.metrics.pending_update(True)
 
         result_dict = {}
-        runtime_graph = DAG()
-        runtime_graph.graph = copy.deepcopy(self.graph)
+        # the graph is compiled once, each request only gets a copy-on-write overlay for runtime edits
+        plan = self.compile()
+        runtime_graph = plan.overlay()
         if LOGFLAG:
             logger.info(initial_inputs)
 
-        timeout = aiohttp.ClientTimeout(total=2000)
-        async with aiohttp.ClientSession(trust_env=True, timeout=timeout) as session:
-            pending = {
-                asyncio.create_task(
-                    self.execute(session, req_start, node, initial_inputs, runtime_graph, llm_parameters, **kwargs)
-                )
-                for node in self.ind_nodes()
-            }
-            ind_nodes = self.ind_nodes()
+        session = await self.http_pool.get_session()
+        pending = {
+            asyncio.create_task(
+                self.execute(session, req_start, node, initial_inputs, runtime_graph, llm_parameters, **kwargs)
+            )
+            for node in plan.ind_nodes
+        }
+        ind_nodes = plan.ind_nodes
 
+        try:
             while pending:
                 done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
                 for done_task in done:
@@ -178,8 +423,9 @@ class ServiceOrchestrator(DAG):
                                 )
 
                     for d_node in downstreams:
-                        if all(i in result_dict for i in runtime_graph.predecessors(d_node)):
-                            inputs = self.process_outputs(runtime_graph.predecessors(d_node), result_dict)
+                        predecessors = runtime_graph.predecessors(d_node)
+                        if all(i in result_dict for i in predecessors):
+                            inputs = self.process_outputs(predecessors, result_dict)
                             pending.add(
                                 asyncio.create_task(
                                     self.execute(
@@ -187,16 +433,24 @@ class ServiceOrchestrator(DAG):
                                     )
                                 )
                             )
-        nodes_to_keep = []
-        for i in ind_nodes:
-            nodes_to_keep.append(i)
-            nodes_to_keep.extend(runtime_graph.all_downstreams(i))
+        except asyncio.CancelledError:
+            # the request was abandoned, stop the nodes still running instead of letting them complete unseen
+            for task in pending:
+                task.cancel()
+            self.metrics.pending_update(False)
+            raise
+        if runtime_graph.modified:
+            # drop the nodes that runtime edits cut off from the entry nodes
+            nodes_to_keep = set()
+            for i in ind_nodes:
+                nodes_to_keep.add(i)
+                nodes_to_keep.update(runtime_graph.all_downstreams(i))
 
-        all_nodes = list(runtime_graph.graph.keys())
+            all_nodes = list(runtime_graph.graph.keys())
 
-        for node in all_nodes:
-            if node not in nodes_to_keep:
-                runtime_graph.delete_node_if_exists(node)
+            for node in all_nodes:
+                if node not in nodes_to_keep:
+                    runtime_graph.delete_node_if_exists(node)
 
         if not llm_parameters.stream:
             self.metrics.pending_update(False)
@@ -211,7 +465,7 @@ class ServiceOrchestrator(DAG):
             all_outputs.update(result_dict[prev_node])
         return all_outputs
 
-    def wrap_iterable(self, iterable, is_first=True):
+    async def wrap_iterable(self, iterable, is_first=True):
 
         with tracer.start_as_current_span("llm_generate_stream") if ENABLE_OPEA_TELEMETRY else contextlib.nullcontext():
             while True:
@@ -221,15 +475,49 @@ class ServiceOrchestrator(DAG):
                     else contextlib.nullcontext()
                 ):  #  else tracer.start_as_current_span(f"llm_generate_stream_next_token")
                     try:
-                        token = next(iterable)
+                        token = await iterable.__anext__()
                         yield token
                         is_first = False
-                    except StopIteration:
+                    except StopAsyncIteration:
                         # Exiting the iterable loop cleanly
                         break
                     except Exception as e:
                         raise e
 
+    async def schedule_coalesced(
+        self,
+        key,
+        initial_inputs: Dict | BaseModel,
+        llm_parameters: LLMParams = LLMParams(),
+        release: Optional[Callable[[], None]] = None,
+        **kwargs,
+    ):
+        """`schedule` variant sharing one execution between concurrent calls with the same `key`.
+
+        Returns (result_dict, runtime_graph, is_leader), `is_leader` is False for callers served by an
+        execution started by another request. Streaming results are multicast: every caller gets its
+        own StreamingResponse replaying the single upstream LLM stream, and the key stays joinable
+        until that stream ended. `release` frees what the caller acquired to run the pipeline, e.g. its
+        admission slot, once that shared execution is over, even if the caller left earlier.
+        """
+
+        async def run():
+            result_dict, runtime_graph = await self.schedule(initial_inputs, llm_parameters, **kwargs)
+            for node, response in result_dict.items():
+                if isinstance(response, StreamingResponse):
+                    result_dict[node] = StreamMulticast(response)
+            return result_dict, runtime_graph
+
+        async def hold(result):
+            await asyncio.gather(*(r.wait_done() for r in result[0].values() if isinstance(r, StreamMulticast)))
+
+        (shared_dict, runtime_graph), is_leader = await self.single_flight.do(key, run, hold, release)
+        result_dict = {
+            node: response.response() if isinstance(response, StreamMulticast) else response
+            for node, response in shared_dict.items()
+        }
+        return result_dict, runtime_graph, is_leader
+
     @opea_telemetry
     async def execute(
         self,
@@ -253,41 +541,33 @@ class ServiceOrchestrator(DAG):
                     inputs[field] = value
         # pre-process
         inputs = self.align_inputs(inputs, cur_node, runtime_graph, llm_parameters_dict, **kwargs)
+        deadline = getattr(kwargs.get("context"), "deadline", None)
+        policy = self.node_policy(cur_node)
+        if policy.optional and deadline is not None and time_left(deadline) < policy.min_budget:
+            # the time left goes to the nodes that follow
+            return self.skip_node(
+                cur_node, "request deadline too close", inputs, runtime_graph, llm_parameters_dict, **kwargs
+            )
         access_token = self.services[cur_node].api_key_value
         if access_token:
             endpoint = self.services[cur_node].endpoint_path(inputs["model"])
         else:
             endpoint = self.services[cur_node].endpoint_path(None)
         if is_llm_vlm and llm_parameters.stream:
-            # Still leave to sync requests.post for StreamingResponse
+            # stream through the shared aiohttp session so a slow first token never blocks the event loop
             if LOGFLAG:
                 logger.info(inputs)
+            headers = {"Content-type": "application/json"}
+            if access_token:
+                headers["Authorization"] = f"Bearer {access_token}"
             with (
                 tracer.start_as_current_span(f"{cur_node}_asyn_generate")
                 if ENABLE_OPEA_TELEMETRY
                 else contextlib.nullcontext()
             ):
-                if access_token:
-                    response = requests.post(
-                        url=endpoint,
-                        data=json.dumps(inputs),
-                        headers={"Content-type": "application/json", "Authorization": f"Bearer {access_token}"},
-                        proxies={"http": None},
-                        stream=True,
-                        timeout=2000,
-                    )
-
-                else:
-                    response = requests.post(
-                        url=endpoint,
-                        data=json.dumps(inputs),
-                        headers={
-                            "Content-type": "application/json",
-                        },
-                        proxies={"http": None},
-                        stream=True,
-                        timeout=2000,
-                    )
+                response, release_node = await self.open_stream(
+                    session, cur_node, endpoint, inputs, headers, deadline
+                )
 
             downstream = runtime_graph.downstream(cur_node)
             if downstream:
@@ -296,49 +576,52 @@ class ServiceOrchestrator(DAG):
                 hitted_ends = [".", "?", "!", "。", "，", "！"]
                 downstream_endpoint = self.services[downstream[0]].endpoint_path()
 
-            def generate():
+            closed = False
+
+            def close_stream(completed: bool = False) -> None:
+                nonlocal closed
+                if closed:
+                    return
+                closed = True
+                if completed:
+                    # return the connection to the pool
+                    response.release()
+                else:
+                    # abandoned midway or before it started (client disconnect): closing the connection makes
+                    # the LLM server abort the generation instead of producing tokens nobody reads
+                    response.close()
+                release_node()
+                self.metrics.pending_update(False)
+
+            async def generate():
                 token_start = req_start
-                if response:
-                    # response.elapsed = time until first headers received
+                completed = False
+                try:
+                    if not response.ok:
+                        logger.error(f"LLM stream request to {endpoint} failed with status {response.status}")
+                        return
                     buffered_chunk_str = ""
                     is_first = True
-                    for chunk in self.wrap_iterable(response.iter_content(chunk_size=None)):
+                    async for chunk in self.wrap_iterable(response.content.iter_any()):
                         if chunk:
                             if downstream:
                                 chunk = chunk.decode("utf-8")
                                 buffered_chunk_str += self.extract_chunk_str(chunk)
                                 is_last = chunk.endswith("[DONE]\n\n")
                                 if (buffered_chunk_str and buffered_chunk_str[-1] in hitted_ends) or is_last:
-                                    if access_token:
-                                        res = requests.post(
-                                            url=downstream_endpoint,
-                                            data=json.dumps({"text": buffered_chunk_str}),
-                                            headers={
-                                                "Content-type": "application/json",
-                                                "Authorization": f"Bearer {access_token}",
-                                            },
-                                            proxies={"http": None},
-                                            timeout=2000,
-                                        )
-                                    else:
-                                        res = requests.post(
-                                            url=downstream_endpoint,
-                                            data=json.dumps({"text": buffered_chunk_str}),
-                                            headers={
-                                                "Content-type": "application/json",
-                                            },
-                                            proxies={"http": None},
-                                            timeout=2000,
-                                        )
-                                    res_json = res.json()
+                                    async with session.post(
+                                        downstream_endpoint, json={"text": buffered_chunk_str}, headers=headers
+                                    ) as res:
+                                        res_json = await res.json(loads=self.http_pool.json_loads)
                                     if "text" in res_json:
                                         res_txt = res_json["text"]
                                     else:
                                         raise Exception("Other response types not supported yet!")
                                     buffered_chunk_str = ""  # clear
-                                    yield from self.token_generator(
+                                    for token in self.token_generator(
                                         res_txt, token_start, is_first=is_first, is_last=is_last
-                                    )
+                                    ):
+                                        yield token
                                     token_start = time.monotonic()
                                     is_first = False
                             else:
@@ -347,12 +630,13 @@ class ServiceOrchestrator(DAG):
                                 yield chunk
 
                     self.metrics.request_update(req_start)
-                    self.metrics.pending_update(False)
+                    completed = True
+                finally:
+                    close_stream(completed)
 
-            return (
-                StreamingResponse(self.align_generator(generate(), **kwargs), media_type="text/event-stream"),
-                cur_node,
-            )
+            # the upstream response is already open, it is released even if the body is closed unread
+            body = ClosingStream(self.align_generator(generate(), **kwargs), close_stream)
+            return StreamingResponse(body, media_type="text/event-stream"), cur_node
         else:
             if LOGFLAG:
                 logger.info(inputs)
@@ -363,15 +647,45 @@ class ServiceOrchestrator(DAG):
             else:
                 input_data = inputs
 
-            with (
-                tracer.start_as_current_span(f"{cur_node}_generate")
-                if ENABLE_OPEA_TELEMETRY
-                else contextlib.nullcontext()
-            ):
-                response = await session.post(
-                    endpoint,
-                    json=input_data,
-                    headers={"Content-type": "application/json", "Authorization": f"Bearer {access_token}"},
+            # a query embedded already for this request, or cached, skips the HTTP hop to the embedding service
+            cache_text = None
+            if self.services[cur_node].service_type == ServiceType.EMBEDDING:
+                query_text = self.embedding_cache_text(input_data)
+                query_embedding = getattr(kwargs.get("context"), "query_embedding", None)
+                data = None
+                if query_text is not None and query_embedding is not None and query_embedding[0] == query_text:
+                    data = query_embedding[1]
+                elif query_text is not None and self.embedding_cache is not None:
+                    model_id = await self.embedding_model(cur_node)
+                    if model_id is not None:
+                        cache_text = query_text
+                        data = await self.embedding_cache.get(cache_text, model_id=model_id)
+                if data is not None:
+                    data = self.align_outputs(data, cur_node, inputs, runtime_graph, llm_parameters_dict, **kwargs)
+                    return data, cur_node
+
+            optional = policy.optional
+            try:
+                with (
+                    tracer.start_as_current_span(f"{cur_node}_generate")
+                    if ENABLE_OPEA_TELEMETRY
+                    else contextlib.nullcontext()
+                ):
+                    response = await self.call_node(
+                        session,
+                        cur_node,
+                        endpoint,
+                        input_data,
+                        headers={"Content-type": "application/json", "Authorization": f"Bearer {access_token}"},
+                        deadline=deadline,
+                    )
+            except (CircuitOpenError, DeadlineExceeded, asyncio.TimeoutError, aiohttp.ClientError) as e:
+                if not optional:
+                    raise
+                return self.skip_node(cur_node, e, inputs, runtime_graph, llm_parameters_dict, **kwargs)
+            if optional and response.status >= 500:
+                return self.skip_node(
+                    cur_node, f"status {response.status}", inputs, runtime_graph, llm_parameters_dict, **kwargs
                 )
 
             if response.content_type == "audio/wav":
@@ -379,12 +693,81 @@ class ServiceOrchestrator(DAG):
                 data = self.align_outputs(audio_data, cur_node, inputs, runtime_graph, llm_parameters_dict, **kwargs)
             else:
                 # Parse as JSON
-                data = await response.json()
+                data = await response.json(loads=self.http_pool.json_loads)
+                if cache_text is not None and response.ok:
+                    await self.embedding_cache.set(cache_text, data, model_id=model_id)
                 # post process
                 data = self.align_outputs(data, cur_node, inputs, runtime_graph, llm_parameters_dict, **kwargs)
 
             return data, cur_node
 
+    async def invoke_node(self, cur_node: str, input_data: Dict, deadline: Optional[float] = None):
+        """Call a single node outside of a DAG run and return its raw JSON reply.
+
+        Uses the shared HTTP pool and, for embedding nodes, the embedding cache, so megaservices can
+        embed a query for their own lookups at the same cost as the pipeline does. `deadline` is the
+        one of the request the call is made for, see `call_node`.
+        """
+        service = self.services[cur_node]
+        endpoint = service.endpoint_path(None)
+        cache_text = model_id = None
+        if self.embedding_cache is not None and service.service_type == ServiceType.EMBEDDING:
+            cache_text = self.embedding_cache_text(input_data)
+            model_id = await self.embedding_model(cur_node) if cache_text is not None else None
+            if model_id is not None:
+                data = await self.embedding_cache.get(cache_text, model_id=model_id)
+                if data is not None:
+                    return data
+
+        headers = {"Content-type": "application/json"}
+        if service.api_key_value:
+            headers["Authorization"] = f"Bearer {service.api_key_value}"
+        session = await self.http_pool.get_session()
+        response = await self.call_node(session, cur_node, endpoint, input_data, headers, deadline)
+        response.raise_for_status()
+        data = await response.json(loads=self.http_pool.json_loads)
+        if model_id is not None:
+            await self.embedding_cache.set(cache_text, data, model_id=model_id)
+        return data
+
+    async def embedding_model(self, node: str) -> Optional[str]:
+        """Model of the embedding `node`, which scopes its embedding cache entries.
+
+        `EMBEDDING_MODEL_ID` when set, else the `model_id` reported by the `/info` route of the service
+        (text-embeddings-inference), looked up again every EMBEDDING_MODEL_REFRESH seconds. None while
+        it is unknown, the cache is bypassed then: the service URL stays the same when the service is
+        redeployed with another model, so it cannot stand in for the model.
+        """
+        if self.embedding_cache.model_id:
+            return self.embedding_cache.model_id
+        model_id, refresh_at = self.embedding_models.get(node, (None, 0.0))
+        if time.monotonic() < refresh_at:
+            return model_id
+        service = self.services[node]
+        base_url = service.endpoint_path(None)
+        if base_url.endswith(service.endpoint):
+            base_url = base_url[: -len(service.endpoint)]
+        headers = {"Authorization": f"Bearer {service.api_key_value}"} if service.api_key_value else None
+        try:
+            session = await self.http_pool.get_session()
+            async with session.get(
+                f"{base_url}/info", headers=headers, timeout=aiohttp.ClientTimeout(total=5)
+            ) as response:
+                response.raise_for_status()
+                model_id = (await response.json(loads=self.http_pool.json_loads)).get("model_id") or None
+        except Exception as e:
+            logger.warning(f"Embedding cache bypassed for {node}, its model is unknown: {e}")
+            model_id = None
+        self.embedding_models[node] = (model_id, time.monotonic() + EMBEDDING_MODEL_REFRESH)
+        return model_id
+
+    def embedding_cache_text(self, input_data: Dict):
+        """Return the single query text of an embedding request, None if it should not be cached."""
+        for field in ("inputs", "input", "text"):
+            if isinstance(input_data.get(field), str):
+                return input_data[field]
+        return None
+
     def align_inputs(self, inputs, *args, **kwargs):
         """Override this method in megaservice definition."""
         return inputs
@@ -393,8 +776,18 @@ class ServiceOrchestrator(DAG):
         """Override this method in megaservice definition."""
         return data
 
+    def align_skipped(self, inputs, *args, **kwargs):
+        """Override this method in megaservice definition.
+
+        Output of an optional node that was skipped (see `NodePolicy.optional`), its inputs by default.
+        """
+        return inputs
+
     def align_generator(self, gen, *args, **kwargs):
-        """Override this method in megaservice definition."""
+        """Override this method in megaservice definition.
+
+        `gen` is an async generator of raw LLM stream chunks, overrides must return an async iterable too.
+        """
         return gen
 
     def get_all_final_outputs(self, result_dict, runtime_graph):
@@ -0,0 +1,251 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import random
+import time
+from collections import deque
+from typing import Deque, Optional
+
+import aiohttp
+from prometheus_client import Counter, Gauge
+
+from .logger import CustomLogger
+
+logger = CustomLogger("comps-core-policy")
+
+# response statuses worth another attempt, the other errors are returned as they are
+RETRYABLE_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+breaker_state = Gauge(
+    "megaservice_circuit_breaker_state",
+    "Circuit breaker state per node: 0 closed, 1 half-open, 2 open",
+    ["node"],
+    multiprocess_mode="livemax",
+)
+node_retries = Counter("megaservice_node_retries", "Retried calls to pipeline nodes", ["node", "reason"])
+node_retries_denied = Counter(
+    "megaservice_node_retries_denied", "Retries not attempted because the retry budget was spent", ["node"]
+)
+node_skipped = Counter(
+    "megaservice_node_skipped",
+    "Optional pipeline nodes skipped because they failed, their breaker is open or the request deadline is near",
+    ["node"],
+)
+
+
+def _timeout(value: Optional[float]) -> Optional[float]:
+    # 0 or less disables a timeout
+    return value if value is not None and value > 0 else None
+
+
+class NodePolicy:
+    """Timeouts, retries and circuit breaking of the orchestrator calls to one `MicroService`.
+
+    Args:
+        connect_timeout: seconds to get a connection to the node.
+        read_timeout: seconds between two reads of the reply, e.g. between two chunks of a stream.
+        total_timeout: seconds of a whole attempt, None keeps the `ORCHESTRATOR_HTTP_TIMEOUT` of the pool.
+        max_retries: attempts after the first one on timeouts, connection errors and 429/5xx replies,
+            within the retry budget of the orchestrator.
+        backoff_base, backoff_max: the delay before the retry `n` is drawn uniformly between 0 and
+            `min(backoff_max, backoff_base * 2**n)` seconds.
+        breaker_threshold: consecutive failed calls that open the circuit breaker, 0 disables it.
+        breaker_reset_timeout: seconds the breaker stays open before a probe call is let through.
+        optional: the node is skipped instead of failing the request when its breaker is open or
+            its call failed, the megaservice `align_skipped` hook builds its output.
+        min_budget: seconds before the request deadline under which an optional node is skipped, to
+            leave the time left to the nodes that follow.
+        balancing: how the replica of a node with several is picked, `least_outstanding` or `ewma`.
+        eject_threshold: consecutive failures of a replica that take it out of the balancing for
+            `eject_time` seconds, 0 never ejects.
+        hedge_quantile: latency quantile of the node (e.g. 0.95) after which a non-streaming call is
+            duplicated to a second replica and the first reply is used, None disables hedging.
+    """
+
+    def __init__(
+        self,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+        total_timeout: Optional[float] = None,
+        max_retries: int = 0,
+        backoff_base: float = 0.1,
+        backoff_max: float = 2.0,
+        breaker_threshold: int = 0,
+        breaker_reset_timeout: float = 30.0,
+        optional: bool = False,
+        min_budget: float = 0.0,
+        balancing: str = "least_outstanding",
+        eject_threshold: int = 5,
+        eject_time: float = 30.0,
+        hedge_quantile: Optional[float] = None,
+    ) -> None:
+        self.connect_timeout = _timeout(connect_timeout)
+        self.read_timeout = _timeout(read_timeout)
+        self.total_timeout = _timeout(total_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset_timeout = breaker_reset_timeout
+        self.optional = optional
+        self.min_budget = min_budget
+        self.balancing = balancing
+        self.eject_threshold = eject_threshold
+        self.eject_time = eject_time
+        self.hedge_quantile = hedge_quantile
+
+    @classmethod
+    def from_env(cls, prefix: str, **defaults) -> "NodePolicy":
+        """Build the policy of a node from `{prefix}_*` environment variables, e.g. RERANK_TOTAL_TIMEOUT.
+
+        `defaults` are the values used for the variables that are not set.
+        """
+        kwargs = dict(defaults)
+        for field, cast in (
+            ("connect_timeout", float),
+            ("read_timeout", float),
+            ("total_timeout", float),
+            ("max_retries", int),
+            ("breaker_threshold", int),
+            ("breaker_reset_timeout", float),
+            ("min_budget", float),
+            ("balancing", str),
+            ("eject_threshold", int),
+            ("eject_time", float),
+            ("hedge_quantile", float),
+        ):
+            value = os.getenv(f"{prefix}_{field.upper()}")
+            if value:
+                kwargs[field] = cast(value)
+        return cls(**kwargs)
+
+    def client_timeout(self, default_total: Optional[float], time_left: Optional[float] = None) -> aiohttp.ClientTimeout:
+        """Timeout of an attempt, whose total is also capped by the `time_left` to the request deadline."""
+        total = self.total_timeout if self.total_timeout is not None else default_total
+        if time_left is not None:
+            total = time_left if total is None else min(total, time_left)
+        return aiohttp.ClientTimeout(
+            total=total,
+            connect=self.connect_timeout,
+            sock_read=self.read_timeout,
+        )
+
+    def backoff(self, retry: int) -> float:
+        # full jitter, concurrent requests retrying the same node do not come back in lockstep
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**retry))
+
+
+class CircuitOpenError(Exception):
+    """A call was refused because the circuit breaker of the node is open."""
+
+    status_code = 503
+
+    def __init__(self, node: str, retry_after: float) -> None:
+        super().__init__(f"{node} is unavailable, circuit breaker open")
+        self.node = node
+        self.retry_after = max(int(retry_after + 0.999), 1)
+
+    @property
+    def headers(self):
+        return {"Retry-After": str(self.retry_after)}
+
+
+class CircuitBreaker:
+    """Consecutive failure circuit breaker of one node.
+
+    Closed, calls go through. After `failure_threshold` consecutive failures it opens and calls are
+    refused for `reset_timeout` seconds, then it is half-open: a single probe call goes through and
+    closes the breaker if it succeeds or opens it again if it fails.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+    STATE_NAMES = ("closed", "half-open", "open")
+
+    def __init__(self, node: str, failure_threshold: int, reset_timeout: float) -> None:
+        self.node = node
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        # start of the probe call in flight when half-open, a probe that never reported is replaced after reset_timeout
+        self.probe_started: Optional[float] = None
+        breaker_state.labels(node).set(self.CLOSED)
+
+    def _set_state(self, state: int) -> None:
+        if state != self.state:
+            logger.warning(
+                f"Circuit breaker of {self.node}: {self.STATE_NAMES[self.state]} -> {self.STATE_NAMES[state]}"
+            )
+            self.state = state
+            breaker_state.labels(self.node).set(state)
+
+    def retry_after(self) -> float:
+        return max(self.opened_at + self.reset_timeout - time.monotonic(), 0)
+
+    def allow(self) -> bool:
+        """Whether a call may go through now, a True in half-open state makes it the probe call."""
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            if now < self.opened_at + self.reset_timeout:
+                return False
+            self._set_state(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            if self.probe_started is not None and now < self.probe_started + self.reset_timeout:
+                return False
+            self.probe_started = now
+        return True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.probe_started = None
+        self._set_state(self.CLOSED)
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.probe_started = None
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._set_state(self.OPEN)
+
+
+class RetryBudget:
+    """Retries allowed to the orchestrator over all nodes, so retries cannot multiply an outage.
+
+    Within the last `window` seconds, retries are allowed up to `ratio` of the calls plus
+    `min_per_second` per second, whatever the `max_retries` of the nodes.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, window: float = 10.0) -> None:
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window = window
+        self.calls: Deque[float] = deque()
+        self.retries: Deque[float] = deque()
+
+    @classmethod
+    def from_env(cls) -> "RetryBudget":
+        return cls(
+            ratio=float(os.getenv("ORCHESTRATOR_RETRY_BUDGET_RATIO", 0.2)),
+            min_per_second=float(os.getenv("ORCHESTRATOR_RETRY_BUDGET_MIN_PER_SECOND", 1)),
+        )
+
+    def _prune(self, now: float) -> None:
+        for events in (self.calls, self.retries):
+            while events and events[0] < now - self.window:
+                events.popleft()
+
+    def record_call(self) -> None:
+        now = time.monotonic()
+        self._prune(now)
+        self.calls.append(now)
+
+    def try_retry(self) -> bool:
+        """Withdraw a retry from the budget, False when it is spent."""
+        now = time.monotonic()
+        self._prune(now)
+        if len(self.retries) >= self.min_per_second * self.window + self.ratio * len(self.calls):
+            return False
+        self.retries.append(now)
+        return True
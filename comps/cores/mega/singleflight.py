@@ -0,0 +1,203 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi.responses import StreamingResponse
+from prometheus_client import Counter, Histogram
+
+from .context import ClosingStream
+from .logger import CustomLogger
+
+logger = CustomLogger("comps-core-singleflight")
+
+coalesced_requests = Counter(
+    "megaservice_coalesced_requests", "Requests served by joining an identical in-flight execution", ["flight"]
+)
+coalesced_fanin = Histogram(
+    "megaservice_coalesced_fanin",
+    "Requests served per pipeline execution (histogram)",
+    ["flight"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+
+
+class StreamMulticast:
+    """Fan a single streaming response out to any number of subscribers.
+
+    A pump task reads the upstream body once and buffers every chunk, so subscribers joining late
+    replay the stream from the start and then follow it live. The pump starts with the first read
+    of a subscriber, and the upstream is closed once every subscriber has closed its response before
+    the end of the stream, whether it read from it or not.
+    Must be created inside the running event loop.
+    """
+
+    def __init__(self, response: StreamingResponse) -> None:
+        self.source = response.body_iterator
+        self.status_code = response.status_code
+        self.media_type = response.media_type
+        self.headers = {k: v for k, v in response.headers.items() if k.lower() != "content-length"}
+        self._chunks = []
+        self._error: Optional[BaseException] = None
+        self._done = asyncio.Event()
+        self._changed = asyncio.Condition()
+        # responses handed out and not closed yet
+        self._readers = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    async def wait_done(self) -> None:
+        await self._done.wait()
+
+    async def _pump(self) -> None:
+        try:
+            async for chunk in self.source:
+                self._chunks.append(chunk)
+                async with self._changed:
+                    self._changed.notify_all()
+        except asyncio.CancelledError:
+            self._error = ConnectionAbortedError("stream abandoned by all subscribers")
+            if hasattr(self.source, "aclose"):
+                await self.source.aclose()
+        except Exception as e:
+            logger.error(f"Multicast upstream failed: {e}")
+            self._error = e
+        finally:
+            self._done.set()
+            async with self._changed:
+                self._changed.notify_all()
+
+    async def subscribe(self):
+        """Async generator of the upstream chunks, from the first one."""
+        if self._task is None and not self.done:
+            self._task = asyncio.create_task(self._pump())
+        index = 0
+        while True:
+            if index < len(self._chunks):
+                index += 1
+                yield self._chunks[index - 1]
+            elif self.done:
+                if self._error is not None:
+                    raise self._error
+                return
+            else:
+                async with self._changed:
+                    await self._changed.wait_for(lambda: index < len(self._chunks) or self.done)
+
+    def _unsubscribe(self) -> None:
+        self._readers -= 1
+        if self._readers > 0 or self.done:
+            return
+        if self._task is not None:
+            self._task.cancel()
+            return
+        # nobody ever read, e.g. the leader left before the answer started: the upstream was never pumped
+        self._error = ConnectionAbortedError("stream abandoned by all subscribers")
+        self._done.set()
+        if hasattr(self.source, "close"):
+            self.source.close()
+
+    def response(self) -> StreamingResponse:
+        """Return a new StreamingResponse subscribed to this multicast, its body must be consumed or closed."""
+        self._readers += 1
+        return StreamingResponse(
+            ClosingStream(self.subscribe(), self._unsubscribe),
+            status_code=self.status_code,
+            headers=self.headers,
+            media_type=self.media_type,
+        )
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into a single execution.
+
+    The first caller of a key (the leader) runs `func`, callers arriving while it is in flight wait
+    for and share its result. With `hold`, the key stays joinable after `func` returned until the
+    awaitable returned by `hold(result)` completes, e.g. until a multicast stream ended.
+    The execution is cancelled if every caller waiting for it is cancelled.
+
+    Resources the leader acquired for the execution, e.g. its admission slot, belong to the execution
+    rather than to the leader, which may leave before it ends: they are freed through `release`.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._flights: Dict[Any, "_Flight"] = {}
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    def __contains__(self, key: Any) -> bool:
+        """Whether a call with `key` would join an execution in flight."""
+        return key in self._flights
+
+    async def do(
+        self,
+        key: Any,
+        func: Callable[[], Awaitable[Any]],
+        hold: Optional[Callable[[Any], Awaitable[None]]] = None,
+        release: Optional[Callable[[], None]] = None,
+    ) -> Tuple[Any, bool]:
+        """Return the (result, is_leader) of the execution registered under `key`.
+
+        `release` is called once the execution is no longer joinable when the caller leads it, right
+        away when the caller joins an execution in flight.
+        """
+        flight = self._flights.get(key)
+        if flight is not None:
+            if release is not None:
+                release()
+            flight.fanin += 1
+            coalesced_requests.labels(self.name).inc()
+            return await self._wait(flight), False
+
+        # run detached and shielded, so the leader disconnecting does not cancel the followers' execution
+        flight = self._flights[key] = _Flight(asyncio.ensure_future(func()), release)
+        flight.task.add_done_callback(lambda task: self._done(key, flight, hold))
+        return await self._wait(flight), True
+
+    async def _wait(self, flight: "_Flight") -> Any:
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # every caller was cancelled, nobody is left to use the result
+                flight.task.cancel()
+
+    def _done(self, key: Any, flight: "_Flight", hold) -> None:
+        task = flight.task
+        if hold is None or task.cancelled() or task.exception() is not None:
+            self._forget(key, flight)
+        else:
+            flight.holder = asyncio.ensure_future(self._hold(key, flight, hold(task.result())))
+
+    async def _hold(self, key: Any, flight: "_Flight", waiter: Awaitable[None]) -> None:
+        try:
+            await waiter
+        finally:
+            self._forget(key, flight)
+
+    def _forget(self, key: Any, flight: "_Flight") -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+            coalesced_fanin.labels(self.name).observe(flight.fanin)
+        release, flight.release = flight.release, None
+        if release is not None:
+            release()
+
+
+class _Flight:
+    __slots__ = ("task", "fanin", "waiters", "holder", "release")
+
+    def __init__(self, task: asyncio.Future, release: Optional[Callable[[], None]] = None) -> None:
+        self.task = task
+        self.fanin = 1
+        self.waiters = 0
+        self.holder = None
+        self.release = release
@@ -0,0 +1,201 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import glob
+import multiprocessing
+import os
+import signal
+import time
+from typing import Callable, Dict, List
+
+from prometheus_client import REGISTRY, Gauge
+from prometheus_client import multiprocess as prometheus_multiprocess
+
+from .logger import CustomLogger
+
+logger = CustomLogger("workers")
+
+# number of pre-forked worker processes of an HTTPService, 1 serves from the main process
+HTTP_SERVICE_WORKERS = int(os.getenv("HTTP_SERVICE_WORKERS", 1))
+# seconds a stopping or reloaded worker gets to finish its in-flight requests
+HTTP_SERVICE_GRACEFUL_TIMEOUT = float(os.getenv("HTTP_SERVICE_GRACEFUL_TIMEOUT", 30))
+# seconds between two publications of the scrape-time collectors of a worker
+METRICS_PUBLISH_INTERVAL = float(os.getenv("METRICS_PUBLISH_INTERVAL", 5))
+# set in the environment of every worker process to its slot, the replacement of a worker gets the same
+WORKER_ID_ENV = "HTTP_SERVICE_WORKER_ID"
+
+
+def multiprocess_metrics_enabled() -> bool:
+    """Whether Prometheus metrics are shared by the worker processes through `PROMETHEUS_MULTIPROC_DIR`.
+
+    prometheus_client picks its storage when imported, the variable must be set in the environment
+    of the service, it cannot be turned on from the code.
+    """
+    return bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+
+# collectors computing their values at scrape time, they cannot be read from the other workers
+_published_collectors: List = []
+_published_gauges: Dict[str, Gauge] = {}
+_published_labels: Dict[str, set] = {}
+
+
+def register_collector(collector) -> None:
+    """Register a scrape-time collector (e.g. cache or connection pool occupancy).
+
+    With multiprocess metrics, the values of every worker are published periodically into gauges
+    summed over the live workers, instead of reporting the values of whichever worker is scraped.
+    """
+    if multiprocess_metrics_enabled():
+        _published_collectors.append(collector)
+    else:
+        REGISTRY.register(collector)
+
+
+def publish_collectors() -> None:
+    """Copy the current values of the scrape-time collectors of this process into shared gauges."""
+    for collector in _published_collectors:
+        for family in collector.collect():
+            seen = set()
+            for sample in family.samples:
+                gauge = _published_gauges.get(family.name)
+                if gauge is None:
+                    gauge = Gauge(
+                        family.name, family.documentation, list(sample.labels), multiprocess_mode="livesum"
+                    )
+                    _published_gauges[family.name] = gauge
+                labels = tuple(sample.labels.values())
+                (gauge.labels(*labels) if labels else gauge).set(sample.value)
+                seen.add(labels)
+            # series that disappeared, e.g. a downstream host without pooled connections anymore
+            for labels in _published_labels.get(family.name, set()) - seen:
+                gauge = _published_gauges[family.name]
+                (gauge.labels(*labels) if labels else gauge).set(0)
+            _published_labels[family.name] = seen
+
+
+async def publish_collectors_forever() -> None:
+    while True:
+        publish_collectors()
+        await asyncio.sleep(METRICS_PUBLISH_INTERVAL)
+
+
+def clear_multiprocess_dir() -> None:
+    """Drop the metric and statistics files left by a previous run of the service."""
+    for pattern in ("*.db", "statistics_*.bin"):
+        for path in glob.glob(os.path.join(os.environ["PROMETHEUS_MULTIPROC_DIR"], pattern)):
+            os.remove(path)
+
+
+class WorkerSupervisor:
+    """Pre-fork `workers` processes serving the same listening socket and keep them running.
+
+    Workers are forked from the main process, which keeps the app, the loaded models and the
+    tokenizers, and are restarted if they die. Signals of the main process:
+      - SIGTERM, SIGINT: graceful shutdown, workers stop accepting connections and finish the
+        in-flight requests within `graceful_timeout`
+      - SIGHUP: graceful reload, a new set of workers is forked before the current ones are
+        gracefully stopped, no connection is refused meanwhile
+
+    The new workers of a reload are forked from the main process as it is: they pick up a changed
+    environment of the services they connect to, but not changed code or configuration of this
+    service, which was imported before the first fork. Restart the service to deploy those.
+
+    Worker slots are numbered from 0, a reload alternates between two ranges of `workers` slots so the
+    old and new workers never share one, see WORKER_ID_ENV.
+    """
+
+    def __init__(self, target: Callable[[], None], workers: int, graceful_timeout: float, name: str = "") -> None:
+        self.target = target
+        self.workers = workers
+        self.graceful_timeout = graceful_timeout
+        self.name = name
+        # the app was built before forking, its routes and closures are inherited as is
+        self.mp_context = multiprocessing.get_context("fork")
+        self.processes: List[multiprocessing.Process] = []
+        # first slot of the current set of workers, 0 or `workers`
+        self.first_slot = 0
+        self.should_exit = False
+        self.should_reload = False
+
+    def _run_worker(self, slot: int) -> None:
+        os.environ[WORKER_ID_ENV] = str(slot)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        # the terminal hangup reaches the whole process group, only the main process reloads
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        self.target()
+
+    def spawn(self, slot: int) -> multiprocessing.Process:
+        process = self.mp_context.Process(target=self._run_worker, args=(slot,), name=f"{self.name}-worker-{slot}")
+        process.start()
+        logger.info(f"Started worker process {process.pid} in slot {slot}")
+        return process
+
+    def spawn_all(self) -> List[multiprocessing.Process]:
+        return [self.spawn(self.first_slot + i) for i in range(self.workers)]
+
+    def _on_exit(self, signum, frame) -> None:
+        self.should_exit = True
+
+    def _on_reload(self, signum, frame) -> None:
+        self.should_reload = True
+
+    def stop_processes(self, processes: List[multiprocessing.Process]) -> None:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + self.graceful_timeout
+        for process in processes:
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                logger.warning(f"Worker process {process.pid} did not stop in time, killing it")
+                process.kill()
+                process.join()
+            self.process_exited(process)
+
+    @staticmethod
+    def process_exited(process: multiprocessing.Process) -> None:
+        if multiprocess_metrics_enabled():
+            # drop the live gauges of the process, its counters and histograms are kept
+            prometheus_multiprocess.mark_process_dead(process.pid)
+
+    def reap(self) -> None:
+        """Replace the workers that died unexpectedly."""
+        for i, process in enumerate(self.processes):
+            if not process.is_alive():
+                process.join()
+                self.process_exited(process)
+                logger.warning(f"Worker process {process.pid} exited with code {process.exitcode}, restarting it")
+                self.processes[i] = self.spawn(self.first_slot + i)
+
+    def reload(self) -> None:
+        logger.info("Reloading the worker processes")
+        previous = self.processes
+        self.first_slot = self.workers - self.first_slot
+        self.processes = self.spawn_all()
+        self.stop_processes(previous)
+
+    def run(self) -> None:
+        """Run the workers until the main process is asked to exit."""
+        if multiprocess_metrics_enabled():
+            clear_multiprocess_dir()
+        else:
+            logger.warning(
+                "PROMETHEUS_MULTIPROC_DIR is not set, /metrics and /v1/statistics report the worker serving the scrape"
+            )
+        signal.signal(signal.SIGTERM, self._on_exit)
+        signal.signal(signal.SIGINT, self._on_exit)
+        signal.signal(signal.SIGHUP, self._on_reload)
+        self.processes = self.spawn_all()
+        try:
+            while not self.should_exit:
+                if self.should_reload:
+                    self.should_reload = False
+                    self.reload()
+                self.reap()
+                time.sleep(0.5)
+        finally:
+            logger.info("Stopping the worker processes")
+            self.stop_processes(self.processes)
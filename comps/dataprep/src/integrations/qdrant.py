@@ -14,10 +14,12 @@ from qdrant_client import QdrantClient
 from qdrant_client.http import models
 
 from comps import CustomLogger, DocPath, OpeaComponent, OpeaComponentRegistry, ServiceType
+from comps.cores.common.cache import CollectionGenerations
 from comps.cores.proto.api_protocol import DataprepRequest
 from comps.dataprep.src.utils import (
     document_loader,
     encode_filename,
+    get_language_tag,
     get_separators,
     get_tables_result,
     parse_html_new,
@@ -30,6 +32,7 @@ from comps.parsers.text import Text
 from comps.parsers.table import Table
 
 import requests
+import tiktoken
 
 logger = CustomLogger("opea_dataprep_qdrant")
 logflag = os.getenv("LOGFLAG", False)
@@ -48,6 +51,9 @@ TGI_LLM_ENDPOINT_NO_RAG = os.getenv("TGI_LLM_ENDPOINT_NO_RAG", "http://localhost
 TEI_EMBEDDING_ENDPOINT = os.getenv("TEI_EMBEDDING_ENDPOINT", "")
 HF_TOKEN = os.getenv("HF_TOKEN") or os.getenv("HUGGINGFACEHUB_API_TOKEN", "")
 
+# token counts stored with every chunk, the megaservice packs the prompt context with them
+TOKEN_ENCODING = tiktoken.get_encoding("cl100k_base")
+
 @OpeaComponentRegistry.register("OPEA_DATAPREP_QDRANT")
 class OpeaQdrantDataprep(OpeaComponent):
     """Dataprep component for Qdrant ingestion and search services."""
@@ -76,6 +82,8 @@ class OpeaQdrantDataprep(OpeaComponent):
             self.embedder = HuggingFaceEmbeddings(model_name=EMBED_MODEL)
 
         self.client = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
+        # bumped on every content change so retrievers drop their cached results for the collection
+        self.generations = CollectionGenerations.from_env()
         health_status = self.check_health()
         if not health_status:
             logger.error("OpeaQdrantDataprep health check failed.")
@@ -217,9 +225,19 @@ class OpeaQdrantDataprep(OpeaComponent):
         for i in range(0, num_chunks, batch_size):
             batch_chunks = chunks[i : i + batch_size]
             batch_texts = batch_chunks
+            batch_metadatas = [
+                {
+                    "file_path": path,
+                    "file_name": os.path.basename(path),
+                    "token_count": len(tokens),
+                    "lang": get_language_tag(text),
+                }
+                for text, tokens in zip(batch_texts, TOKEN_ENCODING.encode_ordinary_batch(batch_texts))
+            ]
 
             _ = Qdrant.from_texts(
                 texts=batch_texts,
+                metadatas=batch_metadatas,
                 embedding=self.embedder,
                 collection_name=collection_name,
                 host=QDRANT_HOST,
@@ -282,6 +300,7 @@ class OpeaQdrantDataprep(OpeaComponent):
                 uploaded_files.append(save_path)
                 if logflag:
                     logger.info(f"Successfully saved file {save_path} to collection {collection_name}")
+            await self.generations.bump(collection_name)
             result = {"status": 200, "message": "Data preparation succeeded"}
             if logflag:
                 logger.info(result)
@@ -313,6 +332,7 @@ class OpeaQdrantDataprep(OpeaComponent):
                 if logflag:
                     logger.info(f"Successfully saved link {link} to collection {collection_name}")
 
+            await self.generations.bump(collection_name)
             result = {"status": 200, "message": "Data preparation succeeded"}
             if logflag:
                 logger.info(result)
@@ -366,6 +386,7 @@ class OpeaQdrantDataprep(OpeaComponent):
 
         if file_path == "all":
             self.client.delete_collection(collection_name)
+            await self.generations.bump(collection_name)
             if logflag:
                 logger.info(f"Deleted all files from collection {collection_name}")
             return {"status": 200, "message": f"All files deleted from collection {collection_name}"}
@@ -383,6 +404,7 @@ class OpeaQdrantDataprep(OpeaComponent):
                     )
                 ),
             )
+            await self.generations.bump(collection_name)
             if logflag:
                 logger.info(f"Deleted file {file_path} from collection {collection_name}")
             return {"status": 200, "message": f"File {file_path} deleted from collection {collection_name}"}
@@ -17,6 +17,7 @@ from comps import (
     register_microservice,
     register_statistics,
     statistics_dict,
+    within_deadline,
 )
 from comps.cores.proto.api_protocol import (
     ArangoDBDataprepRequest,
@@ -122,7 +123,8 @@ async def ingest_files(
         logger.info(f"[ ingest ] link_list:{link_list}")
 
     try:
-        response = await loader.ingest_files(input)
+        # an ingestion that cannot finish within the request deadline is given up
+        response = await within_deadline(loader.ingest_files(input), stage="ingest")
 
         # Log the result if logging is enabled
         if logflag:
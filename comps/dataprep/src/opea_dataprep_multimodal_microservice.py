@@ -19,6 +19,7 @@ from comps import (
     register_microservice,
     register_statistics,
     statistics_dict,
+    within_deadline,
 )
 from comps.dataprep.src.utils import create_upload_folder
 
@@ -49,8 +50,8 @@ async def ingest_files(files: Optional[Union[UploadFile, List[UploadFile]]] = Fi
         logger.info(f"[ ingest ] files:{files}")
 
     try:
-        # Use the loader to invoke the component
-        response = await loader.ingest_files(files)
+        # Use the loader to invoke the component, given up when the request deadline passes
+        response = await within_deadline(loader.ingest_files(files), stage="ingest")
         # Log the result if logging is enabled
         if logflag:
             logger.info(f"[ ingest ] Output generated: {response}")
@@ -77,8 +78,8 @@ async def ingest_videos(files: Optional[Union[UploadFile, List[UploadFile]]] = F
         logger.info(f"[ ingest ] files:{files}")
 
     try:
-        # Use the loader to invoke the component
-        response = await loader.ingest_videos(files)
+        # Use the loader to invoke the component, given up when the request deadline passes
+        response = await within_deadline(loader.ingest_videos(files), stage="ingest")
         # Log the result if logging is enabled
         if logflag:
             logger.info(f"[ ingest ] Output generated: {response}")
@@ -104,8 +105,8 @@ async def ingest_generate_transcripts(files: Optional[Union[UploadFile, List[Upl
     if logflag:
         logger.info(f"[ ingest ] files:{files}")
     try:
-        # Use the loader to invoke the component
-        response = await loader.ingest_generate_transcripts(files)
+        # Use the loader to invoke the component, given up when the request deadline passes
+        response = await within_deadline(loader.ingest_generate_transcripts(files), stage="ingest")
         # Log the result if logging is enabled
         if logflag:
             logger.info(f"[ ingest ] Output generated: {response}")
@@ -132,8 +133,8 @@ async def ingest_generate_captions(files: Optional[Union[UploadFile, List[Upload
         logger.info(f"[ ingest ] files:{files}")
 
     try:
-        # Use the loader to invoke the component
-        response = await loader.ingest_generate_captions(files)
+        # Use the loader to invoke the component, given up when the request deadline passes
+        response = await within_deadline(loader.ingest_generate_captions(files), stage="ingest")
         # Log the result if logging is enabled
         if logflag:
             logger.info(f"[ ingest ] Output generated: {response}")
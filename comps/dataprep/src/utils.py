@@ -115,6 +115,20 @@ def get_separators():
     return separators
 
 
+CJK_PATTERN = re.compile("[\u4E00-\u9FFF]")
+
+
+def get_language_tag(text):
+    """Tag a chunk `zh` when at least 30% of its characters are CJK ideographs, `en` otherwise.
+
+    The tag is stored with the chunk, the megaservice picks the prompt template from the tags of the
+    retrieved chunks instead of scanning the context on every request.
+    """
+    if text and len(CJK_PATTERN.findall(text)) / len(text) >= 0.3:
+        return "zh"
+    return "en"
+
+
 def process_page(doc, idx):
     page = doc.load_page(idx)
     pagetext = page.get_text().strip()
@@ -1,10 +1,11 @@
-from groq import Groq
+from groq import APITimeoutError, Groq
 from fastapi import Request
 from fastapi.responses import StreamingResponse
 import json
 import os
 
-from comps import  MicroService, ServiceRoleType
+from comps import  DeadlineExceeded, MicroService, ServiceRoleType
+from comps.cores.mega.deadline import current_deadline, deadline_exceeded, time_left
 from comps.proto.api_protocol import (
     ChatCompletionRequest,
     ChatCompletionResponse,
@@ -44,19 +45,34 @@ class GroqService:
             messages = [{"role": "user", "content": chat_request.messages}]
         else:
             messages = chat_request.messages
-            
-        response = self.client.chat.completions.create(
-            messages=messages,
-            model=self.model,
-            temperature=chat_request.temperature if chat_request.temperature else 0.01,
-            max_tokens=chat_request.max_tokens if chat_request.max_tokens else 1024,
-            top_p=chat_request.top_p if chat_request.top_p else 0.95,
-            stream=stream_opt
-        )
+
+        # the X-Request-Timeout of the caller bounds the Groq call instead of the client default
+        deadline = current_deadline()
+        options = {}
+        if deadline is not None:
+            options["timeout"] = time_left(deadline)
+            if options["timeout"] <= 0:
+                deadline_exceeded.labels("groq").inc()
+                raise DeadlineExceeded("groq")
+        try:
+            response = self.client.chat.completions.create(
+                messages=messages,
+                model=self.model,
+                temperature=chat_request.temperature if chat_request.temperature else 0.01,
+                max_tokens=chat_request.max_tokens if chat_request.max_tokens else 1024,
+                top_p=chat_request.top_p if chat_request.top_p else 0.95,
+                stream=stream_opt,
+                **options
+            )
+        except APITimeoutError:
+            if deadline is None:
+                raise
+            deadline_exceeded.labels("groq").inc()
+            raise DeadlineExceeded("groq")
         
         if stream_opt:
             return StreamingResponse(
-                self._generate_stream(response),
+                self._generate_stream(response, deadline),
                 media_type="text/event-stream"
             )
         else:
@@ -70,9 +86,10 @@ class GroqService:
             ]
             return ChatCompletionResponse(model=self.model, choices=choices, usage=UsageInfo())
 
-    async def _generate_stream(self, response):
+    async def _generate_stream(self, response, deadline=None):
         buffer = ""
         in_word = False
+        finish_reason = "eos_token"
         
         def is_word_boundary(curr_char, next_char=None):
             if curr_char == '.':
@@ -94,6 +111,12 @@ class GroqService:
             return False, True
 
         for chunk in response:
+            if deadline is not None and time_left(deadline) <= 0:
+                # nobody waits for the rest of the answer, stop the generation upstream
+                response.close()
+                deadline_exceeded.labels("groq").inc()
+                finish_reason = "length"
+                break
             if chunk.choices[0].delta.content is not None:
                 new_content = chunk.choices[0].delta.content
                 
@@ -137,7 +160,7 @@ class GroqService:
         final_data = {
             "choices": [{
                 "delta": {},
-                "finish_reason": "eos_token"
+                "finish_reason": finish_reason
             }]
         }
         yield f"data: {json.dumps(final_data)}\n\n"
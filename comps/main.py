@@ -1,12 +1,32 @@
 import re
 import os
 import json
-import time
+import asyncio
+import hashlib
+from contextlib import aclosing
+from functools import lru_cache
 from uuid import uuid4
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import Any, List, Dict, Optional
 from langchain_core.prompts import PromptTemplate
-from comps import MegaServiceEndpoint, MicroService, ServiceOrchestrator, ServiceRoleType, ServiceType
+from comps import (
+    AdmissionRejected,
+    CircuitOpenError,
+    CollectionGenerations,
+    DeadlineExceeded,
+    MegaServiceEndpoint,
+    MicroService,
+    NodePolicy,
+    RequestContext,
+    SemanticAnswerCache,
+    ServiceOrchestrator,
+    ServiceRoleType,
+    ServiceType,
+)
+from comps.cores.mega.admission import BATCH_LANE, DEFAULT_TENANT, INTERACTIVE_LANE, LANES
+from comps.cores.mega.codec import HTTP_SERVICE_FAST_JSON, FastJSONResponse
+from comps.cores.mega.context import CancellableStreamingResponse, ClosingStream, wait_for_disconnect
+from comps.cores.mega.deadline import DEADLINE_HEADER, deadline_after, deadline_exceeded, parse_timeout
 from cores.mega.utils import handle_message
 from proto.api_protocol import (
     ChatCompletionRequest,
@@ -19,8 +39,10 @@ from pydantic import BaseModel
 from dotenv import load_dotenv
 from proto.docarray import LLMParams, RerankerParms, RetrieverParms
 from fastapi import Request, HTTPException, File, UploadFile
-from fastapi.responses import StreamingResponse, JSONResponse
-from mongo_client import mongo_client
+from fastapi.responses import Response, StreamingResponse, JSONResponse
+from mongo_client import check_connection, create_mongo_client
+from conversation_store import ConversationCache, ConversationStore, InvalidCursor
+from context_packer import pack_context
 import tiktoken
 
 load_dotenv()
@@ -30,19 +52,126 @@ MONGO_HOST = os.getenv("MONGO_HOST", "localhost")
 MONGO_PORT = os.getenv("MONGO_PORT", "27017")
 MONGO_DB = os.getenv("MONGO_DB", "rag_db")
 MEGA_SERVICE_PORT = int(os.getenv("MEGA_SERVICE_PORT", 9001))
-GUARDRAIL_SERVICE_HOST_IP = os.getenv("GUARDRAIL_SERVICE_HOST_IP", "0.0.0.0")
+
+
+def env_hosts(name: str, default: str = "0.0.0.0") -> List[str]:
+    """Hosts listed in the `name` variable, separated by commas for the replicas of a service, which share its port."""
+    return [host.strip() for host in os.getenv(name, default).split(",") if host.strip()]
+
+
+GUARDRAIL_SERVICE_HOSTS = env_hosts("GUARDRAIL_SERVICE_HOST_IP")
+GUARDRAIL_SERVICE_HOST_IP = GUARDRAIL_SERVICE_HOSTS[0]
 GUARDRAIL_SERVICE_PORT = int(os.getenv("GUARDRAIL_SERVICE_PORT", 80))
-EMBEDDING_SERVER_HOST_IP = os.getenv("EMBEDDING_SERVER_HOST_IP", "0.0.0.0")
+EMBEDDING_SERVER_HOSTS = env_hosts("EMBEDDING_SERVER_HOST_IP")
+EMBEDDING_SERVER_HOST_IP = EMBEDDING_SERVER_HOSTS[0]
 EMBEDDING_SERVER_PORT = int(os.getenv("EMBEDDING_SERVER_PORT", 80))
-RETRIEVER_SERVICE_HOST_IP = os.getenv("RETRIEVER_SERVICE_HOST_IP", "0.0.0.0")
+RETRIEVER_SERVICE_HOSTS = env_hosts("RETRIEVER_SERVICE_HOST_IP")
+RETRIEVER_SERVICE_HOST_IP = RETRIEVER_SERVICE_HOSTS[0]
 RETRIEVER_SERVICE_PORT = int(os.getenv("RETRIEVER_SERVICE_PORT", 7000))
-RERANK_SERVER_HOST_IP = os.getenv("RERANK_SERVER_HOST_IP", "0.0.0.0")
+RERANK_SERVER_HOSTS = env_hosts("RERANK_SERVER_HOST_IP")
+RERANK_SERVER_HOST_IP = RERANK_SERVER_HOSTS[0]
 RERANK_SERVER_PORT = int(os.getenv("RERANK_SERVER_PORT", 80))
-LLM_SERVER_HOST_IP = os.getenv("LLM_SERVER_HOST_IP", "0.0.0.0")
+LLM_SERVER_HOSTS = env_hosts("LLM_SERVER_HOST_IP")
+LLM_SERVER_HOST_IP = LLM_SERVER_HOSTS[0]
 LLM_SERVER_PORT = int(os.getenv("LLM_SERVER_PORT", 80))
 LLM_MODEL = os.getenv("LLM_MODEL_ID", "meta-llama/Meta-Llama-3.1-8B-Instruct")
+DEFAULT_COLLECTION_NAME = os.getenv("COLLECTION_NAME", "rag-qdrant")
+# nginx convention for requests closed by the client before the response, never seen by the client
+CLIENT_CLOSED_REQUEST = 499
+# opt-in, requests of a tenant only ever share an execution with requests of the same tenant
+REQUEST_COALESCING_ENABLED = os.getenv("REQUEST_COALESCING_ENABLED", "false").lower() in ("true", "1", "yes")
+# only requests whose deadlines fall in the same window of this many seconds share an execution,
+# the deadline of the request starting it bounds the LLM max_tokens of all of them
+COALESCING_DEADLINE_WINDOW = float(os.getenv("COALESCING_DEADLINE_WINDOW", 5))
+# timeouts, retries and circuit breakers of the pipeline nodes, overridden with e.g. RERANK_TOTAL_TIMEOUT
+NODE_POLICY_DEFAULTS = dict(connect_timeout=5, max_retries=2, breaker_threshold=5, breaker_reset_timeout=30)
+GUARDRAIL_POLICY = NodePolicy.from_env("GUARDRAIL", **NODE_POLICY_DEFAULTS, total_timeout=30)
+EMBEDDING_POLICY = NodePolicy.from_env("EMBEDDING", **NODE_POLICY_DEFAULTS, total_timeout=30)
+RETRIEVER_POLICY = NodePolicy.from_env("RETRIEVER", **NODE_POLICY_DEFAULTS, total_timeout=30)
+# the answer is built from the retrieval order when the reranker is down or too slow, or when less
+# than RERANK_MIN_BUDGET seconds are left to the request deadline, which are kept for the LLM
+RERANK_POLICY = NodePolicy.from_env("RERANK", **NODE_POLICY_DEFAULTS, total_timeout=15, optional=True, min_budget=5)
+# generations are long, only the wait for the next chunk is bounded
+LLM_POLICY = NodePolicy.from_env("LLM", **{**NODE_POLICY_DEFAULTS, "max_retries": 1}, read_timeout=120)
+# end-to-end budget in seconds of the requests without X-Request-Timeout header, unset or 0 for no deadline
+REQUEST_TIMEOUT = float(os.getenv("MEGASERVICE_REQUEST_TIMEOUT", 0))
+# generation speed assumed until the first streams are measured
+LLM_TOKENS_PER_SECOND = float(os.getenv("LLM_TOKENS_PER_SECOND", 20))
+# seconds of the time left kept for the prompt processing and the delivery of the answer
+LLM_DEADLINE_MARGIN = float(os.getenv("LLM_DEADLINE_MARGIN", 1))
+# answers shorter than this are not worth generating, the request fails with 504 instead
+LLM_MIN_TOKENS = int(os.getenv("LLM_MIN_TOKENS", 16))
+# largest page of turns returned by the conversation history endpoint
+HISTORY_MAX_LIMIT = int(os.getenv("CONVERSATION_HISTORY_MAX_LIMIT", 100))
 
 TOKEN_ENCODING = tiktoken.get_encoding("cl100k_base")
+# explicit JSON responses use the codec of the megaservice HTTPService
+ResponseClass = FastJSONResponse if HTTP_SERVICE_FAST_JSON else JSONResponse
+
+def query_int(query_params: Dict[str, str], name: str, minimum: int = 0) -> Optional[int]:
+    """Integer query parameter, None when missing, 400 when it is not an integer of at least `minimum`."""
+    value = query_params.get(name)
+    if not value:
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        number = None
+    if number is None or number < minimum:
+        raise HTTPException(status_code=400, detail=f"Query parameter '{name}' must be an integer >= {minimum}")
+    return number
+
+
+def request_tenant(request: Request, db_name: Optional[str] = None) -> str:
+    """Tenant of a request for the fair admission: its database, else its API key, else the default one."""
+    if db_name:
+        return db_name
+    api_key = request.headers.get("x-api-key")
+    authorization = request.headers.get("authorization", "")
+    if not api_key and authorization.lower().startswith("bearer "):
+        api_key = authorization[7:].strip()
+    if api_key:
+        # the key itself must not end up in the metric labels
+        return "key-" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+    return DEFAULT_TENANT
+
+
+def request_lane(request: Request, stream: bool) -> str:
+    """Priority lane of a request, from its `X-Priority` header, else interactive for streams and batch otherwise."""
+    lane = request.headers.get("x-priority", "").strip().lower()
+    if lane in LANES:
+        return lane
+    return INTERACTIVE_LANE if stream else BATCH_LANE
+
+
+def request_deadline(request: Request) -> Optional[float]:
+    """Deadline of a request, `X-Request-Timeout` seconds from now, else MEGASERVICE_REQUEST_TIMEOUT."""
+    timeout = parse_timeout(request.headers.get(DEADLINE_HEADER))
+    if timeout is None and REQUEST_TIMEOUT > 0:
+        timeout = REQUEST_TIMEOUT
+    return deadline_after(timeout)
+
+
+class DecodeRate:
+    """Running average of the LLM generation speed, to fit the answers in the time left to their request."""
+
+    # streams this short are mostly first token latency, their throughput is noise
+    MIN_OUTPUT_TOKENS = 32
+
+    def __init__(self, tokens_per_second: float, smoothing: float = 0.2):
+        self.tokens_per_second = tokens_per_second
+        self.smoothing = smoothing
+
+    def observe(self, metrics: Dict):
+        if metrics.get("output_tokens", 0) >= self.MIN_OUTPUT_TOKENS and metrics.get("throughput"):
+            self.tokens_per_second += self.smoothing * (metrics["throughput"] - self.tokens_per_second)
+
+    def tokens_within(self, seconds: float) -> int:
+        return int((seconds - LLM_DEADLINE_MARGIN) * self.tokens_per_second)
+
+
+LLM_DECODE_RATE = DecodeRate(LLM_TOKENS_PER_SECOND)
+
 
 def align_inputs(self, inputs, cur_node, runtime_graph, llm_parameters_dict, **kwargs):
     if self.services[cur_node].service_type == ServiceType.EMBEDDING:
@@ -59,6 +188,16 @@ def align_inputs(self, inputs, cur_node, runtime_graph, llm_parameters_dict, **k
         next_inputs["model"] = LLM_MODEL
         next_inputs["messages"] = [{"role": "user", "content": inputs["inputs"]}]
         next_inputs["max_tokens"] = llm_parameters_dict["max_tokens"]
+        context = kwargs.get("context")
+        time_left = context.time_left() if context is not None else None
+        if time_left is not None:
+            # a longer answer would be cut by the deadline midway, generating it is wasted
+            budget = LLM_DECODE_RATE.tokens_within(time_left)
+            if budget < LLM_MIN_TOKENS:
+                deadline_exceeded.labels(cur_node).inc()
+                raise DeadlineExceeded(cur_node)
+            if budget < next_inputs["max_tokens"]:
+                next_inputs["max_tokens"] = context.max_tokens = budget
         next_inputs["top_p"] = llm_parameters_dict["top_p"]
         next_inputs["stream"] = inputs["stream"]
         next_inputs["frequency_penalty"] = inputs["frequency_penalty"]
@@ -76,15 +215,22 @@ def align_outputs(self, data, cur_node, inputs, runtime_graph, llm_parameters_di
     elif self.services[cur_node].service_type == ServiceType.RETRIEVER:
         if "retrieved_docs" in data:
             enhanced_docs = []
+            token_counts = []
+            languages = []
             for doc, metadata in zip(data["retrieved_docs"], data["metadata"]):
                 enhanced_doc = {
                     "content": doc["text"],
-                    "source": metadata["file_name"],
-                    "id": metadata["id"]
+                    "source": metadata.get("file_name"),
+                    "id": metadata.get("id")
                 }
                 enhanced_docs.append(enhanced_doc)
+                # stored at ingestion, saves tokenizing the chunks when packing the prompt
+                token_counts.append(metadata.get("token_count"))
+                languages.append(metadata.get("lang"))
             
             next_data["source_docs"] = enhanced_docs
+            next_data["token_counts"] = token_counts
+            next_data["languages"] = languages
             
         docs = [doc["text"] for doc in data["retrieved_docs"]]
 
@@ -104,46 +250,51 @@ def align_outputs(self, data, cur_node, inputs, runtime_graph, llm_parameters_di
                         runtime_graph.add_edge(cur_node, nds)
                     runtime_graph.delete_node_if_exists(ds)
 
-            # handle template
-            # if user provides template, then format the prompt with it
-            # otherwise, use the default template
-            prompt = data["initial_query"]
-            chat_template = llm_parameters_dict["chat_template"]
-            if chat_template:
-                prompt_template = PromptTemplate.from_template(chat_template)
-                input_variables = prompt_template.input_variables
-                if sorted(input_variables) == ["context", "question"]:
-                    prompt = prompt_template.format(question=data["initial_query"], context="\n".join(docs))
-                elif input_variables == ["question"]:
-                    prompt = prompt_template.format(question=data["initial_query"])
-                else:
-                    print(f"{prompt_template} not used, we only support 2 input variables ['question', 'context']")
-                    prompt = ChatTemplate.generate_rag_prompt(data["initial_query"], docs)
-            else:
-                prompt = ChatTemplate.generate_rag_prompt(data["initial_query"], docs)
+            token_counts = next_data.get("token_counts", [])
+            languages = next_data.get("languages", [])
+            packed = pack_context([(doc, token_counts[i] if i < len(token_counts) else None) for i, doc in enumerate(docs)])
+            prompt, prompt_tokens = build_prompt(
+                data["initial_query"],
+                [docs[i] for i in packed.indices],
+                [languages[i] if i < len(languages) else None for i in packed.indices],
+                packed.tokens,
+                llm_parameters_dict["chat_template"],
+            )
             next_data["inputs"] = prompt
             enhanced_sources = []
-            for doc in data["retrieved_docs"]:
-                source = doc.copy()
+            for i in packed.indices:
+                source = data["retrieved_docs"][i].copy()
                 if "relevance_score" not in source:
                     source["relevance_score"] = 1.0
                 enhanced_sources.append(source)
             next_data["selected_sources"] = enhanced_sources
+            if kwargs.get("context"):
+                kwargs["context"].sources = enhanced_sources
+                kwargs["context"].prompt_tokens = prompt_tokens
 
     elif self.services[cur_node].service_type == ServiceType.RERANK:
         # rerank the inputs with the scores
         reranker_parameters = kwargs.get("reranker_parameters", None)
         top_n = reranker_parameters.top_n if reranker_parameters else 5
         docs = inputs["texts"]
-        reranked_docs = []
+        token_counts = inputs.get("token_counts", [])
+        languages = inputs.get("languages", [])
         selected_sources = []
         
         # doc_metadata = inputs.get("doc_metadata", [])
         doc_metadata = inputs.get("source_docs", [])
+
+        # fill the context in rerank order, duplicates are replaced by the next best chunks
+        candidates = []
+        for best_response in data:
+            idx = best_response["index"]
+            candidates.append((docs[idx], token_counts[idx] if idx < len(token_counts) else None))
+        packed = pack_context(candidates, limit=top_n)
+        best_responses = [data[i] for i in packed.indices]
+        reranked_docs = [docs[best_response["index"]] for best_response in best_responses]
         
-        for best_response in data[:top_n]:
+        for best_response in best_responses:
             idx = best_response["index"]
-            reranked_docs.append(docs[idx])
             
             if idx < len(doc_metadata):
                 source_info = doc_metadata[idx].copy()
@@ -160,28 +311,20 @@ def align_outputs(self, data, cur_node, inputs, runtime_graph, llm_parameters_di
                 #     source_info["file_name"] = file_name
                 
                 selected_sources.append(source_info)
-                print(f"DEBUG: Added reranked source: {source_info.get('source', 'unknown')} with score {source_info.get('relevance_score', 0.0)}")
-
-        # handle template
-        # if user provides template, then format the prompt with it
-        # otherwise, use the default template
-        prompt = inputs["query"]
-        chat_template = llm_parameters_dict["chat_template"]
-        if chat_template:
-            prompt_template = PromptTemplate.from_template(chat_template)
-            input_variables = prompt_template.input_variables
-            if sorted(input_variables) == ["context", "question"]:
-                prompt = prompt_template.format(question=prompt, context="\n".join(reranked_docs))
-            elif input_variables == ["question"]:
-                prompt = prompt_template.format(question=prompt)
-            else:
-                print(f"{prompt_template} not used, we only support 2 input variables ['question', 'context']")
-                prompt = ChatTemplate.generate_rag_prompt(prompt, reranked_docs)
-        else:
-            prompt = ChatTemplate.generate_rag_prompt(prompt, reranked_docs)
+
+        reranked_languages = [
+            languages[best_response["index"]] if best_response["index"] < len(languages) else None
+            for best_response in best_responses
+        ]
+        prompt, prompt_tokens = build_prompt(
+            inputs["query"], reranked_docs, reranked_languages, packed.tokens, llm_parameters_dict["chat_template"]
+        )
 
         next_data["inputs"] = prompt
         next_data["selected_sources"] = selected_sources
+        if kwargs.get("context"):
+            kwargs["context"].sources = selected_sources
+            kwargs["context"].prompt_tokens = prompt_tokens
 
     elif self.services[cur_node].service_type == ServiceType.LLM and not llm_parameters_dict["stream"]:
         next_data["text"] = data["choices"][0]["message"]["content"]
@@ -194,106 +337,109 @@ def align_outputs(self, data, cur_node, inputs, runtime_graph, llm_parameters_di
 
     return next_data
 
-def align_generator(self, gen, **kwargs):
-    buffer = ""
-    request_id = kwargs.get("request_id", str(uuid4()))
-    
-    ttft_start_time = kwargs.get("ttft_start_time", time.perf_counter())
-    e2e_start_time = ttft_start_time
-    
-    ttft = 0.0
-    first_token_received = False
-    token_count = 0
-    
-    self.__class__._metrics_registry[request_id] = {
-        "ttft": 0.0,
-        "e2e_latency": 0.0,
-        "completed": False,
-        "output_tokens": 0,
-        "throughput": 0
-    }
-    
-    full_response = ""
+def align_skipped(self, inputs, cur_node, runtime_graph, llm_parameters_dict, **kwargs):
+    if self.services[cur_node].service_type == ServiceType.RERANK:
+        # keep the retrieval order, scored like the pipeline without rerank
+        ranking = [{"index": i, "score": 1.0} for i in range(len(inputs["texts"]))]
+        return align_outputs(self, ranking, cur_node, inputs, runtime_graph, llm_parameters_dict, **kwargs)
+    return inputs
+
+@lru_cache(maxsize=128)
+def compile_chat_template(chat_template: str):
+    """Parse a user chat template once, return it with its sorted input variables."""
+    prompt_template = PromptTemplate.from_template(chat_template)
+    return prompt_template, sorted(prompt_template.input_variables)
+
+
+@lru_cache(maxsize=64)
+def template_tokens(template: str) -> int:
+    """Tokens of a prompt template without its variables, counted once per template."""
+    return len(TOKEN_ENCODING.encode(template.format(context="", question="")))
+
+
+def build_prompt(
+    question: str, docs: List[str], languages: List[Optional[str]], context_tokens: int, chat_template: Optional[str]
+):
+    """Format the LLM prompt from the packed docs, return it with its token count.
+
+    The user template is used when it has the supported variables, the default RAG template of the
+    docs `languages` (tags stored at ingestion) otherwise. The prompt tokens add up the template,
+    the question and `context_tokens`, the packed docs are not tokenized again.
+    """
+    # handle template
+    # if user provides template, then format the prompt with it
+    # otherwise, use the default template
+    context_str = "\n".join(docs)
+    question_tokens = len(TOKEN_ENCODING.encode(question))
+    if chat_template:
+        prompt_template, input_variables = compile_chat_template(chat_template)
+        if input_variables == ["context", "question"]:
+            prompt = prompt_template.format(question=question, context=context_str)
+            return prompt, template_tokens(chat_template) + question_tokens + context_tokens
+        elif input_variables == ["question"]:
+            return prompt_template.format(question=question), template_tokens(chat_template) + question_tokens
+        else:
+            print(f"{prompt_template} not used, we only support 2 input variables ['question', 'context']")
+    template = ChatTemplate.get_template(docs, languages)
+    prompt = template.format(context=context_str, question=question)
+    return prompt, template_tokens(template) + question_tokens + context_tokens
+
+
+def sse_event(event: str, data: Dict) -> str:
+    """Encode one typed server-sent event, `data` is sent as JSON."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+async def align_generator(self, gen, **kwargs):
+    """Turn the OpenAI style LLM stream into ("token", text) events and a final ("metrics", dict) one.
+
+    The events are encoded for the client by `ChatQnAService.track_stream`.
+    """
+    # timings go to the context of this request, a fresh one when called outside of a gateway request
+    context = kwargs.get("context") or RequestContext()
+    parts = []
     
-    for line in gen:
-        line = line.decode("utf-8")
-        start = line.find("{")
-        end = line.rfind("}") + 1
-        json_str = line[start:end]
-        
-        try:
-            json_data = json.loads(json_str)
-            if not first_token_received and json_data.get("choices") and json_data["choices"] and json_data["choices"][0].get("delta") and json_data["choices"][0]["delta"].get("content"):
-                ttft = time.perf_counter() - ttft_start_time
-                first_token_received = True
-                self.__class__._metrics_registry[request_id]["ttft"] = ttft
-            
-            if (
-                json_data["choices"][0]["finish_reason"] != "eos_token"
-                and "content" in json_data["choices"][0]["delta"]
-            ):
-                new_content = json_data["choices"][0]["delta"]["content"]
-                buffer += new_content
-                full_response += new_content
-
-                if buffer:
-                    yield buffer
-                    buffer = ""
-            
-            if json_data["choices"][0]["finish_reason"] == "stop":
-                e2e_latency = time.perf_counter() - e2e_start_time
-                token_count = len(TOKEN_ENCODING.encode(full_response))
-                throughput = token_count / max(e2e_latency - ttft if ttft > 0 else e2e_latency, 0.001)
-                
-                self.__class__._metrics_registry[request_id]["e2e_latency"] = e2e_latency
-                self.__class__._metrics_registry[request_id]["completed"] = True
-                self.__class__._metrics_registry[request_id]["output_tokens"] = token_count
-                self.__class__._metrics_registry[request_id]["throughput"] = throughput
-                
-                metrics_json = json.dumps({
-                    "metrics": {
-                        "ttft": ttft if ttft > 0 else e2e_latency,
-                        "output_tokens": token_count,
-                        "throughput": throughput,
-                        "e2e_latency": e2e_latency
-                    }
-                })
-                
-                yield f"__METRICS__{metrics_json}__METRICS__"
+    try:
+        # closing `gen` on the way out drops the upstream LLM request if the stream is abandoned
+        async with aclosing(gen):
+            async for line in gen:
+                line = line.decode("utf-8")
+                start = line.find("{")
+                end = line.rfind("}") + 1
+                json_str = line[start:end]
                 
-        except Exception as e:
-            if buffer:
-                yield buffer
-                buffer = ""
-            
-            cleaned_json_str = json_str.strip()
-            if cleaned_json_str:
-                yield cleaned_json_str
-    
-    if not self.__class__._metrics_registry[request_id]["completed"]:
-        e2e_latency = time.perf_counter() - e2e_start_time
-        token_count = len(TOKEN_ENCODING.encode(full_response))
-        throughput = token_count / max(e2e_latency - ttft if ttft > 0 else e2e_latency, 0.001)
-        
-        self.__class__._metrics_registry[request_id]["e2e_latency"] = e2e_latency
-        self.__class__._metrics_registry[request_id]["completed"] = True
-        self.__class__._metrics_registry[request_id]["output_tokens"] = token_count
-        self.__class__._metrics_registry[request_id]["throughput"] = throughput
-        
-        metrics_json = json.dumps({
-            "metrics": {
-                "ttft": ttft if ttft > 0 else e2e_latency,
-                "output_tokens": token_count,
-                "throughput": throughput,
-                "e2e_latency": e2e_latency
-            }
-        })
-        yield f"__METRICS__{metrics_json}__METRICS__"
-    
-    if buffer:
-        yield buffer
+                try:
+                    json_data = json.loads(json_str)
+                    if json_data.get("choices") and json_data["choices"][0].get("delta") and json_data["choices"][0]["delta"].get("content"):
+                        context.first_token()
+                    
+                    if (
+                        json_data["choices"][0]["finish_reason"] != "eos_token"
+                        and "content" in json_data["choices"][0]["delta"]
+                    ):
+                        new_content = json_data["choices"][0]["delta"]["content"]
+                        if new_content:
+                            parts.append(new_content)
+                            yield ("token", new_content)
+                    
+                    if json_data["choices"][0]["finish_reason"] == "stop":
+                        metrics = context.complete(len(TOKEN_ENCODING.encode("".join(parts))))
+                        LLM_DECODE_RATE.observe(metrics)
+                        yield ("metrics", metrics)
+                        
+                except Exception as e:
+                    cleaned_json_str = json_str.strip()
+                    if cleaned_json_str:
+                        yield ("token", cleaned_json_str)
+    except (GeneratorExit, asyncio.CancelledError):
+        if not context.completed:
+            context.cancel("stream", output_tokens=len(TOKEN_ENCODING.encode("".join(parts))))
+        raise
     
-    yield ""
+    if not context.completed:
+        metrics = context.complete(len(TOKEN_ENCODING.encode("".join(parts))))
+        LLM_DECODE_RATE.observe(metrics)
+        yield ("metrics", metrics)
 
 
 class SourceInfo(BaseModel):
@@ -320,20 +466,30 @@ class ConversationResponse(BaseModel):
     metrics: Optional[Dict[str, float]] = None
 
 
+class RAGResult(BaseModel):
+    """Answer of `ChatQnAService.generate`, either complete or as a stream of chunks."""
+    request_id: str
+    sources: List[Dict] = []
+    answer: Optional[str] = None
+    # async iterator of answer chunks, answer and metrics are set once it has been consumed, it must be
+    # consumed or closed even if it is never read, to release the request and its LLM stream
+    stream: Optional[Any] = None
+    metrics: Optional[Dict] = None
+    # False while streaming and for a stream that was abandoned or failed midway
+    completed: bool = False
+
+
+CJK_PATTERN = re.compile("[\u4E00-\u9FFF]")
+
+
 class ChatTemplate:
-    @staticmethod
-    def generate_rag_prompt(question, documents):
-        context_str = "\n".join(documents)
-        if context_str and len(re.findall("[\u4E00-\u9FFF]", context_str)) / len(context_str) >= 0.3:
-            # chinese context
-            template = """
+    ZH_TEMPLATE = """
 ### 你将扮演一个乐于助人、尊重他人并诚实的助手，你的目标是帮助用户解答问题。有效地利用来自本地知识库的搜索结果。确保你的回答中只包含相关信息。如果你不确定问题的答案，请避免分享不准确的信息。
 ### 搜索结果：{context}
 ### 问题：{question}
 ### 回答：
 """
-        else:
-            template = """
+    EN_TEMPLATE = """
 ### You are a helpful, respectful and honest assistant to help the user with questions. \
 Please refer to the search results obtained from the local knowledge base. \
 But be careful to not incorporate the information that you think is not relevant to the question. \
@@ -342,7 +498,37 @@ If you don't know the answer to a question, please don't share false information
 ### Question: {question} \n
 ### Answer:
 """
-        return template.format(context=context_str, question=question)
+
+    @staticmethod
+    def detect_language(text):
+        """Same tag as dataprep `get_language_tag`, for chunks ingested without one."""
+        if text and len(CJK_PATTERN.findall(text)) / len(text) >= 0.3:
+            return "zh"
+        return "en"
+
+    @staticmethod
+    def get_template(documents, languages=None):
+        """Chinese template when the docs tagged `zh` hold at least half of the context, English otherwise.
+
+        Only docs without a tag in `languages` are scanned, tagged ones cost a lookup.
+        """
+        zh_chars = total_chars = 0
+        for i, doc in enumerate(documents):
+            lang = languages[i] if languages and i < len(languages) and languages[i] else None
+            if lang is None:
+                lang = ChatTemplate.detect_language(doc)
+            total_chars += len(doc)
+            if lang == "zh":
+                zh_chars += len(doc)
+        if total_chars and zh_chars / total_chars >= 0.5:
+            # chinese context
+            return ChatTemplate.ZH_TEMPLATE
+        return ChatTemplate.EN_TEMPLATE
+
+    @staticmethod
+    def generate_rag_prompt(question, documents, languages=None):
+        context_str = "\n".join(documents)
+        return ChatTemplate.get_template(documents, languages).format(context=context_str, question=question)
 
 class ChatQnAService:
     def __init__(self, host="0.0.0.0", port=8000):
@@ -351,10 +537,15 @@ class ChatQnAService:
         ServiceOrchestrator.align_inputs = align_inputs
         ServiceOrchestrator.align_outputs = align_outputs
         ServiceOrchestrator.align_generator = align_generator
-        ServiceOrchestrator._metrics_registry = {}
+        ServiceOrchestrator.align_skipped = align_skipped
         self.megaservice = ServiceOrchestrator()
         self.endpoint = str(MegaServiceEndpoint.CHAT_QNA)
-        self.last_result_dict = {}
+        self.answer_cache = SemanticAnswerCache.from_env()
+        self.collection_generations = CollectionGenerations.from_env()
+        if self.answer_cache is not None and self.collection_generations.client is None:
+            # nothing would bump a process-local generation, answers would be served stale until their TTL
+            print("WARNING: answer cache disabled, it needs COLLECTION_GENERATION_REDIS_URL to see dataprep ingests")
+            self.answer_cache = None
 
     def add_remote_service(self):
 
@@ -365,6 +556,8 @@ class ChatQnAService:
             endpoint="/embed",
             use_remote_service=True,
             service_type=ServiceType.EMBEDDING,
+            policy=EMBEDDING_POLICY,
+            replicas=EMBEDDING_SERVER_HOSTS,
         )
 
         retriever = MicroService(
@@ -374,6 +567,8 @@ class ChatQnAService:
             endpoint="/v1/retrieval",
             use_remote_service=True,
             service_type=ServiceType.RETRIEVER,
+            policy=RETRIEVER_POLICY,
+            replicas=RETRIEVER_SERVICE_HOSTS,
         )
 
         rerank = MicroService(
@@ -383,6 +578,8 @@ class ChatQnAService:
             endpoint="/rerank",
             use_remote_service=True,
             service_type=ServiceType.RERANK,
+            policy=RERANK_POLICY,
+            replicas=RERANK_SERVER_HOSTS,
         )
 
         llm = MicroService(
@@ -392,6 +589,8 @@ class ChatQnAService:
             endpoint="/v1/chat/completions",
             use_remote_service=True,
             service_type=ServiceType.LLM,
+            policy=LLM_POLICY,
+            replicas=LLM_SERVER_HOSTS,
         )
         self.megaservice.add(embedding).add(retriever).add(rerank).add(llm)
         self.megaservice.flow_to(embedding, retriever)
@@ -407,6 +606,8 @@ class ChatQnAService:
             endpoint="/embed",
             use_remote_service=True,
             service_type=ServiceType.EMBEDDING,
+            policy=EMBEDDING_POLICY,
+            replicas=EMBEDDING_SERVER_HOSTS,
         )
 
         retriever = MicroService(
@@ -416,6 +617,8 @@ class ChatQnAService:
             endpoint="/v1/retrieval",
             use_remote_service=True,
             service_type=ServiceType.RETRIEVER,
+            policy=RETRIEVER_POLICY,
+            replicas=RETRIEVER_SERVICE_HOSTS,
         )
 
         llm = MicroService(
@@ -425,6 +628,8 @@ class ChatQnAService:
             endpoint="/v1/chat/completions",
             use_remote_service=True,
             service_type=ServiceType.LLM,
+            policy=LLM_POLICY,
+            replicas=LLM_SERVER_HOSTS,
         )
         self.megaservice.add(embedding).add(retriever).add(llm)
         self.megaservice.flow_to(embedding, retriever)
@@ -438,6 +643,8 @@ class ChatQnAService:
             endpoint="/v1/guardrails",
             use_remote_service=True,
             service_type=ServiceType.GUARDRAIL,
+            policy=GUARDRAIL_POLICY,
+            replicas=GUARDRAIL_SERVICE_HOSTS,
         )
         embedding = MicroService(
             name="embedding",
@@ -446,6 +653,8 @@ class ChatQnAService:
             endpoint="/embed",
             use_remote_service=True,
             service_type=ServiceType.EMBEDDING,
+            policy=EMBEDDING_POLICY,
+            replicas=EMBEDDING_SERVER_HOSTS,
         )
         retriever = MicroService(
             name="retriever",
@@ -454,6 +663,8 @@ class ChatQnAService:
             endpoint="/v1/retrieval",
             use_remote_service=True,
             service_type=ServiceType.RETRIEVER,
+            policy=RETRIEVER_POLICY,
+            replicas=RETRIEVER_SERVICE_HOSTS,
         )
         rerank = MicroService(
             name="rerank",
@@ -462,6 +673,8 @@ class ChatQnAService:
             endpoint="/rerank",
             use_remote_service=True,
             service_type=ServiceType.RERANK,
+            policy=RERANK_POLICY,
+            replicas=RERANK_SERVER_HOSTS,
         )
         llm = MicroService(
             name="llm",
@@ -470,6 +683,8 @@ class ChatQnAService:
             endpoint="/v1/chat/completions",
             use_remote_service=True,
             service_type=ServiceType.LLM,
+            policy=LLM_POLICY,
+            replicas=LLM_SERVER_HOSTS,
         )
         # guardrail_out = MicroService(
         #     name="guardrail_out",
@@ -489,16 +704,100 @@ class ChatQnAService:
 
     async def handle_request(self, request: Request):
         data = await request.json()
-        stream_opt = data.get("stream", True)
         chat_request = ChatCompletionRequest.parse_obj(data)
+        chat_request.stream = data.get("stream", True)
+        include_metrics = data.get("include_metrics", False)
+        try:
+            result = await self.generate_for_client(
+                request, chat_request, data.get("collection_name", None), data.get("db_name", None)
+            )
+        except (AdmissionRejected, CircuitOpenError, DeadlineExceeded) as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers)
+        except Exception as e:
+            print(f"ERROR in handle_request: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            raise HTTPException(status_code=500, detail=str(e))
+
+        if result is None:
+            return Response(status_code=CLIENT_CLOSED_REQUEST)
+        if result.stream is not None:
+            return CancellableStreamingResponse(result.stream, media_type="text/event-stream")
+
+        completion_response = ChatCompletionResponse(
+            model="chatqna",
+            choices=[
+                ChatCompletionResponseChoice(
+                    index=0,
+                    message=ChatMessage(role="assistant", content=result.answer),
+                    finish_reason="stop",
+                )
+            ],
+            usage=UsageInfo(),
+        )
+        response_dict = completion_response.dict()
+        response_dict["sources"] = result.sources
+        if include_metrics:
+            response_dict["metrics"] = result.metrics
+
+        return ResponseClass(content=response_dict)
+
+    async def generate_for_client(
+        self,
+        request: Request,
+        chat_request: ChatCompletionRequest,
+        collection_name: Optional[str] = None,
+        db_name: Optional[str] = None,
+    ) -> Optional[RAGResult]:
+        """`generate` on behalf of an HTTP client, cancelled if the client disconnects before the answer starts.
+
+        The pipeline nodes still running are cancelled with it, None is returned in that case.
+        The request is admitted as its tenant (`db_name` or API key) in its priority lane, and answered
+        within its deadline.
+        The request body must have been read already.
+        """
+        generation = asyncio.ensure_future(
+            self.generate(
+                chat_request,
+                collection_name,
+                tenant=request_tenant(request, db_name),
+                lane=request_lane(request, bool(chat_request.stream)),
+                deadline=request_deadline(request),
+            )
+        )
+        watcher = asyncio.ensure_future(wait_for_disconnect(request.receive))
+        try:
+            await asyncio.wait({generation, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            watcher.cancel()
+            if not generation.done():
+                generation.cancel()
+        if not generation.done():
+            print("Client disconnected before the answer started, request cancelled")
+            # let the cancellation run through the pipeline before answering
+            await asyncio.wait({generation})
+            return None
+        return generation.result()
+
+    async def generate(
+        self,
+        chat_request: ChatCompletionRequest,
+        collection_name: Optional[str] = None,
+        tenant: str = DEFAULT_TENANT,
+        lane: str = INTERACTIVE_LANE,
+        deadline: Optional[float] = None,
+    ) -> RAGResult:
+        """Answer a chat request through the RAG pipeline.
+
+        In-process entry point shared by the HTTP handlers, nothing is serialized on the way. With
+        `chat_request.stream` the result carries the token stream, its `answer` and `metrics` are
+        filled in once the stream has been consumed. `tenant` and `lane` are those the pipeline is
+        admitted as when the concurrent pipelines are capped. `deadline` (time.monotonic()) bounds the
+        wait for admission and the node calls, and the length of the answer.
+        """
+        stream_opt = bool(chat_request.stream)
         prompt = handle_message(chat_request.messages)
-        request_id = str(uuid4())
-        
-        sources = []
-        self.last_sources = []
 
-        collection_name = data.get("collection_name", None)
-        
         parameters = LLMParams(
             max_tokens=chat_request.max_tokens if chat_request.max_tokens else 1024,
             top_k=chat_request.top_k if chat_request.top_k else 5,
@@ -523,123 +822,210 @@ class ChatQnAService:
             top_n=chat_request.top_n if chat_request.top_n else 5,
         )
 
-        e2e_start_time = time.perf_counter()
-        ttft_start_time = e2e_start_time
-        
+        context = RequestContext(max_tokens=parameters.max_tokens, deadline=deadline)
         try:
-            result_dict, runtime_graph = await self.megaservice.schedule(
-                initial_inputs={"text": prompt},
-                llm_parameters=parameters,
-                retriever_parameters=retriever_parameters,
-                reranker_parameters=reranker_parameters,
-                ttft_start_time=ttft_start_time,
-                request_id=request_id,
+            result = await self.run_pipeline(
+                context, prompt, collection_name, parameters, retriever_parameters, reranker_parameters, tenant, lane
             )
-            
-            self.last_result_dict = result_dict
-
-            sources = []
-            try:
-                last_node = runtime_graph.all_leaves()[-1]
-                if last_node in result_dict and isinstance(result_dict[last_node], dict) and "selected_sources" in result_dict[last_node]:
-                    sources = result_dict[last_node]["selected_sources"]
-                    print(f"DEBUG: Found {len(sources)} sources in last node")
-            except (IndexError, TypeError, KeyError) as e:
-                print(f"Error accessing last node sources: {e}")
-
-            if not sources:
-                for node_name, node_data in result_dict.items():
-                    if isinstance(node_data, dict) and "selected_sources" in node_data:
-                        sources = node_data["selected_sources"]
-                        print(f"DEBUG: Found {len(sources)} sources in node {node_name}")
-                        break
-
-            self.last_sources = sources
-            
-            for node, response in result_dict.items():
-                if isinstance(response, StreamingResponse):
-                    return response
-            
-            e2e_end_time = time.perf_counter()
-            e2e_latency = e2e_end_time - e2e_start_time
-                    
-            response = "No response generated"
-            try:
-                last_node = runtime_graph.all_leaves()[-1]
-                if isinstance(result_dict[last_node], dict) and "text" in result_dict[last_node]:
-                    response = result_dict[last_node]["text"]
-                else:
-                    print(f"WARNING: No response text found in result_dict[{last_node}]")
-            except (IndexError, TypeError, KeyError) as e:
-                print(f"Error accessing last node response: {e}")
-                
-            print(f"DEBUG: Using {len(sources)} pre-extracted sources for response")
-                
-            choices = []
-            usage = UsageInfo()
-            choices.append(
-                ChatCompletionResponseChoice(
-                    index=0,
-                    message=ChatMessage(role="assistant", content=response),
-                    finish_reason="stop",
-                )
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                context.cancel("pipeline")
+            context.release()
+            raise
+        if result.stream is None:
+            # streams release the context once consumed or abandoned, see `track_stream`
+            context.release()
+        return result
+
+    async def run_pipeline(
+        self,
+        context: RequestContext,
+        prompt: str,
+        collection_name: Optional[str],
+        parameters: LLMParams,
+        retriever_parameters: RetrieverParms,
+        reranker_parameters: RerankerParms,
+        tenant: str = DEFAULT_TENANT,
+        lane: str = INTERACTIVE_LANE,
+    ) -> RAGResult:
+        answer_cache_key = None
+        if self.answer_cache is not None and not parameters.chat_template:
+            cached, answer_cache_key = await self.lookup_cached_answer(context, prompt, collection_name)
+            if cached:
+                return self.cached_answer_result(context, cached, parameters.stream)
+
+        schedule_kwargs = dict(
+            initial_inputs={"text": prompt},
+            llm_parameters=parameters,
+            retriever_parameters=retriever_parameters,
+            reranker_parameters=reranker_parameters,
+            context=context,
+        )
+        coalesce_key = None
+        if REQUEST_COALESCING_ENABLED:
+            # identical questions in flight at the same time share one pipeline run and LLM stream
+            time_left = context.time_left()
+            coalesce_key = json.dumps(
+                [
+                    tenant,
+                    None if time_left is None else int(time_left // COALESCING_DEADLINE_WINDOW),
+                    " ".join(prompt.split()).casefold(),
+                    collection_name or DEFAULT_COLLECTION_NAME,
+                    parameters.dict(exclude={"id"}),
+                    retriever_parameters.dict(exclude={"id"}),
+                    reranker_parameters.dict(exclude={"id"}),
+                ],
+                sort_keys=True,
+                default=str,
             )
-            
-            completion_response = ChatCompletionResponse(
-                model="chatqna", 
-                choices=choices, 
-                usage=usage
+        admission = self.megaservice.admission
+        slot = None
+        if admission is not None and coalesce_key not in self.megaservice.single_flight:
+            # joining a pipeline in flight costs the backends nothing, only new pipelines wait for a slot,
+            # which is held until the answer is complete or abandoned by every request sharing it
+            time_left = context.time_left()
+            if time_left is not None and time_left <= 0:
+                raise DeadlineExceeded("admission")
+            slot = await admission.acquire(
+                tenant, lane, timeout=None if time_left is None else min(time_left, admission.queue_timeout)
             )
-            
-            response_dict = completion_response.dict()
-            response_dict["sources"] = sources
-
-            if not stream_opt:
-                token_count = len(TOKEN_ENCODING.encode(response))
-                throughput = token_count / max(e2e_latency, 0.001)
-                self.megaservice.__class__._metrics_registry[request_id] = {
-                    "ttft": e2e_latency,
-                    "e2e_latency": e2e_latency,
-                    "completed": True,
-                    "output_tokens": token_count,
-                    "throughput": throughput
-                }
-
-            include_metrics = data.get("include_metrics", False)
-
-            metrics_registry_data = self.megaservice.__class__._metrics_registry.get(request_id, {})
-
-            if include_metrics:
-                if metrics_registry_data and metrics_registry_data.get("completed", False):
-                    metrics_data = {
-                        "ttft": float(metrics_registry_data.get("ttft", 0.0)),
-                        "e2e_latency": float(metrics_registry_data.get("e2e_latency", 0.0)),
-                        "output_tokens": int(metrics_registry_data.get("output_tokens", 0)),
-                        "throughput": float(metrics_registry_data.get("throughput", 0.0))
-                    }
-                else:
-                    metrics_data = {
-                        "ttft": 0.0,
-                        "e2e_latency": 0.0,
-                        "output_tokens": 0,
-                        "throughput": 0.0
-                    }
-                response_dict["metrics"] = metrics_data
-
-            if request_id in self.megaservice.__class__._metrics_registry:
-                del self.megaservice.__class__._metrics_registry[request_id]
-            
-            print(f"DEBUG: Returning response with {len(sources)} sources")
-            for i, src in enumerate(sources):
-                print(f"DEBUG: Source {i+1}: {src.get('source', 'unknown')} score: {src.get('relevance_score', 0.0)}")
-            
-            return JSONResponse(content=response_dict)
-            
+            if coalesce_key is None:
+                context.on_release(slot.release)
+        if coalesce_key is not None:
+            # the execution holds the slot, it goes on streaming to the others when this request leaves
+            result_dict, runtime_graph, is_leader = await self.megaservice.schedule_coalesced(
+                coalesce_key, release=slot.release if slot is not None else None, **schedule_kwargs
+            )
+        else:
+            result_dict, runtime_graph = await self.megaservice.schedule(**schedule_kwargs)
+            is_leader = True
+        if not is_leader:
+            # the leader stores the answer once
+            answer_cache_key = None
+
+        if not context.sources:
+            # requests coalesced into another one's execution only get its results
+            for node_data in result_dict.values():
+                if isinstance(node_data, dict) and "selected_sources" in node_data:
+                    context.sources = node_data["selected_sources"]
+                    break
+
+        result = RAGResult(request_id=context.request_id, sources=context.sources)
+        for node, response in result_dict.items():
+            if isinstance(response, StreamingResponse):
+                result.stream = self.answer_stream(result, context, response.body_iterator, answer_cache_key)
+                return result
+
+        response = "No response generated"
+        try:
+            last_node = runtime_graph.all_leaves()[-1]
+            if isinstance(result_dict[last_node], dict) and "text" in result_dict[last_node]:
+                response = result_dict[last_node]["text"]
+            else:
+                print(f"WARNING: No response text found in result_dict[{last_node}]")
+        except (IndexError, TypeError, KeyError) as e:
+            print(f"Error accessing last node response: {e}")
+
+        if answer_cache_key and response != "No response generated":
+            self.answer_cache.store(*answer_cache_key, response, context.sources)
+
+        result.answer = response
+        result.metrics = context.complete(len(TOKEN_ENCODING.encode(response)))
+        result.completed = True
+        return result
+
+    async def lookup_cached_answer(self, context: RequestContext, prompt: str, collection_name: Optional[str]):
+        """Look the question up in the semantic answer cache.
+
+        Returns the cached entry (or None) and the (embedding, collection, generation) key to store the
+        generated answer under, the key is None when the cache cannot be used for this request. The
+        query embedding is kept on the context for the pipeline run on a miss.
+        """
+        collection = collection_name or DEFAULT_COLLECTION_NAME
+        generation = await self.collection_generations.get(collection)
+        embedding_node = next(
+            (name for name, service in self.megaservice.services.items() if service.service_type == ServiceType.EMBEDDING),
+            None,
+        )
+        if generation is None or embedding_node is None:
+            return None, None
+        try:
+            reply = await self.megaservice.invoke_node(embedding_node, {"inputs": prompt}, context.deadline)
+            embedding = reply[0]
         except Exception as e:
-            print(f"ERROR in handle_request: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            raise HTTPException(status_code=500, detail=str(e))
+            print(f"Answer cache lookup skipped: {e}")
+            return None, None
+        # the embedding node of the pipeline run on a miss reuses it
+        context.query_embedding = (prompt, reply)
+        key = (embedding, collection, generation)
+        return self.answer_cache.lookup(*key), key
+
+    def cached_answer_result(self, context: RequestContext, cached: Dict, stream_opt: bool) -> RAGResult:
+        context.sources = cached["sources"]
+        result = RAGResult(request_id=context.request_id, sources=context.sources)
+        if stream_opt:
+            result.stream = self.answer_stream(result, context, self.stream_cached_answer(context, cached["answer"]))
+            return result
+
+        result.answer = cached["answer"]
+        result.metrics = context.complete(len(TOKEN_ENCODING.encode(cached["answer"])))
+        result.completed = True
+        return result
+
+    async def stream_cached_answer(self, context: RequestContext, answer: str):
+        """Replay a cached answer in the same chunk and metrics format as `align_generator`."""
+        context.first_token()
+        for chunk in re.findall(r"\s*\S+", answer):
+            yield ("token", chunk)
+        yield ("metrics", context.complete(len(TOKEN_ENCODING.encode(answer))))
+
+    def answer_stream(self, result: RAGResult, context: RequestContext, body_iterator, answer_cache_key=None):
+        """`track_stream` of the answer, which releases the request and closes `body_iterator` when closed.
+
+        Also when it is closed before it started, e.g. on a client disconnect before the first chunk.
+        """
+
+        def close():
+            close_body = getattr(body_iterator, "close", None)
+            if close_body is not None:
+                close_body()
+            context.release()
+
+        return ClosingStream(self.track_stream(result, context, body_iterator, answer_cache_key), close)
+
+    async def track_stream(self, result: RAGResult, context: RequestContext, body_iterator, answer_cache_key=None):
+        """Encode the answer events as typed server-sent events, then fill in `result.answer` and `result.metrics`.
+
+        The client gets a `sources` event before the first `token` event and a `metrics` event at the end.
+        The answer is also stored in the answer cache once the stream completed, if a key is given.
+        The request context is released when the stream ends, fails or is closed on client disconnect,
+        `result` then holds the partial answer.
+        """
+        parts = []
+        try:
+            async with aclosing(body_iterator):
+                yield sse_event("sources", {"sources": context.sources})
+                async for chunk in body_iterator:
+                    if isinstance(chunk, tuple):
+                        event, data = chunk
+                    else:
+                        # plain text streams, e.g. the orchestrator's when the LLM was skipped
+                        event, data = "token", chunk.decode("utf-8") if isinstance(chunk, bytes) else chunk
+                    if event == "token" and data:
+                        parts.append(data)
+                        yield sse_event("token", {"text": data})
+                    elif event == "metrics":
+                        if not context.completed:
+                            # coalesced request, the generation was timed in the context of the leader
+                            context.metrics = data
+                        yield sse_event("metrics", {"metrics": context.metrics})
+            result.completed = True
+        finally:
+            context.release()
+            result.answer = "".join(parts).strip()
+            result.metrics = context.metrics
+        if answer_cache_key and result.answer:
+            self.answer_cache.store(*answer_cache_key, result.answer, result.sources)
 
     def start(self):
         self.service = MicroService(
@@ -653,45 +1039,43 @@ class ChatQnAService:
         )
 
         self.service.add_route(self.endpoint, self.handle_request, methods=["POST"])
+        self.service.add_shutdown_event(self.megaservice.close)
 
         self.service.start()
 
 class ConversationRAGService(ChatQnAService):
     def __init__(self, host="0.0.0.0", port=8000):
         super().__init__(host=host, port=port)
-        self.active_conversations = {}
+        # latest turns of recently active conversations, bounded, Mongo stays the source of truth
+        self.conversation_cache = ConversationCache.from_env()
+        # detached writes, referenced until done so they are not garbage collected midway
+        self.background_tasks = set()
         
-        try:
-            self.mongo_client = mongo_client
-        except Exception as e:
-            print(f"Error connecting to MongoDB: {str(e)}")
-            raise Exception("Failed to connect to MongoDB")
+        # the Mongo client is created by `connect_mongo` in the process serving the requests, which
+        # may be a worker forked from this one
+        self.mongo_client = None
+        self.conversation_store = ConversationStore(None)
     
     async def handle_new_conversation(self, request: Request):
         try:
             data = await request.json()
-            db = self.mongo_client[data["db_name"]]
-            conversations_collection = db["conversations"]
             conversation_id = str(uuid4())
-            self.active_conversations[conversation_id] = []
-            conversations_collection.insert_one({
-                "conversation_id": conversation_id,
-                "created_at": datetime.now(),
-                "last_updated": datetime.now(),
-                "history": []
-            })
+            await self.conversation_store.create_conversation(data["db_name"], conversation_id)
+            self.conversation_cache.set((data["db_name"], conversation_id), [])
             
-            return JSONResponse(content={"conversation_id": conversation_id})
+            return ResponseClass(content={"conversation_id": conversation_id})
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
-    def save_conversation_turn(self, conversation_id: str, question: str, conversations_collection, answer: str, sources: List[Dict], metrics: Dict = None):
+    async def save_conversation_turn(self, conversation_id: str, question: str, db_name: str, answer: str, sources: List[Dict], metrics: Dict = None, status: str = None):
         turn = {
             "question": question,
             "answer": answer,
             "sources": sources,
             "timestamp": datetime.now()
         }
+        if status:
+            turn["status"] = status
 
         if metrics:
             turn["metrics"] = {
@@ -700,25 +1084,57 @@ class ConversationRAGService(ChatQnAService):
                 "output_tokens": int(metrics.get("output_tokens", 0)),
                 "throughput": float(metrics.get("throughput", 0.0))
             }
+            if "prompt_tokens" in metrics:
+                turn["metrics"]["prompt_tokens"] = int(metrics["prompt_tokens"])
 
-        if conversation_id not in self.active_conversations:
-            self.active_conversations[conversation_id] = []
-        
-        self.active_conversations[conversation_id].append(turn)
+        # append-only, the write costs the size of this turn whatever the conversation length
+        turn["seq"] = await self.conversation_store.append_turn(db_name, conversation_id, turn)
+        self.conversation_cache.append((db_name, conversation_id), turn)
 
-        serialized_turn = self.serialize_datetime(turn)
-        
-        conversations_collection.update_one(
-            {"conversation_id": conversation_id},
-            {
-                "$set": {
-                    "last_updated": datetime.now().isoformat(),
-                    "history": self.serialize_datetime(self.active_conversations[conversation_id])
-                }
-            },
-            upsert=True
+    def save_cancelled_turn(self, conversation_id: str, question: str, db_name: str, partial_answer: Optional[str]):
+        """Record a turn abandoned by the client, with the answer streamed so far and no sources.
+
+        Runs detached, the request task is being cancelled when this is called.
+        """
+        task = asyncio.ensure_future(
+            self.save_conversation_turn(conversation_id, question, db_name, partial_answer or "", [], status="cancelled")
         )
-        print(f"DEBUG: Saved conversation turn with metrics: {turn.get('metrics', {})}")
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+
+    def cached_history(self, db_name: str, conversation: Dict, limit: Optional[int]):
+        """Return the latest `limit` turns (all when None) and the `before` cursor of the older ones
+        from the conversation cache, None when they are not all cached.
+
+        `conversation` is the stored metadata, its `turn_count` tells whether turns were appended by
+        another worker since the conversation was cached.
+        """
+        turns = self.conversation_cache.get((db_name, conversation["conversation_id"]))
+        turn_count = conversation.get("turn_count", 0)
+        if turns is None or (turns[-1]["seq"] if turns else -1) != turn_count - 1:
+            return None
+        if limit is None or limit >= len(turns):
+            # the whole conversation, unless older turns fell out of the cache
+            return (list(turns), None) if len(turns) >= turn_count else None
+        history = turns[-limit:]
+        return history, history[0]["seq"]
+
+    async def load_history(self, db_name: str, conversation: Dict, limit: Optional[int], before: Optional[int]):
+        """Return a page of turns and the `before` cursor of the next older one, from the cache if possible."""
+        conversation_id = conversation["conversation_id"]
+        if before is None:
+            page = self.cached_history(db_name, conversation, limit)
+            if page is not None:
+                return page
+            max_cached = self.conversation_cache.max_turns_per_conversation
+            if limit and limit <= max_cached:
+                # cache the latest turns, the next pages of this conversation are served from memory
+                turns, _ = await self.conversation_store.get_turns(db_name, conversation_id, limit=max_cached)
+                self.conversation_cache.set((db_name, conversation_id), turns)
+                page = self.cached_history(db_name, conversation, limit)
+                if page is not None:
+                    return page
+        return await self.conversation_store.get_turns(db_name, conversation_id, limit=limit, before=before)
 
     def prepare_source_info_list(self, sources_data: List[Dict]) -> List[SourceInfo]:
         source_info_list = []
@@ -737,281 +1153,96 @@ class ConversationRAGService(ChatQnAService):
             conversation_request = ConversationRequest.parse_obj(data)
 
             include_metrics = conversation_request.include_metrics
-            print("Include metrics:", include_metrics)
-
-            e2e_start_time = time.perf_counter()
-            ttft_start_time = e2e_start_time
 
-            request_id = str(uuid4())
             stream = data.get("stream", False)
 
-            db = self.mongo_client[conversation_request.db_name]
-            conversations_collection = db["conversations"]
+            db_name = conversation_request.db_name
 
             if not conversation_request.conversation_id and "conversation_id" in request.path_params:
                 conversation_request.conversation_id = request.path_params["conversation_id"]
 
-            if conversation_request.conversation_id not in self.active_conversations:
-                stored_conversation = conversations_collection.find_one(
-                    {"conversation_id": conversation_request.conversation_id}
-                )
-                if stored_conversation:
-                    self.active_conversations[conversation_request.conversation_id] = stored_conversation["history"]
-                else:
-                    self.active_conversations[conversation_request.conversation_id] = []
-
-            chat_data = {
-                "messages": [{"role": "user", "content": conversation_request.question}],
-                "max_tokens": conversation_request.max_tokens,
-                "temperature": conversation_request.temperature,
-                "stream": stream,
-                "k": conversation_request.top_k or 5,
-                "top_n": conversation_request.top_k or 5,
-                "collection_name": conversation_request.collection_name,
-                "include_metrics": include_metrics
-            }
+            chat_request = ChatCompletionRequest(
+                messages=[{"role": "user", "content": conversation_request.question}],
+                max_tokens=conversation_request.max_tokens,
+                temperature=conversation_request.temperature,
+                stream=stream,
+                k=conversation_request.top_k or 5,
+                top_n=conversation_request.top_k or 5,
+            )
+            result = await self.generate_for_client(
+                request, chat_request, conversation_request.collection_name, db_name
+            )
 
-            new_request = Request(scope=request.scope)
-            async def receive():
-                return {"type": "http.request", "body": json.dumps(chat_data).encode()}
-            new_request._receive = receive
+            if result is None:
+                self.save_cancelled_turn(conversation_request.conversation_id, conversation_request.question, db_name, "")
+                return Response(status_code=CLIENT_CLOSED_REQUEST)
 
-            rag_response = await super().handle_request(new_request)
-            
-            if isinstance(rag_response, StreamingResponse):
-                if stream:
-                    original_body_iterator = rag_response.body_iterator
-                    
-                    async def capture_and_forward():
-                        full_response = ""
-                        metrics_data = None
-                        
-                        try:
-                            async for chunk in original_body_iterator:
+            if result.stream is not None:
+                async def capture_and_forward():
+                    try:
+                        async with aclosing(result.stream):
+                            async for chunk in result.stream:
                                 yield chunk
-                                chunk_str = chunk.decode('utf-8') if isinstance(chunk, bytes) else chunk
-                                
-                                metrics_match = re.search(r"__METRICS__(.*?)__METRICS__", chunk_str)
-                                if metrics_match:
-                                    try:
-                                        metrics_json = json.loads(metrics_match.group(1))
-                                        metrics_data = metrics_json.get("metrics", {})
-                                        chunk_str = chunk_str.replace(metrics_match.group(0), "")
-                                    except Exception as e:
-                                        print(f"Failed to parse metrics: {e}")
-                                        metrics_data = {
-                                            "ttft": 0.0,
-                                            "e2e_latency": 0.0,
-                                            "output_tokens": 0,
-                                            "throughput": 0.0
-                                        }
-                                
-                                full_response += chunk_str
-                        except Exception as e:
-                            print(f"Error during streaming: {e}")
-                            error_message = f"Streaming error occurred: {str(e)}"
-                            yield error_message.encode('utf-8') if isinstance(chunk, bytes) else error_message
-                        
-                        sources = []
-                        metrics_registry_data = self.megaservice.__class__._metrics_registry.get(request_id, {})
-                        
-                        if hasattr(self, 'last_result_dict') and self.last_result_dict:
-                            for node_name, node_data in self.last_result_dict.items():
-                                if isinstance(node_data, dict) and "selected_sources" in node_data:
-                                    sources = node_data["selected_sources"]
-                                    print(f"DEBUG: Found {len(sources)} sources in node {node_name}")
-                                    break
-                        
-                        if not sources and hasattr(self, 'last_sources') and self.last_sources:
-                            sources = self.last_sources
-                            print(f"DEBUG: Using {len(sources)} pre-extracted sources")
-                        
-                        full_response = re.sub(r"__METRICS__.*?__METRICS__", "", full_response)
-                        full_response = full_response.strip()
-                        
-                        full_response = full_response.replace('\r\n', '\n').replace('\n{3,}', '\n\n')
-                                                
-                        if not metrics_data and metrics_registry_data and metrics_registry_data.get("completed", False):
-                            metrics_data = {
-                                "ttft": float(metrics_registry_data.get("ttft", 0.0)),
-                                "e2e_latency": float(metrics_registry_data.get("e2e_latency", 0.0)),
-                                "output_tokens": int(metrics_registry_data.get("output_tokens", 0)),
-                                "throughput": float(metrics_registry_data.get("throughput", 0.0))
-                            }
-                        elif not metrics_data:
-                            metrics_data = {
-                                "ttft": 0.0,
-                                "e2e_latency": 0.0,
-                                "output_tokens": 0,
-                                "throughput": 0.0
-                            }
-                        
-                        print(f"DEBUG: Saving streamed content to MongoDB: {len(full_response)} chars, {len(sources)} sources")
-                        if include_metrics:
-                            self.save_conversation_turn(
-                                conversation_request.conversation_id,
-                                conversation_request.question,
-                                conversations_collection,
-                                full_response,
-                                sources,
-                                metrics_data
-                            )
-                        else:
-                            self.save_conversation_turn(
-                                conversation_request.conversation_id,
-                                conversation_request.question,
-                                conversations_collection,
-                                full_response,
-                                sources,
-                                None
-                            )
-                        
-                        if request_id in self.megaservice.__class__._metrics_registry:
-                            del self.megaservice.__class__._metrics_registry[request_id]
-                                                
-                    new_streaming_response = StreamingResponse(
-                        capture_and_forward(),
-                        status_code=rag_response.status_code,
-                        headers=dict(rag_response.headers),
-                        media_type=rag_response.media_type
-                    )
-                    
-                    return new_streaming_response
-                else:
-                    answer_text = data.get("answer", "")
-                    metrics_data = {
+                    except Exception as e:
+                        print(f"Error during streaming: {e}")
+                        yield sse_event("error", {"message": f"Streaming error occurred: {str(e)}"})
+                    except (GeneratorExit, asyncio.CancelledError):
+                        # client gone, nothing more can be sent nor awaited here
+                        self.save_cancelled_turn(
+                            conversation_request.conversation_id, conversation_request.question, db_name, result.answer
+                        )
+                        raise
+
+                    answer = (result.answer or "").replace('\r\n', '\n')
+                    metrics_data = result.metrics or {
                         "ttft": 0.0,
                         "e2e_latency": 0.0,
                         "output_tokens": 0,
                         "throughput": 0.0
                     }
-                    
-                    metrics_registry_data = self.megaservice.__class__._metrics_registry.get(request_id, {})
-
-                    if include_metrics:
-                        if metrics_registry_data and metrics_registry_data.get("completed", False):
-                            metrics_data = {
-                                "ttft": float(metrics_registry_data.get("ttft", 0.0)),
-                                "e2e_latency": float(metrics_registry_data.get("e2e_latency", 0.0)),
-                                "output_tokens": int(metrics_registry_data.get("output_tokens", 0)),
-                                "throughput": float(metrics_registry_data.get("throughput", 0.0))
-                            }
-                    
-                    answer_text = answer_text.replace('\r\n', '\n').replace('\n{3,}', '\n\n')
-                    
-                    if include_metrics:
-                        self.save_conversation_turn(
-                            conversation_request.conversation_id,
-                            conversation_request.question,
-                            conversations_collection,
-                            answer_text,
-                            data.get("sources", []),
-                            metrics_data
-                        )
-                    else:
-                        self.save_conversation_turn(
-                            conversation_request.conversation_id,
-                            conversation_request.question,
-                            conversations_collection,
-                            answer_text,
-                            data.get("sources", []),
-                            None
-                        )
-                    
-                    processed_sources = data.get("sources", [])
-                    source_info_list = self.prepare_source_info_list(processed_sources)
-                    
-                    if include_metrics and metrics_data:
-                        return ConversationResponse(
-                            conversation_id=conversation_request.conversation_id,
-                            answer=answer_text,
-                            sources=source_info_list,
-                            metrics=metrics_data
-                        ).dict(exclude_none=True)
-                    else:
-                        return ConversationResponse(
-                            conversation_id=conversation_request.conversation_id,
-                            answer=answer_text,
-                            sources=source_info_list
-                        ).dict(exclude_none=True)
-                
-                return rag_response
-
-            if isinstance(rag_response, JSONResponse):
-                response_data = json.loads(rag_response.body.decode())
-                answer = response_data["choices"][0]["message"]["content"]
-                sources = response_data.get("sources", [])
-                metrics_data = None
-
-                if include_metrics:
-                    metrics_data = response_data.get("metrics")
-                    if not metrics_data:
-                        metrics_registry_data = self.megaservice.__class__._metrics_registry.get(request_id, {})
-                        if metrics_registry_data and metrics_registry_data.get("completed", False):
-                            metrics_data = {
-                                "ttft": float(metrics_registry_data.get("ttft", 0.0)),
-                                "e2e_latency": float(metrics_registry_data.get("e2e_latency", 0.0)),
-                                "output_tokens": int(metrics_registry_data.get("output_tokens", 0)),
-                                "throughput": float(metrics_registry_data.get("throughput", 0.0))
-                            }
-                        else:
-                            metrics_data = {
-                                "ttft": 0.0,
-                                "e2e_latency": 0.0,
-                                "output_tokens": 0,
-                                "throughput": 0.0
-                            }
-
-                processed_sources = []
-                for source in sources:
-                    if isinstance(source, dict):
-                        processed_source = {
-                            "source": source.get("file_name", source.get("source", "unknown")),
-                            "content": source.get("content", source.get("text", "")),
-                            "relevance_score": float(source.get("relevance_score", 0.0))
-                        }
-                        processed_sources.append(processed_source)
-
-                if include_metrics and metrics_data:
-                    self.save_conversation_turn(
+                    await self.save_conversation_turn(
                         conversation_request.conversation_id,
                         conversation_request.question,
-                        conversations_collection,
+                        db_name,
                         answer,
-                        processed_sources,
-                        metrics_data
+                        result.sources,
+                        metrics_data if include_metrics else None
                     )
-                else:
-                    self.save_conversation_turn(
-                        conversation_request.conversation_id,
-                        conversation_request.question,
-                        conversations_collection,
-                        answer,
-                        processed_sources,
-                        None
-                    )
-
-                if request_id in self.megaservice.__class__._metrics_registry:
-                    del self.megaservice.__class__._metrics_registry[request_id]
 
-                source_info_list = self.prepare_source_info_list(processed_sources)
+                # the answer stream is released even if the client leaves before capture_and_forward started
+                return CancellableStreamingResponse(
+                    ClosingStream(capture_and_forward(), result.stream.close), media_type="text/event-stream"
+                )
 
-                if include_metrics and metrics_data:
-                    return ConversationResponse(
-                        conversation_id=conversation_request.conversation_id,
-                        answer=answer,
-                        sources=source_info_list,
-                        metrics=metrics_data
-                    ).dict(exclude_none=True)
-                else:
-                    return ConversationResponse(
-                        conversation_id=conversation_request.conversation_id,
-                        answer=answer,
-                        sources=source_info_list
-                    ).dict(exclude_none=True)
+            processed_sources = []
+            for source in result.sources:
+                if isinstance(source, dict):
+                    processed_source = {
+                        "source": source.get("file_name", source.get("source", "unknown")),
+                        "content": source.get("content", source.get("text", "")),
+                        "relevance_score": float(source.get("relevance_score", 0.0))
+                    }
+                    processed_sources.append(processed_source)
+
+            metrics_data = result.metrics if include_metrics else None
+            await self.save_conversation_turn(
+                conversation_request.conversation_id,
+                conversation_request.question,
+                db_name,
+                result.answer,
+                processed_sources,
+                metrics_data
+            )
 
-            return rag_response
+            return ConversationResponse(
+                conversation_id=conversation_request.conversation_id,
+                answer=result.answer,
+                sources=self.prepare_source_info_list(processed_sources),
+                metrics=metrics_data
+            ).dict(exclude_none=True)
 
+        except (AdmissionRejected, CircuitOpenError, DeadlineExceeded) as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers)
         except Exception as e:
             print(f"Error processing request: {str(e)}")
             import traceback
@@ -1025,30 +1256,22 @@ class ConversationRAGService(ChatQnAService):
         try:
             query_params = dict(request.query_params)
             db_name = query_params.get("db_name")
-            db = self.mongo_client[db_name]
-            conversations_collection = db["conversations"]
             conversation_id = request.path_params["conversation_id"]
-            
-            if conversation_id in self.active_conversations:
-                stored_conversation = conversations_collection.find_one(
-                    {"conversation_id": conversation_id}
-                )
-                if stored_conversation:
-                    stored_conversation.pop('_id', None)
-                    serialized_data = self.serialize_datetime(stored_conversation)
-                    return JSONResponse(content=serialized_data)
-            
-            stored_conversation = conversations_collection.find_one(
-                {"conversation_id": conversation_id}
-            )
-            
-            if stored_conversation:
-                stored_conversation.pop('_id', None)
-                serialized_data = self.serialize_datetime(stored_conversation)
-                return JSONResponse(content=serialized_data)
-                
-            raise HTTPException(status_code=404, detail="Conversation not found")
-            
+            # without `limit` the whole history is returned, `before` pages towards older turns
+            limit = query_int(query_params, "limit", minimum=1)
+            if limit is not None:
+                limit = min(limit, HISTORY_MAX_LIMIT)
+            before = query_int(query_params, "before")
+
+            stored_conversation = await self.conversation_store.get_conversation(db_name, conversation_id)
+            if not stored_conversation:
+                raise HTTPException(status_code=404, detail="Conversation not found")
+
+            history, next_before = await self.load_history(db_name, stored_conversation, limit, before)
+            stored_conversation["history"] = history
+            stored_conversation["next_before"] = next_before
+            return ResponseClass(content=self.serialize_datetime(stored_conversation))
+
         except HTTPException:
             raise
         except Exception as e:
@@ -1063,19 +1286,14 @@ class ConversationRAGService(ChatQnAService):
             if not db_name:
                 raise HTTPException(status_code=400, detail="Missing required query parameter 'db_name'")
             
-            db = self.mongo_client[db_name]
-            conversations_collection = db["conversations"]
+            self.conversation_cache.pop((db_name, conversation_id))
             
-            self.active_conversations.pop(conversation_id, None)
+            deleted = await self.conversation_store.delete_conversation(db_name, conversation_id)
             
-            result = conversations_collection.delete_one(
-                {"conversation_id": conversation_id}
-            )
-            
-            if result.deleted_count == 0:
+            if not deleted:
                 raise HTTPException(status_code=404, detail="Conversation not found")
                 
-            return JSONResponse(content={"message": "Conversation deleted successfully"})
+            return ResponseClass(content={"message": "Conversation deleted successfully"})
             
         except HTTPException:
             raise
@@ -1086,29 +1304,36 @@ class ConversationRAGService(ChatQnAService):
         try:
             query_params = dict(request.query_params)
             db_name = query_params.get("db_name")
-            db = self.mongo_client[db_name]
-            conversations_collection = db["conversations"]
-            
             limit = int(query_params.get("limit", 10))
+
+            if query_params.get("view") == "summary" or "cursor" in query_params:
+                # summary fields only, keyset paginated with the opaque `next_cursor`
+                conversations, next_cursor = await self.conversation_store.list_conversation_summaries(
+                    db_name, limit=limit, cursor=query_params.get("cursor") or None
+                )
+                return ResponseClass(content={
+                    "total": await self.conversation_store.count_conversations(db_name),
+                    "limit": limit,
+                    "next_cursor": next_cursor,
+                    "conversations": self.serialize_datetime(conversations)
+                })
+
             skip = int(query_params.get("skip", 0))
             
-            conversations = list(conversations_collection
-                                .find({}, {'_id': 0})
-                                .sort('last_updated', -1)
-                                .skip(skip)
-                                .limit(limit))
-            
-            total = conversations_collection.count_documents({})
+            conversations = await self.conversation_store.list_conversations(db_name, skip=skip, limit=limit)
+            total = await self.conversation_store.count_conversations(db_name)
             
             serialized_conversations = self.serialize_datetime(conversations)
             
-            return JSONResponse(content={
+            return ResponseClass(content={
                 "total": total,
                 "skip": skip,
                 "limit": limit,
                 "conversations": serialized_conversations
             })
             
+        except InvalidCursor as e:
+            raise HTTPException(status_code=400, detail=str(e))
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
@@ -1121,6 +1346,12 @@ class ConversationRAGService(ChatQnAService):
             return obj.isoformat()
         return obj
 
+    async def connect_mongo(self):
+        # startup hook, runs in every worker before it accepts connections
+        self.mongo_client = create_mongo_client()
+        self.conversation_store.client = self.mongo_client
+        await check_connection(self.mongo_client)
+
     def start(self):
         self.service = MicroService(
             self.__class__.__name__,
@@ -1137,6 +1368,8 @@ class ConversationRAGService(ChatQnAService):
         self.service.add_route("/api/conversations/{conversation_id}", self.handle_get_history, methods=["GET"])
         self.service.add_route("/api/conversations/{conversation_id}", self.handle_delete_conversation, methods=["DELETE"])
         self.service.add_route("/api/conversations", self.handle_list_conversations, methods=["GET"])
+        self.service.add_startup_event(self.connect_mongo())
+        self.service.add_shutdown_event(self.megaservice.close)
         self.service.start()
 
 if __name__ == "__main__":
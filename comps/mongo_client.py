@@ -1,6 +1,7 @@
-import pymongo
 import os
 from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.read_preferences import read_pref_mode_from_name
 
 
 load_dotenv()
@@ -10,18 +11,50 @@ MONGO_PASSWORD = os.getenv("MONGO_PASSWORD")
 MONGO_HOST = os.getenv("MONGO_HOST", "localhost")
 MONGO_PORT = os.getenv("MONGO_PORT", "27017")
 
+# connection pool shared by all requests of the process
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 100))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", 60000))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", 5000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 5000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 20000))
+# primary, primaryPreferred, secondary, secondaryPreferred or nearest
+MONGO_READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE", "primary")
+
 if MONGO_USERNAME and MONGO_PASSWORD:
     MONGO_URI = f"mongodb://{MONGO_USERNAME}:{MONGO_PASSWORD}@{MONGO_HOST}:{MONGO_PORT}"
 else:
     MONGO_URI = f"mongodb://{MONGO_HOST}:{MONGO_PORT}"
 
-try:
-    mongo_client = pymongo.MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
-    mongo_client.server_info()
-    print("Successfully connected to MongoDB")
+# validate early, pymongo only raises on the first operation otherwise
+read_pref_mode_from_name(MONGO_READ_PREFERENCE)
+
+
+def create_mongo_client() -> AsyncIOMotorClient:
+    """Create the Motor client of the current process.
+
+    pymongo clients are not fork-safe, their connection pool and monitor threads are not carried over
+    to a forked child: with pre-forked workers, every worker creates its own client from a startup hook.
+    """
+    # motor connects lazily on the first operation, inside the event loop serving the requests
+    return AsyncIOMotorClient(
+        MONGO_URI,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+        readPreference=MONGO_READ_PREFERENCE,
+    )
+
 
-except Exception as e:
-    print(f"Error connecting to MongoDB: {str(e)}")
-    mongo_client = None
-    db = None
-    conversations_collection = None
+async def check_connection(mongo_client: AsyncIOMotorClient):
+    """Ping the server once, called on service startup to report connectivity early."""
+    try:
+        await mongo_client.admin.command("ping")
+        print("Successfully connected to MongoDB")
+    except Exception as e:
+        print(f"Error connecting to MongoDB: {str(e)}")
@@ -66,6 +66,13 @@ QDRANT_PORT = int(os.getenv("QDRANT_PORT", 6333))
 QDRANT_EMBED_DIMENSION = os.getenv("QDRANT_EMBED_DIMENSION", 384) #switch to 384 for all-MiniLM-L6-v2
 QDRANT_INDEX_NAME = os.getenv("QDRANT_INDEX_NAME", "rag-qdrant")
 
+# Retrieval result cache, invalidated through the collection generations bumped by dataprep
+RETRIEVAL_CACHE_ENABLED = get_boolean_env_var("RETRIEVAL_CACHE_ENABLED", False)
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", 10000))
+RETRIEVAL_CACHE_MAX_MB = float(os.getenv("RETRIEVAL_CACHE_MAX_MB", 128))
+RETRIEVAL_CACHE_TTL = float(os.getenv("RETRIEVAL_CACHE_TTL", 3600))
+COLLECTION_GENERATION_REDIS_URL = os.getenv("COLLECTION_GENERATION_REDIS_URL", "")
+
 
 # Summarizer Configuration
 SUMMARIZER_ENABLED = os.getenv("SUMMARIZER_ENABLED", "false").lower() == "true"
@@ -2,15 +2,30 @@
 # SPDX-License-Identifier: Apache-2.0
 
 
+import asyncio
+import copy
+import hashlib
 import os
+from array import array
 from types import SimpleNamespace
 
 from haystack_integrations.components.retrievers.qdrant import QdrantEmbeddingRetriever
 from haystack_integrations.document_stores.qdrant import QdrantDocumentStore
 
-from comps import CustomLogger, EmbedDoc, OpeaComponent, OpeaComponentRegistry, ServiceType
-
-from .config import QDRANT_EMBED_DIMENSION, QDRANT_HOST, QDRANT_INDEX_NAME, QDRANT_PORT
+from comps import CustomLogger, EmbedDoc, LRUTTLCache, OpeaComponent, OpeaComponentRegistry, ServiceType
+from comps.cores.common.cache import CollectionGenerations
+
+from .config import (
+    COLLECTION_GENERATION_REDIS_URL,
+    QDRANT_EMBED_DIMENSION,
+    QDRANT_HOST,
+    QDRANT_INDEX_NAME,
+    QDRANT_PORT,
+    RETRIEVAL_CACHE_ENABLED,
+    RETRIEVAL_CACHE_MAX_ENTRIES,
+    RETRIEVAL_CACHE_MAX_MB,
+    RETRIEVAL_CACHE_TTL,
+)
 
 logger = CustomLogger("qdrant_retrievers")
 logflag = os.getenv("LOGFLAG", False)
@@ -23,6 +38,21 @@ class OpeaQDrantRetriever(OpeaComponent):
     def __init__(self, name: str, description: str, config: dict = None):
         super().__init__(name, ServiceType.RETRIEVER.name.lower(), description, config)
 
+        self.cache = None
+        if RETRIEVAL_CACHE_ENABLED:
+            if not COLLECTION_GENERATION_REDIS_URL:
+                logger.warning(
+                    "Retrieval cache enabled without COLLECTION_GENERATION_REDIS_URL, "
+                    "ingestion by a separate dataprep service will not invalidate it."
+                )
+            self.cache = LRUTTLCache(
+                "retrieval",
+                max_entries=RETRIEVAL_CACHE_MAX_ENTRIES,
+                max_bytes=int(RETRIEVAL_CACHE_MAX_MB * 1024 * 1024),
+                ttl=RETRIEVAL_CACHE_TTL,
+            )
+            self.generations = CollectionGenerations(redis_url=COLLECTION_GENERATION_REDIS_URL or None)
+
         health_status = self.check_health()
         if not health_status:
             logger.error("OpeaQDrantRetriever health check failed.")
@@ -59,6 +89,25 @@ class OpeaQDrantRetriever(OpeaComponent):
             logger.info(f"[ check health ] Failed to connect to QDrant: {e}")
             return False
 
+    def _cache_key(self, input: EmbedDoc, collection_name: str, generation: int) -> str:
+        """Key a search on its collection generation, the embedding fingerprint and the search params."""
+        fingerprint = hashlib.sha1(array("f", input.embedding).tobytes()).hexdigest()
+        params = (
+            input.search_type,
+            input.k,
+            input.distance_threshold,
+            input.fetch_k,
+            input.lambda_mult,
+            input.score_threshold,
+            repr(input.constraints),
+        )
+        return f"{collection_name}:{generation}:{fingerprint}:{params}"
+
+    def _search(self, collection_name: str, embedding: list) -> list:
+        """Run a blocking similarity search against the given collection."""
+        _, retriever = self._initialize_client(collection_name)
+        return retriever.run(query_embedding=embedding)["documents"]
+
     async def invoke(self, input: EmbedDoc) -> list:
         """Search the QDrant index for the most similar documents to the input query.
 
@@ -71,8 +120,21 @@ class OpeaQDrantRetriever(OpeaComponent):
             logger.info(f"[ similarity search ] input: {input}")
 
         collection_name = input.collection_name or QDRANT_INDEX_NAME
-        db_store, retriever = self._initialize_client(collection_name)
-        search_res = retriever.run(query_embedding=input.embedding)["documents"]
+
+        cache_key = None
+        if self.cache is not None and input.embedding and isinstance(input.embedding[0], float):
+            generation = await self.generations.get(collection_name)
+            if generation is not None:
+                cache_key = self._cache_key(input, collection_name, generation)
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    if logflag:
+                        logger.info(f"[ similarity search ] cache hit for collection {collection_name}")
+                    # callers may modify the results, hand out copies of the cached metadata
+                    return [SimpleNamespace(**copy.deepcopy(meta)) for meta in cached]
+
+        # the haystack client is blocking, keep it off the event loop so the request deadline can cancel the wait
+        search_res = await asyncio.to_thread(self._search, collection_name, input.embedding)
 
         # format result to align with the standard output in opea_retrievers_microservice.py
         final_res = []
@@ -81,6 +143,9 @@ class OpeaQDrantRetriever(OpeaComponent):
             res_obj = SimpleNamespace(**dict_res)
             final_res.append(res_obj)
 
+        if cache_key is not None:
+            self.cache.set(cache_key, [copy.deepcopy(res.meta) for res in search_res])
+
         if logflag:
             logger.info(f"[ similarity search ] search result: {final_res}")
 
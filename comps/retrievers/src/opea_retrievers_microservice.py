@@ -23,6 +23,7 @@ from comps import (
     register_microservice,
     register_statistics,
     statistics_dict,
+    within_deadline,
 )
 from comps.cores.proto.api_protocol import (
     ChatCompletionRequest,
@@ -60,8 +61,8 @@ async def retrieve_docs(
         logger.info(f"[ retrieval ] input:{input}")
 
     try:
-        # Use the loader to invoke the component
-        response = await loader.invoke(input)
+        # Use the loader to invoke the component, given up when the request deadline passes
+        response = await within_deadline(loader.invoke(input), stage="retrieval")
 
         # return different response format
         retrieved_docs = []
@@ -35,6 +35,7 @@ import ImageIcon from '@mui/icons-material/Image';
 import TextSnippetIcon from '@mui/icons-material/TextSnippet';
 import CloseIcon from '@mui/icons-material/Close';
 import { CHAT_QNA_URL } from '@/lib/constants';
+import { SSEParser } from '@/lib/sse';
 import AudioRecorder from './AudioRecorder';
 
 interface Metrics {
@@ -431,6 +432,7 @@ export default function ChatArea({
 
         const reader = response.body.getReader();
         const decoder = new TextDecoder();
+        const parser = new SSEParser();
 
         while (true) {
           const { done, value } = await reader.read();
@@ -438,31 +440,33 @@ export default function ChatArea({
           if (done) {
             break;
           }
-          const chunk = decoder.decode(value, { stream: true });
 
-          const metricsMatch = chunk.match(/__METRICS__(.*?)__METRICS__/);
-          if (metricsMatch) {
-            try {
-              const metricsData = JSON.parse(metricsMatch[1]);
-              responseMetrics = metricsData.metrics;
+          for (const { event, data } of parser.push(decoder.decode(value, { stream: true }))) {
+            if (event === 'sources') {
+              // retrieval is done before generation starts, sources arrive ahead of the first token
+              sourcesFromResponse = data.sources || [];
               setMessages(prev =>
                 prev.map(msg =>
                   msg.id === streamingMessageId
-                    ? { 
-                        ...msg, 
-                        metrics: responseMetrics,
-                      }
+                    ? { ...msg, sources: sourcesFromResponse }
                     : msg
                 )
               );
-              
-              fullResponseText += chunk.replace(/__METRICS__(.*?)__METRICS__/, '');
-            } catch (e) {
-              console.error('Failed to parse metrics:', e);
-              fullResponseText += chunk;
+            } else if (event === 'metrics') {
+              responseMetrics = data.metrics;
+              setMessages(prev =>
+                prev.map(msg =>
+                  msg.id === streamingMessageId
+                    ? { ...msg, metrics: responseMetrics }
+                    : msg
+                )
+              );
+            } else if (event === 'error') {
+              console.error('Streaming error:', data.message);
+              fullResponseText += data.message;
+            } else if (event === 'token') {
+              fullResponseText += data.text;
             }
-          } else {
-            fullResponseText += chunk;
           }
 
           const formattedText = fullResponseText
@@ -505,31 +509,6 @@ export default function ChatArea({
           )
         );
 
-        axios.get(`${CHAT_QNA_URL}/api/conversations/${targetConversationId}?db_name=rag_db`)
-          .then(response => {
-            if (response.data && response.data.history && response.data.history.length > 0) {
-              const latestTurn = response.data.history.filter((turn: { question: string; sources?: any[] }) => 
-                turn.question === messageContent
-              ).pop();
-              
-              if (latestTurn && latestTurn.sources) {
-                setMessages(prev =>
-                  prev.map(msg =>
-                    msg.id === streamingMessageId
-                      ? {
-                          ...msg,
-                          sources: latestTurn.sources
-                        }
-                      : msg
-                  )
-                );
-              }
-            }
-          })
-          .catch(error => {
-            console.error("Error fetching conversation with sources:", error);
-          });
-
         // Clear uploaded files after successful send
         setUploadedFiles([]);
         setIsLoading(false);
@@ -39,6 +39,7 @@ import {
 } from "@mui/material"
 import FileUploadIcon from "@mui/icons-material/FileUpload"
 import { CHAT_QNA_URL } from "@/lib/constants"
+import { SSEParser } from "@/lib/sse"
 import DeleteIcon from "@mui/icons-material/Delete"
 import DownloadIcon from "@mui/icons-material/Download"
 
@@ -392,7 +393,7 @@ export default function ChatArea({
 
         let fullResponseText = ""
         let responseMetrics: Metrics | null = null
-        const sourcesFromResponse: Array<{ source: string; relevance_score: number; content: string }> = []
+        let sourcesFromResponse: Array<{ source: string; relevance_score: number; content: string }> = []
 
         // Upload files if any
         let fileUrls: string[] = []
@@ -454,6 +455,7 @@ export default function ChatArea({
 
         const reader = response.body.getReader()
         const decoder = new TextDecoder()
+        const parser = new SSEParser()
 
         while (true) {
           const { done, value } = await reader.read()
@@ -461,31 +463,25 @@ export default function ChatArea({
           if (done) {
             break
           }
-          const chunk = decoder.decode(value, { stream: true })
 
-          const metricsMatch = chunk.match(/__METRICS__(.*?)__METRICS__/)
-          if (metricsMatch) {
-            try {
-              const metricsData = JSON.parse(metricsMatch[1])
-              responseMetrics = metricsData.metrics
+          for (const { event, data } of parser.push(decoder.decode(value, { stream: true }))) {
+            if (event === "sources") {
+              // retrieval is done before generation starts, sources arrive ahead of the first token
+              sourcesFromResponse = data.sources || []
               setMessages((prev) =>
-                prev.map((msg) =>
-                  msg.id === streamingMessageId
-                    ? {
-                        ...msg,
-                        metrics: responseMetrics,
-                      }
-                    : msg,
-                ),
+                prev.map((msg) => (msg.id === streamingMessageId ? { ...msg, sources: sourcesFromResponse } : msg)),
               )
-
-              fullResponseText += chunk.replace(/__METRICS__(.*?)__METRICS__/, "")
-            } catch (e) {
-              console.error("Failed to parse metrics:", e)
-              fullResponseText += chunk
+            } else if (event === "metrics") {
+              responseMetrics = data.metrics
+              setMessages((prev) =>
+                prev.map((msg) => (msg.id === streamingMessageId ? { ...msg, metrics: responseMetrics } : msg)),
+              )
+            } else if (event === "error") {
+              console.error("Streaming error:", data.message)
+              fullResponseText += data.message
+            } else if (event === "token") {
+              fullResponseText += data.text
             }
-          } else {
-            fullResponseText += chunk
           }
 
           const formattedText = fullResponseText.replace(/\r\n/g, "\n").replace(/\n{3,}/g, "\n\n")
@@ -522,32 +518,6 @@ export default function ChatArea({
           ),
         )
 
-        axios
-          .get(`${CHAT_QNA_URL}/api/conversations/${targetConversationId}?db_name=rag_db`)
-          .then((response) => {
-            if (response.data && response.data.history && response.data.history.length > 0) {
-              const latestTurn = response.data.history
-                .filter((turn: { question: string; sources?: any[] }) => turn.question === messageContent)
-                .pop()
-
-              if (latestTurn && latestTurn.sources) {
-                setMessages((prev) =>
-                  prev.map((msg) =>
-                    msg.id === streamingMessageId
-                      ? {
-                          ...msg,
-                          sources: latestTurn.sources,
-                        }
-                      : msg,
-                  ),
-                )
-              }
-            }
-          })
-          .catch((error) => {
-            console.error("Error fetching conversation with sources:", error)
-          })
-
         // Clear uploaded files after successful send
         setUploadedFiles([])
         setIsLoading(false)
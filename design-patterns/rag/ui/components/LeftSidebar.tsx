@@ -29,7 +29,10 @@ interface Conversation {
   created_at: string;
   last_updated: string;
   context?: string;
-  history: Array<{
+  title?: string;
+  last_question?: string;
+  turn_count?: number;
+  history?: Array<{
     question: { content: string; timestamp: string };
     answer: { content: string; timestamp: string };
   }> | Array<any>;
@@ -57,6 +60,8 @@ export default function LeftSidebar({
   const [conversationToDelete, setConversationToDelete] = useState<string | null>(null);
   const [deletePreview, setDeletePreview] = useState<string>('');
   const [isDeleting, setIsDeleting] = useState(false);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
 
   useEffect(() => {
     fetchConversations();
@@ -65,10 +70,11 @@ export default function LeftSidebar({
   const fetchConversations = async () => {
     try {
       setIsLoading(true);
-      const response = await axios.get(`${CHAT_QNA_URL}/api/conversations?db_name=rag_db`);
+      const response = await axios.get(`${CHAT_QNA_URL}/api/conversations?db_name=rag_db&view=summary`);
       const data = await response.data;
       console.log('Fetched conversations:', data);
       setConversations(data.conversations || []);
+      setNextCursor(data.next_cursor || null);
     } catch (err) {
       setError(err instanceof Error ? err.message : 'Failed to load conversations');
       console.error('Error fetching conversations:', err);
@@ -78,6 +84,23 @@ export default function LeftSidebar({
     }
   };
 
+  const loadMoreConversations = async () => {
+    if (!nextCursor || isLoadingMore) return;
+    try {
+      setIsLoadingMore(true);
+      const response = await axios.get(
+        `${CHAT_QNA_URL}/api/conversations?db_name=rag_db&view=summary&cursor=${encodeURIComponent(nextCursor)}`
+      );
+      const data = await response.data;
+      setConversations(prevConversations => [...prevConversations, ...(data.conversations || [])]);
+      setNextCursor(data.next_cursor || null);
+    } catch (err) {
+      console.error('Error loading more conversations:', err);
+    } finally {
+      setIsLoadingMore(false);
+    }
+  };
+
   const openDeleteDialog = (id: string, e: React.MouseEvent) => {
     e.stopPropagation();
     const conversation = conversations.find(conv => conv.conversation_id === id);
@@ -115,6 +138,12 @@ export default function LeftSidebar({
   };
 
   const getConversationPreview = (conversation: Conversation) => {
+    if (conversation.last_question || conversation.title) {
+      return {
+        context: conversation.context || 'General',
+        question: conversation.last_question || conversation.title || 'Empty conversation'
+      };
+    }
     if (!conversation.history || !Array.isArray(conversation.history) || conversation.history.length === 0) {
       return { context: 'General', question: 'Empty conversation' };
     }
@@ -394,6 +423,18 @@ export default function LeftSidebar({
                   </ListItemButton>
                 );
               })}
+              {nextCursor && (
+                <Box sx={{ display: 'flex', justifyContent: 'center', py: 1 }}>
+                  <Button
+                    size="small"
+                    onClick={loadMoreConversations}
+                    disabled={isLoadingMore}
+                    sx={{ color: '#6b7280', textTransform: 'none' }}
+                  >
+                    {isLoadingMore ? <CircularProgress size={16} /> : 'Load more'}
+                  </Button>
+                </Box>
+              )}
             </List>
           )}
         </Box>
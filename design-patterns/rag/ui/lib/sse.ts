@@ -0,0 +1,47 @@
+export interface StreamEvent {
+  event: string;
+  data: any;
+}
+
+// Incremental parser for the typed server-sent events of the chat endpoints
+// (`sources`, `token`, `metrics` and `error`), fed with the decoded chunks of a fetch stream.
+export class SSEParser {
+  private buffer = '';
+
+  push(chunk: string): StreamEvent[] {
+    this.buffer += chunk.replace(/\r\n/g, '\n');
+    const events: StreamEvent[] = [];
+    let boundary = this.buffer.indexOf('\n\n');
+    while (boundary !== -1) {
+      const block = this.buffer.slice(0, boundary);
+      this.buffer = this.buffer.slice(boundary + 2);
+      const event = parseEvent(block);
+      if (event) {
+        events.push(event);
+      }
+      boundary = this.buffer.indexOf('\n\n');
+    }
+    return events;
+  }
+}
+
+function parseEvent(block: string): StreamEvent | null {
+  let event = 'message';
+  const dataLines: string[] = [];
+  for (const line of block.split('\n')) {
+    if (line.startsWith('event:')) {
+      event = line.slice(6).trim();
+    } else if (line.startsWith('data:')) {
+      dataLines.push(line.slice(5).replace(/^ /, ''));
+    }
+  }
+  if (dataLines.length === 0) {
+    return null;
+  }
+  try {
+    return { event, data: JSON.parse(dataLines.join('\n')) };
+  } catch (e) {
+    console.error('Failed to parse stream event:', e);
+    return null;
+  }
+}